@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'payments.middleware.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'mass_payment_service.urls'
@@ -76,6 +77,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'mass_payment_service.wsgi.application'
+ASGI_APPLICATION = 'mass_payment_service.asgi.application'
 
 
 # Database
@@ -85,6 +87,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Payment workers write concurrently: take the write lock up front and
+        # wait for it instead of failing with "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -149,3 +157,110 @@ REST_FRAMEWORK = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Mass payment processing settings
+
+# Number of phone numbers resolved per IN query when validating recipients
+# (kept under SQLite's bound-parameter limit)
+MASS_PAYMENT_RESOLVER_CHUNK_SIZE = 500
+
+# Number of MassPaymentItem rows inserted per bulk INSERT
+MASS_PAYMENT_BULK_CREATE_BATCH_SIZE = 1000
+
+# Post payment items chunk by chunk with set-based writes (False: one item at a time)
+MASS_PAYMENT_BATCH_POSTING = True
+
+# Number of payment items posted per database transaction in batch mode
+MASS_PAYMENT_POSTING_CHUNK_SIZE = 500
+
+# Payment job queue (see manage.py run_payment_workers)
+PAYMENT_WORKER_CONCURRENCY = 4
+PAYMENT_WORKER_POLL_INTERVAL = 1.0
+PAYMENT_JOB_LEASE_SECONDS = 60
+PAYMENT_JOB_MAX_ATTEMPTS = 5
+PAYMENT_JOB_RETRY_BACKOFF_SECONDS = 10
+PAYMENT_JOB_MAX_BACKOFF_SECONDS = 600
+# Port of the workers' Prometheus endpoint (GET /metrics), None: not served
+PAYMENT_WORKER_METRICS_PORT = None
+
+# Split mass payments with more than MASS_PAYMENT_SHARD_SIZE pending items into shards
+# processed in parallel by the payment workers ('id_range' or 'bank')
+MASS_PAYMENT_SHARDING = True
+MASS_PAYMENT_SHARD_SIZE = 5000
+MASS_PAYMENT_SHARD_STRATEGY = 'id_range'
+
+# Send external transfers to BankProvider.api_endpoint (False: external items
+# are only debited locally)
+EXTERNAL_TRANSFER_DISPATCH = False
+
+# Per-bank circuit breaker: open after this many consecutive provider errors
+# (timeouts, connection errors, 5xx, 429) and probe again after the cooldown.
+# Items sent to an open provider are parked and retried after the cooldown,
+# up to EXTERNAL_TRANSFER_MAX_ATTEMPTS sends.
+EXTERNAL_BREAKER_FAILURE_THRESHOLD = 5
+EXTERNAL_BREAKER_COOLDOWN_SECONDS = 30
+EXTERNAL_TRANSFER_MAX_ATTEMPTS = 5
+
+# A dispatch whose providers have not all answered after this many seconds is
+# cancelled and its transfers parked, so a stuck provider cannot hang a worker
+EXTERNAL_DISPATCH_TIMEOUT_SECONDS = 600
+
+# Per-bank adaptive rate limit (requests/second): +INCREASE per success,
+# x DECREASE_FACTOR per provider error
+EXTERNAL_RATE_LIMIT_INITIAL = 20.0
+EXTERNAL_RATE_LIMIT_MIN = 1.0
+EXTERNAL_RATE_LIMIT_MAX = 200.0
+EXTERNAL_RATE_LIMIT_INCREASE = 1.0
+EXTERNAL_RATE_LIMIT_DECREASE_FACTOR = 0.5
+
+# Bank providers are cached in memory by each process; reload them at least this
+# often (seconds) to pick up changes made by other processes. 0: never expire
+BANK_PROVIDER_REGISTRY_TTL_SECONDS = 300
+
+# Rows resolved and inserted per transaction by recipient file imports
+RECIPIENT_IMPORT_CHUNK_SIZE = 1000
+
+# Where uploads imported in the background (?async=true) are spooled
+RECIPIENT_IMPORT_DIR = BASE_DIR / 'imports'
+
+# POST /mass-payments/upload/: rows inserted per chunk, invalid rows reported at most
+MASS_PAYMENT_UPLOAD_CHUNK_SIZE = 1000
+MASS_PAYMENT_UPLOAD_MAX_ERRORS = 100
+
+# Fee per payment item when no catch-all FeeSchedule tier is active
+MASS_PAYMENT_DEFAULT_FEE = '0.50'
+
+# Fee schedules are compiled and cached in memory by each process; recompile them
+# at least this often (seconds) to pick up changes made by other processes. 0: never expire
+FEE_SCHEDULE_REGISTRY_TTL_SECONDS = 300
+
+# Idempotency-Key header on the mass payment creation endpoints: stored responses
+# are replayed for this long (seconds), see manage.py purge_idempotency_keys.
+# A key whose first request has not finished after IDEMPOTENCY_KEY_LOCK_SECONDS
+# is considered abandoned and can be claimed again.
+IDEMPOTENCY_KEY_TTL_SECONDS = 86400
+IDEMPOTENCY_KEY_LOCK_SECONDS = 600
+
+# A worker processing a mass payment holds a lease on it, renewed at every
+# checkpoint (each posted chunk). The recovery scan, run by the payment workers at
+# startup and every MASS_PAYMENT_RECOVERY_INTERVAL_SECONDS, resumes payments whose
+# lease expired with no job left for them, at most MASS_PAYMENT_MAX_RECOVERIES times.
+MASS_PAYMENT_LEASE_SECONDS = 120
+MASS_PAYMENT_RECOVERY_INTERVAL_SECONDS = 60
+MASS_PAYMENT_MAX_RECOVERIES = 5
+
+# GET /mass-payments/<id>/events/ (Server-Sent Events): counters are polled every
+# MASS_PAYMENT_EVENTS_POLL_INTERVAL seconds, a keep-alive comment is sent after
+# MASS_PAYMENT_EVENTS_HEARTBEAT_SECONDS without events, and at most
+# MASS_PAYMENT_EVENTS_MAX_FAILURES failed items are sent per 'failures' event
+MASS_PAYMENT_EVENTS_POLL_INTERVAL = 1.0
+MASS_PAYMENT_EVENTS_HEARTBEAT_SECONDS = 15
+MASS_PAYMENT_EVENTS_MAX_FAILURES = 20
+
+# manage.py create_demo_data --recipients: rows inserted per bulk INSERT chunk
+DEMO_DATA_BATCH_SIZE = 5000
+
+# Return the number of SQL queries of each request in an X-DB-Query-Count header,
+# read by manage.py loadtest --url to report queries per endpoint
+QUERY_COUNT_HEADER = DEBUG
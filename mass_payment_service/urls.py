@@ -1,9 +1,11 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from payments.views.metrics_views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('payments.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
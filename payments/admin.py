@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import GroupRecipient, PaymentTemplate, RecipientGroup, TemplateRecipient, User, Account, BankProvider, Transaction, MassPayment, MassPaymentItem
+from .models import BankProviderHealth, FeeSchedule, FundsHold, IdempotencyKey, GroupRecipient, PaymentTemplate, ProcessingJob, RecipientGroup, RecipientImport, TemplateRecipient, User, Account, BankProvider, Transaction, MassPayment, MassPaymentItem
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -89,4 +89,41 @@ class GroupRecipientAdmin(admin.ModelAdmin):
     list_display = ('id', 'group', 'phone_number', 'bank_code', 'full_name', 'default_amount', 'status')
     list_filter = ('status', 'bank_code')
     search_fields = ('phone_number', 'full_name', 'group__name')
-    raw_id_fields = ('group',)
\ No newline at end of file
+    raw_id_fields = ('group',)
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job_type', 'object_id', 'status', 'attempts', 'available_at', 'lease_owner', 'lease_expires_at')
+    list_filter = ('status', 'job_type')
+    search_fields = ('lease_owner',)
+
+@admin.register(FundsHold)
+class FundsHoldAdmin(admin.ModelAdmin):
+    list_display = ('id', 'mass_payment', 'account', 'amount', 'consumed_amount', 'released_amount', 'status', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('mass_payment', 'account')
+
+@admin.register(BankProviderHealth)
+class BankProviderHealthAdmin(admin.ModelAdmin):
+    list_display = ('bank_code', 'state', 'consecutive_failures', 'open_until', 'current_rate', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('bank_code',)
+
+@admin.register(RecipientImport)
+class RecipientImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'group', 'file_name', 'status', 'rows_processed', 'rows_succeeded', 'rows_failed', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('group',)
+
+@admin.register(FeeSchedule)
+class FeeScheduleAdmin(admin.ModelAdmin):
+    list_display = ('initiator_account', 'bank_code', 'transfer_type', 'min_amount', 'flat_fee', 'percentage_fee', 'is_active', 'updated_at')
+    list_filter = ('is_active', 'transfer_type', 'bank_code')
+    ordering = ('initiator_account', 'bank_code', 'transfer_type', 'min_amount')
+    raw_id_fields = ('initiator_account',)
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'scope', 'status', 'response_status', 'mass_payment', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('key', 'scope')
+    raw_id_fields = ('mass_payment',)
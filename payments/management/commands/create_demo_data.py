@@ -1,74 +1,81 @@
-from django.core.management.base import BaseCommand
-from payments.models import User, Account, BankProvider, Transaction
-from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from payments.services.demo_data_services import DemoDataGenerator
+import time
 
 class Command(BaseCommand):
     help = 'Creates demo data for testing the mass payment service'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=None,
+                            help='Also create this many synthetic users (default: --recipients)')
+        parser.add_argument('--accounts-per-user', type=int, default=1,
+                            help='Most accounts of a synthetic user, at different banks; '
+                                 'each extra account is half as frequent (default: 1)')
+        parser.add_argument('--banks', type=int, default=3,
+                            help='Number of bank providers: the 3 demo banks, then synthetic ones')
+        parser.add_argument('--groups', type=int, default=1,
+                            help='Recipient groups of synthetic users to create')
+        parser.add_argument('--templates', type=int, default=1,
+                            help='Payment templates of synthetic users to create')
+        parser.add_argument('--recipients', type=int, default=None,
+                            help='Recipients per group, template and file (default: all the synthetic '
+                                 'users, at most 1000). Alone, also the number of users to create')
+        parser.add_argument('--files', nargs='+', choices=['csv', 'ndjson'], default=[],
+                            help='Also write the recipients as upload files next to recipients.csv')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed of the generated data')
+
     def handle(self, *args, **options):
+        users_count = options['users'] if options['users'] is not None else (options['recipients'] or 0)
+        recipients_count = options['recipients'] if options['recipients'] is not None else min(users_count, 1000)
+        if min(users_count, recipients_count, options['groups'], options['templates']) < 0:
+            raise CommandError('Counts must not be negative')
+        if options['banks'] < 1 or options['accounts_per_user'] < 1:
+            raise CommandError('--banks and --accounts-per-user must be at least 1')
+
+        generator = DemoDataGenerator(seed=options['seed'])
+        started = time.monotonic()
+
         # Create bank providers
         self.stdout.write('Creating bank providers...')
-        banks = [
-            ('SEDAD', 'Sedad Bank', 'https://api.sedad.test.com'),
-            ('BIMBANK', 'Bimbank Bank', 'https://api.bimbank.test.com'),
-            ('BANKILY', 'bankily Bank', 'https://api.bankily.test.com'),
-        ]
-        
-        for code, name, api in banks:
-            BankProvider.objects.get_or_create(
-                bank_code=code,
-                defaults={
-                    'name': name,
-                    'is_active': True,
-                    'api_endpoint': api
-                }
+        banks = generator.create_banks(options['banks'])
+
+        # Create test users and their accounts
+        self.stdout.write('Creating test users and accounts...')
+        generator.create_demo_users()
+
+        if not users_count:
+            self.stdout.write(self.style.SUCCESS('Successfully created demo data'))
+            return
+
+        self.stdout.write(f"Creating {users_count} users (up to {options['accounts_per_user']} accounts each)...")
+        users = generator.create_users(users_count, banks, options['accounts_per_user'])
+
+        for number in range(1, options['groups'] + 1):
+            group = generator.create_group(
+                f"Demo group {number} ({recipients_count} recipients)",
+                generator.sample_recipients(users, recipients_count)
             )
-        
-        # Create test users
-        self.stdout.write('Creating test users...')
-        users = [
-            ('20593670', 'Med yahya', 'Mohamed'),
-            ('42563512', 'Selemhe', 'Med salem'),
-            ('36459515', 'Aichetou', 'Mohamed'),
-            ('26456565', 'Ahmed', 'Lemine'),
-            ('26594815', 'Sidi', 'Lemine'),
-        ]
-        
-        for phone, first, last in users:
-            User.objects.get_or_create(
-                phone_number=phone,
-                defaults={
-                    'first_name': first,
-                    'last_name': last
-                }
+            self.stdout.write(f"Recipient group {group.id}: {group.name}")
+
+        for number in range(1, options['templates'] + 1):
+            template = generator.create_template(
+                f"Demo template {number} ({recipients_count} recipients)",
+                generator.sample_recipients(users, recipients_count)
             )
-        
-        # Create accounts
-        self.stdout.write('Creating accounts...')
-        Med = User.objects.get(phone_number='20593670')
-        Selemhe = User.objects.get(phone_number='42563512')
-        Aichetou = User.objects.get(phone_number='36459515')
-        Ahmed = User.objects.get(phone_number='26456565')
-        Sidi = User.objects.get(phone_number='26594815')
-        
-        accounts = [
-            (Med, 'ACC001', Decimal('10000.00'), 'SEDAD'),
-            (Selemhe, 'ACC002', Decimal('5000.00'), 'SEDAD'),
-            (Aichetou, 'ACC003', Decimal('7500.00'), 'BIMBANK'),
-            (Ahmed, 'ACC004', Decimal('3000.00'), 'BIMBANK'),
-            (Sidi, 'ACC005', Decimal('12000.00'), 'BANKILY'),
-        ]
-        
-        for user, acc_num, balance, bank_code in accounts:
-            Account.objects.get_or_create(
-                account_number=acc_num,
-                defaults={
-                    'user': user,
-                    'balance': balance,
-                    'is_active': True,
-                    'is_blocked': False,
-                    'bank_code': bank_code
-                }
+            self.stdout.write(f"Payment template {template.id}: {template.name}")
+
+        if options['files']:
+            paths = DemoDataGenerator.write_recipient_files(
+                generator.sample_recipients(users, recipients_count),
+                settings.BASE_DIR,
+                f"recipients_{recipients_count}",
+                options['files']
             )
-        
-        self.stdout.write(self.style.SUCCESS('Successfully created demo data'))
\ No newline at end of file
+            for path in paths:
+                self.stdout.write(f"Wrote {path}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully created demo data in {time.monotonic() - started:.1f}s"
+        ))
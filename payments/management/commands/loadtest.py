@@ -0,0 +1,118 @@
+from django.core.management.base import BaseCommand, CommandError
+from payments.services.load_test_services import (
+    HttpLoadTarget, LoadTestReplay, LoadTestRunner, LoadTrafficSynthesizer, TestClientLoadTarget
+)
+import json
+
+class Command(BaseCommand):
+    help = ('Sends synthetic (or replayed) API traffic at a target rate and reports latency percentiles, '
+            'throughput, error rates and SQL queries per endpoint')
+
+    DEFAULT_MIX = 'create=2,upload=1,template=1,group=1,poll=5'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Base URL of a running server (e.g. http://localhost:8000). '
+                                 'Default: requests go to this process through the Django test client')
+        parser.add_argument('--replay', default=None,
+                            help='Replay the requests of a JSON lines file ({"method", "path", "json", "data", '
+                                 '"headers", "name"} per line) instead of synthesising traffic')
+        parser.add_argument('--rps', type=float, default=10,
+                            help='Target requests per second, 0 for as fast as possible (default: 10)')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Requests in flight at most (default: 10)')
+        parser.add_argument('--requests', type=int, default=None,
+                            help='Stop after this many requests')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Stop after this many seconds (default: 30 without --requests)')
+        parser.add_argument('--mix', default=self.DEFAULT_MIX,
+                            help=f'Weights of the synthetic requests (default: {self.DEFAULT_MIX})')
+        parser.add_argument('--recipients', type=int, default=10,
+                            help='Recipients per synthetic mass payment, upload and template (default: 10)')
+        parser.add_argument('--pool', type=int, default=200,
+                            help='Accounts read through the API to draw recipients from (default: 200)')
+        parser.add_argument('--initiator', default=None,
+                            help='Initiator account number (default: the richest account of the pool)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic traffic')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Request timeout with --url (seconds)')
+        parser.add_argument('--output', default=None, help='Also write the report to this JSON file')
+
+    def parse_mix(self, mix):
+        weights = {}
+        for part in mix.split(','):
+            kind, _, weight = part.partition('=')
+            kind = kind.strip()
+            if kind not in LoadTrafficSynthesizer.KINDS:
+                raise CommandError(f"Unknown request kind '{kind}' in --mix, expected one of {', '.join(LoadTrafficSynthesizer.KINDS)}")
+            try:
+                weights[kind] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Invalid weight '{weight}' for '{kind}' in --mix")
+        if not any(weights.values()):
+            raise CommandError('--mix must give a positive weight to at least one request kind')
+        return weights
+
+    def handle(self, *args, **options):
+        if options['rps'] < 0 or options['concurrency'] < 1:
+            raise CommandError('--rps must not be negative and --concurrency must be at least 1')
+        duration = options['duration']
+        if duration is None and options['requests'] is None:
+            duration = 30
+
+        if options['url']:
+            target = HttpLoadTarget(options['url'], options['timeout'], options['concurrency'])
+        else:
+            target = TestClientLoadTarget()
+
+        try:
+            if options['replay']:
+                source = LoadTestReplay(options['replay'])
+                if not source.requests:
+                    raise CommandError(f"No request to replay in {options['replay']} ({source.skipped} lines skipped)")
+                if source.skipped:
+                    self.stdout.write(self.style.WARNING(f"Skipped {source.skipped} lines that are not requests"))
+            else:
+                mix = self.parse_mix(options['mix'])
+                pool, initiator, mass_payment_ids = LoadTrafficSynthesizer.bootstrap(
+                    target, options['pool'], options['initiator']
+                )
+                if not pool or not initiator:
+                    raise CommandError('No accounts to draw recipients from: run manage.py create_demo_data first')
+                source = LoadTrafficSynthesizer(pool, initiator, mix, options['recipients'], options['seed'])
+                source.mass_payment_ids.extend(mass_payment_ids)
+                self.stdout.write(f"Initiator {initiator}, {len(pool)} recipient accounts")
+
+            limits = [f"{options['requests']} requests" if options['requests'] else None, f"{duration}s" if duration else None]
+            self.stdout.write(
+                f"Sending {' or '.join(limit for limit in limits if limit)} at "
+                f"{options['rps'] or 'max'} rps, concurrency {options['concurrency']}..."
+            )
+            runner = LoadTestRunner(target, options['rps'], options['concurrency'])
+            elapsed = runner.run(source, options['requests'], duration)
+        finally:
+            target.close()
+
+        report = LoadTestRunner.summarize(runner.results, elapsed)
+        self.write_report(report, elapsed)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump({"elapsed_seconds": round(elapsed, 2), "endpoints": report}, output, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def write_report(self, report, elapsed):
+        width = max(len(name) for name in report)
+        self.stdout.write(
+            f"{'endpoint':<{width}} {'requests':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'rps':>7} {'queries':>8} {'q/req':>6}"
+        )
+        for name, metrics in report.items():
+            line = (
+                f"{name:<{width}} {metrics['requests']:>8} {metrics['error_rate']:>7.1%} {metrics['p50_ms']:>8} "
+                f"{metrics['p95_ms']:>8} {metrics['p99_ms']:>8} {metrics['throughput_rps']:>7} "
+                f"{metrics['queries'] if metrics['queries'] is not None else '-':>8} "
+                f"{metrics['queries_per_request'] if metrics['queries_per_request'] is not None else '-':>6}"
+            )
+            self.stdout.write(self.style.ERROR(line) if metrics['errors'] else line)
+            if metrics['errors']:
+                self.stdout.write(f"{'':<{width}} responses: {metrics['statuses']}")
+        self.stdout.write(self.style.SUCCESS(f"{report['total']['requests']} requests in {elapsed:.1f}s"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from payments.services.idempotency_services import IdempotencyService
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired idempotency keys (see IDEMPOTENCY_KEY_TTL_SECONDS)'
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyService.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from payments.services.mass_payement_services import PaymentProcessor
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the success/failure/pending counters of mass payments from their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mass-payment', type=int, action='append', dest='mass_payment_ids',
+                            help='Only reconcile this mass payment (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted counters without fixing them')
+
+    def handle(self, *args, **options):
+        fixed = PaymentProcessor.reconcile_counters(options['mass_payment_ids'], dry_run=options['dry_run'])
+
+        for mass_payment_id, (stored, counted) in sorted(fixed.items()):
+            self.stdout.write(f"Mass payment {mass_payment_id}: success/failure/pending "
+                              f"{'/'.join(map(str, stored))} -> {'/'.join(map(str, counted))}")
+
+        verb = 'would be fixed' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f"{len(fixed)} mass payments {verb}"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from payments.services.payment_recovery_services import PaymentRecovery
+
+
+class Command(BaseCommand):
+    help = 'Resumes mass payments abandoned in processing by crashed workers'
+
+    def handle(self, *args, **options):
+        recovered = PaymentRecovery.scan()
+        self.stdout.write(self.style.SUCCESS(f"Recovered {recovered} mass payments"))
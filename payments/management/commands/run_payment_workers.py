@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.services.job_queue_services import PaymentWorkerPool
+from payments.services.payment_recovery_services import PaymentRecovery
+from payments.services.processing_metrics_services import ProcessingMetrics
+from payments.tasks import JOB_HANDLERS
+import signal
+
+
+class Command(BaseCommand):
+    help = 'Runs a bounded pool of workers that process queued mass payment and recipient group jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'PAYMENT_WORKER_CONCURRENCY', 4),
+                            help='Number of worker threads')
+        parser.add_argument('--lease-seconds', type=int, default=getattr(settings, 'PAYMENT_JOB_LEASE_SECONDS', 60),
+                            help='Lease duration of a claimed job, renewed by heartbeats')
+        parser.add_argument('--poll-interval', type=float, default=getattr(settings, 'PAYMENT_WORKER_POLL_INTERVAL', 1.0),
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--job-type', action='append', dest='job_types', choices=sorted(JOB_HANDLERS),
+                            help='Only process jobs of this type (can be repeated)')
+        parser.add_argument('--drain', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever')
+        parser.add_argument('--no-recovery', action='store_true',
+                            help='Do not scan for mass payments abandoned by crashed workers')
+        parser.add_argument('--recovery-interval', type=float,
+                            default=getattr(settings, 'MASS_PAYMENT_RECOVERY_INTERVAL_SECONDS', 60),
+                            help='Seconds between two recovery scans')
+        parser.add_argument('--metrics-port', type=int, default=getattr(settings, 'PAYMENT_WORKER_METRICS_PORT', None),
+                            help='Serve the processing timings in the Prometheus format on this port (GET /metrics)')
+
+    def handle(self, *args, **options):
+        pool = PaymentWorkerPool(
+            handlers=JOB_HANDLERS,
+            concurrency=options['workers'],
+            lease_seconds=options['lease_seconds'],
+            poll_interval=options['poll_interval'],
+            job_types=options['job_types'],
+            recovery=None if options['no_recovery'] else PaymentRecovery.scan,
+            recovery_interval=options['recovery_interval']
+        )
+
+        # Finish the jobs in progress before exiting
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping workers after their current job...')
+            pool.stop()
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        if options['metrics_port']:
+            ProcessingMetrics.serve(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        self.stdout.write(f"Starting {options['workers']} payment workers...")
+        pool.run(drain=options['drain'])
+        self.stdout.write(self.style.SUCCESS('Payment workers stopped'))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from payments.models import BankProvider
+from payments.services.bank_provider_registry_services import BankProviderRegistry
+from payments.stub_bank import StubBankServer
+
+
+class Command(BaseCommand):
+    help = 'Runs a local stub bank provider API for testing external transfers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to wait before answering each request')
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help='Share of transfers rejected at random (0 to 1)')
+        parser.add_argument('--no-batch', action='store_true',
+                            help='Reject the batch endpoint')
+        parser.add_argument('--reject', nargs='*', default=[],
+                            help='Phone numbers whose transfers are always rejected')
+        parser.add_argument('--unavailable', action='store_true',
+                            help='Answer every request with a 503 (provider outage)')
+        parser.add_argument('--bank-code', action='append', dest='bank_codes', default=[],
+                            help='Point this BankProvider at the stub (can be repeated)')
+        parser.add_argument('--verbose', action='store_true')
+
+    def handle(self, *args, **options):
+        server = StubBankServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            supports_batch=not options['no_batch'],
+            reject_phone_numbers=options['reject'],
+            unavailable=options['unavailable'],
+            verbose=options['verbose']
+        )
+
+        for bank_code in options['bank_codes']:
+            updated = BankProvider.objects.filter(bank_code=bank_code).update(
+                api_endpoint=server.url,
+                supports_batch=not options['no_batch']
+            )
+            if not updated:
+                self.stdout.write(self.style.WARNING(f"Bank provider {bank_code} not found"))
+        BankProviderRegistry.invalidate()
+
+        self.stdout.write(f"Stub bank listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
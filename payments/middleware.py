@@ -0,0 +1,60 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries it sees
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryCountMiddleware:
+    """
+    Counts the SQL queries run while handling a request and returns the
+    count in an X-DB-Query-Count header, so load tests against a running
+    server can report database work per endpoint. Only installed when the
+    QUERY_COUNT_HEADER setting is on at startup; runs under WSGI and ASGI.
+    Queries run while a streamed response is read are not counted.
+    """
+    HEADER = 'X-DB-Query-Count'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_COUNT_HEADER', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        response[self.HEADER] = str(counter.count)
+        return response
+
+    async def __acall__(self, request):
+        # Connections are per thread: queries of an ASGI request run in its
+        # thread-sensitive sync_to_async thread, so the counter goes there
+        counter = QueryCounter()
+        await sync_to_async(lambda: connection.execute_wrappers.append(counter))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(counter))()
+        response[self.HEADER] = str(counter.count)
+        return response
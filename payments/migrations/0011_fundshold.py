@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:03
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_processingjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processingjob',
+            name='job_type',
+            field=models.CharField(choices=[('mass_payment', 'Mass Payment'), ('recipient_group', 'Recipient Group'), ('mass_payment_shard', 'Mass Payment Shard')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='FundsHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('consumed_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('released_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('settled', 'Settled'), ('released', 'Released')], default='active', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='payments.account')),
+                ('mass_payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='funds_hold', to='payments.masspayment')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_fundshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bankprovider',
+            name='max_batch_size',
+            field=models.PositiveIntegerField(default=100),
+        ),
+        migrations.AddField(
+            model_name='bankprovider',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='bankprovider',
+            name='supports_batch',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='bankprovider',
+            name='timeout_seconds',
+            field=models.FloatField(default=10.0),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_bankprovider_dispatch_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankProviderHealth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bank_code', models.CharField(max_length=10, unique=True)),
+                ('state', models.CharField(choices=[('closed', 'Closed'), ('open', 'Open'), ('half_open', 'Half Open')], default='closed', max_length=10)),
+                ('consecutive_failures', models.PositiveIntegerField(default=0)),
+                ('open_until', models.DateTimeField(blank=True, null=True)),
+                ('current_rate', models.FloatField(default=0.0)),
+                ('last_failure_reason', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='masspaymentitem',
+            name='dispatch_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='masspaymentitem',
+            name='next_dispatch_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='processingjob',
+            name='job_type',
+            field=models.CharField(choices=[('mass_payment', 'Mass Payment'), ('recipient_group', 'Recipient Group'), ('mass_payment_shard', 'Mass Payment Shard'), ('external_retry', 'External Transfer Retry')], max_length=30),
+        ),
+    ]
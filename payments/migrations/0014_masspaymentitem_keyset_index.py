@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_bank_provider_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='masspaymentitem',
+            index=models.Index(fields=['mass_payment', 'status', 'id'], name='payments_ma_mass_pa_0a5f54_idx'),
+        ),
+    ]
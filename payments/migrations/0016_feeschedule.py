@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:21
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0015_recipientimport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bank_code', models.CharField(blank=True, default='', max_length=10)),
+                ('min_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('flat_fee', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15)),
+                ('percentage_fee', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=5)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
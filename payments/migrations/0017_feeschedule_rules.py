@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0016_feeschedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feeschedule',
+            name='initiator_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fee_schedules', to='payments.account'),
+        ),
+        migrations.AddField(
+            model_name='feeschedule',
+            name='transfer_type',
+            field=models.CharField(choices=[('any', 'Any'), ('internal', 'Internal'), ('external', 'External')], default='any', max_length=10),
+        ),
+    ]
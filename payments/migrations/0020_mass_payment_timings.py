@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0019_mass_payment_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masspayment',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 from decimal import Decimal
 
@@ -17,11 +18,34 @@ class BankProvider(models.Model):
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
     api_endpoint = models.URLField(max_length=255)
+    max_concurrency = models.PositiveIntegerField(default=10)  # Simultaneous requests to the provider
+    supports_batch = models.BooleanField(default=False)  # Accepts several transfers per request
+    max_batch_size = models.PositiveIntegerField(default=100)
+    timeout_seconds = models.FloatField(default=10.0)
     
     def __str__(self):
         return self.name
 
 
+class BankProviderHealth(models.Model):
+    STATE_CHOICES = [
+        ('closed', 'Closed'),
+        ('open', 'Open'),
+        ('half_open', 'Half Open'),
+    ]
+
+    bank_code = models.CharField(max_length=10, unique=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='closed')
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    open_until = models.DateTimeField(null=True, blank=True)
+    current_rate = models.FloatField(default=0.0)  # Requests per second allowed by the rate limiter
+    last_failure_reason = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.bank_code} - {self.state}"
+
+
 class Account(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='accounts')
     account_number = models.CharField(max_length=30, unique=True)
@@ -81,6 +105,12 @@ class MassPayment(models.Model):
     success_count = models.IntegerField(default=0)
     failure_count = models.IntegerField(default=0)
     pending_count = models.IntegerField(default=0)
+    lease_owner = models.CharField(max_length=100, blank=True, default='')  # Worker processing the payment
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # Renewed at every checkpoint
+    checkpoint_item_id = models.BigIntegerField(default=0)  # Items up to this id have been posted
+    checkpoint_at = models.DateTimeField(null=True, blank=True)
+    recovery_count = models.PositiveIntegerField(default=0)  # Times resumed by the recovery scan
+    timings = models.JSONField(default=dict, blank=True)  # Seconds spent per processing stage, see StageTimer
     
     def __str__(self):
         return f"Mass Payment {self.reference_code} - {self.status}"
@@ -103,11 +133,91 @@ class MassPaymentItem(models.Model):
     transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='mass_payment_item')
     fee_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     failure_reason = models.TextField(blank=True, null=True)
+    dispatch_attempts = models.PositiveIntegerField(default=0)  # Sends to an external bank provider
+    next_dispatch_at = models.DateTimeField(null=True, blank=True)  # Set while parked for a later retry
+
+    class Meta:
+        indexes = [
+            # Keyset scans of a payment's items, optionally by status, in id order
+            models.Index(fields=['mass_payment', 'status', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.destination_phone_number} - {self.amount} - {self.status}"
     
 
+class FundsHold(models.Model):
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('settled', 'Settled'),
+        ('released', 'Released'),
+    ]
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='holds')
+    mass_payment = models.OneToOneField(MassPayment, on_delete=models.CASCADE, related_name='funds_hold')
+    amount = models.DecimalField(max_digits=15, decimal_places=2)  # Reserved (already taken from the balance)
+    consumed_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    released_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Hold {self.amount} on {self.account.account_number} - {self.status}"
+
+
+class FeeSchedule(models.Model):
+    """
+    One tier of a fee schedule: items of `min_amount` or more, up to the next
+    tier of the same schedule, pay flat_fee + percentage_fee % of their amount.
+    A schedule is the set of tiers sharing an initiator account, a destination
+    bank and a transfer type; empty values match anything, and the most
+    specific schedule matching an item prices it.
+    """
+    TRANSFER_TYPE_CHOICES = [
+        ('any', 'Any'),
+        ('internal', 'Internal'),  # Destination in the initiator's bank
+        ('external', 'External'),
+    ]
+
+    initiator_account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, blank=True, related_name='fee_schedules')  # Empty: any initiator
+    bank_code = models.CharField(max_length=10, blank=True, default='')  # Empty: any destination bank
+    transfer_type = models.CharField(max_length=10, choices=TRANSFER_TYPE_CHOICES, default='any')
+    min_amount = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    flat_fee = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    percentage_fee = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))  # 1.25 = 1.25 %
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return (f"{self.bank_code or 'All banks'} ({self.transfer_type}) from {self.min_amount}: "
+                f"{self.flat_fee} + {self.percentage_fee}%")
+
+
+class IdempotencyKey(models.Model):
+    STATUS_CHOICES = [
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+    ]
+
+    scope = models.CharField(max_length=30, blank=True, default='')  # Initiator account number the key belongs to
+    key = models.CharField(max_length=255)  # Idempotency-Key header
+    request_fingerprint = models.CharField(max_length=64)  # SHA-256 of the method, URL and body
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='processing')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    mass_payment = models.ForeignKey(MassPayment, on_delete=models.SET_NULL, null=True, blank=True, related_name='idempotency_keys')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+    def __str__(self):
+        return f"{self.scope}/{self.key} - {self.status}"
+
+
 class PaymentTemplate(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, on_delete=models.CASCADE,null=True, related_name='payment_templates')
@@ -179,4 +289,71 @@ class GroupRecipient(models.Model):
         return f"{self.full_name} ({self.phone_number}) - {self.group.name}"
     
     class Meta:
-        unique_together = ('group', 'phone_number', 'bank_code')
\ No newline at end of file
+        unique_together = ('group', 'phone_number', 'bank_code')
+
+
+class RecipientImport(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    group = models.ForeignKey(RecipientGroup, on_delete=models.CASCADE, related_name='imports')
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)  # Spooled upload, deleted once imported
+    file_size = models.PositiveBigIntegerField(default=0)
+    bytes_processed = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_succeeded = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    failure_report_path = models.CharField(max_length=500, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import {self.id} of {self.file_name} - {self.status}"
+
+
+class ProcessingJob(models.Model):
+    JOB_TYPES = [
+        ('mass_payment', 'Mass Payment'),
+        ('recipient_group', 'Recipient Group'),
+        ('mass_payment_shard', 'Mass Payment Shard'),
+        ('external_retry', 'External Transfer Retry'),
+        ('recipient_import', 'Recipient Import'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    job_type = models.CharField(max_length=30, choices=JOB_TYPES)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)  # Not claimable before this (retry backoff)
+    lease_owner = models.CharField(max_length=100, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.job_type} #{self.object_id} - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MassPaymentItemCursorPagination(CursorPagination):
+    """
+    Keyset pagination of mass payment items on their id: each page is a
+    WHERE id > cursor query, so late pages cost the same as the first one.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
@@ -1,5 +1,8 @@
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from ..models import GroupRecipient, PaymentTemplate, RecipientGroup, TemplateRecipient, User, Account, BankProvider, Transaction, MassPayment, MassPaymentItem
+from ..models import GroupRecipient, PaymentTemplate, RecipientImport, RecipientGroup, TemplateRecipient, User, Account, BankProvider, Transaction, MassPayment, MassPaymentItem
 
 
 class GroupRecipientSerializer(serializers.ModelSerializer):
@@ -9,15 +12,53 @@ class GroupRecipientSerializer(serializers.ModelSerializer):
 
 
 class RecipientGroupListSerializer(serializers.ModelSerializer):
-    recipient_count = serializers.SerializerMethodField()
-    recipients = GroupRecipientSerializer(many=True, required=False)
+    """
+    Group list rows. The counts come from annotations (see annotate_queryset());
+    the totals and the nested recipients are only rendered when the context
+    asks for them ('include_totals', 'include_recipients').
+    """
+    recipient_count = serializers.IntegerField(read_only=True)
+    total_default_amount = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    recipients_by_status = serializers.SerializerMethodField()
+    recipients = GroupRecipientSerializer(many=True, read_only=True)
     
     class Meta:
         model = RecipientGroup
-        fields = ['id', 'name', 'is_active', 'created_at', 'recipient_count', 'recipients', 'status']
-    
-    def get_recipient_count(self, obj):
-        return obj.recipients.count()
+        fields = [
+            'id', 'name', 'is_active', 'created_at', 'recipient_count', 'total_default_amount',
+            'recipients_by_status', 'recipients', 'status',
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('include_totals'):
+            self.fields.pop('total_default_amount')
+            self.fields.pop('recipients_by_status')
+        if not self.context.get('include_recipients'):
+            self.fields.pop('recipients')
+
+    @staticmethod
+    def annotate_queryset(queryset, include_totals=False, include_recipients=False):
+        """
+        Add the aggregates rendered by this serializer to a RecipientGroup
+        queryset, so that a page of groups costs the same number of queries
+        whatever the size of the groups
+        """
+        aggregates = {"recipient_count": Count('recipients')}
+        if include_totals:
+            aggregates["total_default_amount"] = Sum('recipients__default_amount')
+            for status, _ in GroupRecipient.STATUS_CHOICES:
+                aggregates[f"{status}_recipient_count"] = Count('recipients', filter=Q(recipients__status=status))
+        queryset = queryset.annotate(**aggregates)
+        if include_recipients:
+            queryset = queryset.prefetch_related('recipients')
+        return queryset
+
+    def get_recipients_by_status(self, obj):
+        return {
+            status: getattr(obj, f"{status}_recipient_count")
+            for status, _ in GroupRecipient.STATUS_CHOICES
+        }
 
 
 class RecipientGroupDetailSerializer(serializers.ModelSerializer):
@@ -82,4 +123,54 @@ class CreateMassPaymentFromGroupSerializer(serializers.Serializer):
     reference = serializers.CharField(required=False, allow_blank=True, max_length=50)
 
 class UploadRecipientsCSVSerializer(serializers.Serializer):
-    file = serializers.FileField()
\ No newline at end of file
+    file = serializers.FileField()
+
+
+class RecipientImportSerializer(serializers.ModelSerializer):
+    progress_percentage = serializers.SerializerMethodField()
+    rows_per_second = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+    failure_report_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RecipientImport
+        fields = [
+            'id', 'group', 'file_name', 'file_size', 'status', 'rows_processed',
+            'rows_succeeded', 'rows_failed', 'progress_percentage', 'rows_per_second',
+            'eta_seconds', 'failure_report_url', 'error', 'started_at', 'finished_at', 'created_at',
+        ]
+
+    def _elapsed(self, obj):
+        if obj.started_at is None:
+            return None
+        return ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+
+    def get_progress_percentage(self, obj):
+        # Measured on the bytes read, the row count is only known at the end
+        if obj.status == 'completed':
+            return 100.0
+        if not obj.file_size:
+            return 0.0
+        return round(min(obj.bytes_processed, obj.file_size) / obj.file_size * 100, 1)
+
+    def get_rows_per_second(self, obj):
+        elapsed = self._elapsed(obj)
+        if not elapsed:
+            return None
+        return round(obj.rows_processed / elapsed, 1)
+
+    def get_eta_seconds(self, obj):
+        if obj.status == 'completed':
+            return 0
+        elapsed = self._elapsed(obj)
+        if obj.status != 'running' or not elapsed or not obj.bytes_processed:
+            return None
+        remaining = max(obj.file_size - obj.bytes_processed, 0)
+        return round(elapsed * remaining / obj.bytes_processed, 1)
+
+    def get_failure_report_url(self, obj):
+        if not obj.rows_failed or not obj.failure_report_path:
+            return None
+        url = reverse('recipientgroup-import-failures', kwargs={'pk': obj.group_id, 'job_id': obj.id})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -1,5 +1,8 @@
+from django.db.models import Count, Sum
 from rest_framework import serializers
 from ..models import  User, Account, BankProvider, MassPayment, MassPaymentItem
+from ..services.bank_provider_registry_services import BankProviderRegistry
+from ..services.recipient_resolver_services import RecipientResolver
 
 
 
@@ -8,43 +11,44 @@ class MassPaymentItemCreateSerializer(serializers.Serializer):
     bank_code = serializers.CharField(max_length=10)
     amount = serializers.DecimalField(max_digits=15, decimal_places=2)
 
+
+class MassPaymentCreateSerializer(serializers.Serializer):
+    initiator_account_number = serializers.CharField(max_length=30)
+    recipients = MassPaymentItemCreateSerializer(many=True)
+    description = serializers.CharField(required=False, allow_blank=True)
+    reference = serializers.CharField(required=False, allow_blank=True, max_length=50)
+
     def validate(self, data):
         """
-        Validate that the phone_number belongs to a User and has an active Account.
+        Validate that every phone_number belongs to a User with an active Account,
+        resolving the whole recipient list at once.
         """
-        phone_number = data.get('phone_number')
-        bank_code = data.get('bank_code')
-
-        try:
-            # Find the user by phone_number
-            user = User.objects.get(phone_number=phone_number)
-        except User.DoesNotExist:
-            raise serializers.ValidationError(
-                {"phone_number": "No user found with the provided phone number."}
-            )
-
-        try:
-            # Find the active account for the user with the specified bank_code
-            destination_account = Account.objects.get(
-                user=user,
-                bank_code=bank_code,
-                is_active=True,
-                is_blocked=False
-            )
-        except Account.DoesNotExist:
-            raise serializers.ValidationError(
-                {"bank_code": "No active account found for the user with the provided bank code."}
-            )
-
-        # Add the destination_account to the validated data
-        data['destination_account'] = destination_account
+        recipients = data['recipients']
+        accounts, failures = RecipientResolver.resolve(
+            (recipient['phone_number'], recipient['bank_code']) for recipient in recipients
+        )
+
+        if failures:
+            # Report errors per recipient, in the same shape as nested serializer errors
+            errors = [{} for _ in recipients]
+            for index, failure in failures.items():
+                errors[index] = {failure['field']: [failure['error']]}
+            raise serializers.ValidationError({"recipients": errors})
+
+        # Add the destination_account to each recipient's validated data
+        for recipient in recipients:
+            recipient['destination_account'] = accounts[(recipient['phone_number'], recipient['bank_code'])]
 
         return data
 
 
-class MassPaymentCreateSerializer(serializers.Serializer):
+class MassPaymentUploadSerializer(serializers.Serializer):
+    """
+    Mass payment from a recipients file (columns phone_number, amount and
+    optionally bank_code; any format read by RecipientFileReader)
+    """
+    file = serializers.FileField()
     initiator_account_number = serializers.CharField(max_length=30)
-    recipients = MassPaymentItemCreateSerializer(many=True)
     description = serializers.CharField(required=False, allow_blank=True)
     reference = serializers.CharField(required=False, allow_blank=True, max_length=50)
 
@@ -60,11 +64,14 @@ class MassPaymentItemDetailSerializer(serializers.ModelSerializer):
         ]
     
     def get_bank_name(self, obj):
-        try:
-            bank = BankProvider.objects.get(bank_code=obj.destination_bank_code)
-            return bank.name
-        except BankProvider.DoesNotExist:
+        return self.bank_name_for(obj.destination_bank_code)
+
+    @staticmethod
+    def bank_name_for(bank_code):
+        bank = BankProviderRegistry.get(bank_code)
+        if bank is None:
             return "Unknown Bank"
+        return bank.name
 
 
 class MassPaymentListSerializer(serializers.ModelSerializer):
@@ -76,20 +83,49 @@ class MassPaymentListSerializer(serializers.ModelSerializer):
         ]
 
 
-class MassPaymentDetailSerializer(serializers.ModelSerializer):
-    items = MassPaymentItemDetailSerializer(many=True, read_only=True)
+class MassPaymentSummarySerializer(serializers.ModelSerializer):
+    """
+    Mass payment detail with aggregates of its items instead of the items
+    themselves (see /mass-payments/{id}/items/)
+    """
     initiator_account_number = serializers.SerializerMethodField()
-   
+    items_summary = serializers.SerializerMethodField()
+
     class Meta:
         model = MassPayment
         fields = [
             'id', 'reference_code', 'initiator_account_number', 'status',
             'total_amount', 'fee_amount', 'success_count', 'failure_count',
-            'pending_count', 'created_at', 'updated_at', 'description', 'items',
+            'pending_count', 'created_at', 'updated_at', 'description', 'items_summary', 'timings',
         ]
-    
+
+    def get_items_summary(self, obj):
+        # Render sums like the amount fields
+        amount = serializers.DecimalField(max_digits=15, decimal_places=2).to_representation
+        items = obj.items.order_by()
+        by_status = {
+            row['status']: {"count": row['count'], "amount": amount(row['amount'])}
+            for row in items.values('status').annotate(count=Count('id'), amount=Sum('amount'))
+        }
+        by_bank = {
+            row['destination_bank_code']: {"count": row['count'], "amount": amount(row['amount'])}
+            for row in items.values('destination_bank_code').annotate(count=Count('id'), amount=Sum('amount'))
+        }
+        return {
+            "count": sum(row['count'] for row in by_status.values()),
+            "by_status": by_status,
+            "by_bank": by_bank,
+        }
+
     def get_initiator_account_number(self, obj):
         return obj.initiator_account.account_number
+
+
+class MassPaymentDetailSerializer(MassPaymentSummarySerializer):
+    items = MassPaymentItemDetailSerializer(many=True, read_only=True)
+   
+    class Meta(MassPaymentSummarySerializer.Meta):
+        fields = MassPaymentSummarySerializer.Meta.fields + ['items']
     
     def get_contains_external_transfers(self, obj):
         bank_code = obj.initiator_account.bank_code
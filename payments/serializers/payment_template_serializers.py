@@ -1,3 +1,4 @@
+from django.db.models import Count, Sum
 from rest_framework import serializers
 from ..models import PaymentTemplate, TemplateRecipient
 
@@ -10,15 +11,32 @@ class TemplateRecipientSerializer(serializers.ModelSerializer):
 
 
 class PaymentTemplateListSerializer(serializers.ModelSerializer):
-    recipient_count = serializers.SerializerMethodField()
-    
+    """
+    Template list rows. recipient_count comes from an annotation (see
+    annotate_queryset()); total_default_amount is only rendered when the
+    context asks for it ('include_totals').
+    """
+    recipient_count = serializers.IntegerField(read_only=True)
+    total_default_amount = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
     
     class Meta:
         model = PaymentTemplate
-        fields = ['id', 'name', 'is_active', 'created_at', 'recipient_count']
-    
-    def get_recipient_count(self, obj):
-        return obj.recipients.count()
+        fields = ['id', 'name', 'is_active', 'created_at', 'recipient_count', 'total_default_amount']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('include_totals'):
+            self.fields.pop('total_default_amount')
+
+    @staticmethod
+    def annotate_queryset(queryset, include_totals=False):
+        """
+        Add the aggregates rendered by this serializer to a PaymentTemplate queryset
+        """
+        aggregates = {"recipient_count": Count('recipients')}
+        if include_totals:
+            aggregates["total_default_amount"] = Sum('recipients__default_amount')
+        return queryset.annotate(**aggregates)
 
 
 class PaymentTemplateDetailSerializer(serializers.ModelSerializer):
@@ -41,8 +59,9 @@ class PaymentTemplateCreateUpdateSerializer(serializers.ModelSerializer):
         recipients_data = validated_data.pop('recipients')
         template = PaymentTemplate.objects.create(**validated_data)
         
-        for recipient_data in recipients_data:
-            TemplateRecipient.objects.create(template=template, **recipient_data)
+        TemplateRecipient.objects.bulk_create([
+            TemplateRecipient(template=template, **recipient_data) for recipient_data in recipients_data
+        ])
         
         return template
     
@@ -59,8 +78,9 @@ class PaymentTemplateCreateUpdateSerializer(serializers.ModelSerializer):
             instance.recipients.all().delete()
             
             # Create new recipients
-            for recipient_data in recipients_data:
-                TemplateRecipient.objects.create(template=instance, **recipient_data)
+            TemplateRecipient.objects.bulk_create([
+                TemplateRecipient(template=instance, **recipient_data) for recipient_data in recipients_data
+            ])
         
         return instance
 
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from ..models import User, Account, BankProvider, Transaction
+from ..models import User, Account, BankProvider, BankProviderHealth, Transaction
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,6 +13,12 @@ class BankProviderSerializer(serializers.ModelSerializer):
         fields = ['id', 'bank_code', 'name', 'is_active', 'api_endpoint']
 
 
+class BankProviderHealthSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BankProviderHealth
+        fields = ['bank_code', 'state', 'consecutive_failures', 'open_until', 'current_rate', 'last_failure_reason', 'updated_at']
+
+
 class AccountSerializer(serializers.ModelSerializer):
     user_details = UserSerializer(source='user', read_only=True)
 
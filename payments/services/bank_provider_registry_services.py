@@ -0,0 +1,66 @@
+from django.conf import settings
+from ..models import BankProvider
+from .services import logger
+import threading
+import time
+
+
+class BankProviderRegistry:
+    """
+    Process-local cache of the BankProvider table, keyed by bank_code.
+
+    The table is small and rarely changes, so it is loaded once and kept in
+    memory. post_save/post_delete signals on BankProvider clear it; other
+    processes pick changes up after BANK_PROVIDER_REGISTRY_TTL_SECONDS
+    (0 or None: no expiry). Bulk .update() calls bypass the signals and must
+    call invalidate() themselves.
+    """
+    _cache = None  # (providers by bank_code, load time)
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load(cls):
+        ttl = getattr(settings, 'BANK_PROVIDER_REGISTRY_TTL_SECONDS', 300)
+        cache = cls._cache
+        if cache is not None and (not ttl or time.monotonic() - cache[1] < ttl):
+            return cache[0]
+
+        with cls._lock:
+            # Another thread may have reloaded it while we waited
+            if cls._cache is not None and cls._cache is not cache:
+                return cls._cache[0]
+
+            providers = {provider.bank_code: provider for provider in BankProvider.objects.all()}
+            cls._cache = (providers, time.monotonic())
+            logger.debug(f"Loaded {len(providers)} bank providers")
+            return providers
+
+    @classmethod
+    def get(cls, bank_code, active_only=False):
+        """
+        Return the provider of a bank code, or None
+        """
+        provider = cls._load().get(bank_code)
+        if provider is None or (active_only and not provider.is_active):
+            return None
+        return provider
+
+    @classmethod
+    def get_many(cls, bank_codes, active_only=False):
+        """
+        Return {bank_code: provider} for the known bank codes among `bank_codes`
+        """
+        providers = cls._load()
+        return {
+            bank_code: providers[bank_code]
+            for bank_code in set(bank_codes)
+            if bank_code in providers and (providers[bank_code].is_active or not active_only)
+        }
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drop the cached providers; the next lookup reloads them
+        """
+        with cls._lock:
+            cls._cache = None
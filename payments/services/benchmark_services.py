@@ -0,0 +1,96 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pathlib import Path
+import json
+import time
+import tracemalloc
+
+
+class EndpointBenchmark:
+    """
+    Measures API requests made with a Django test client: number of SQL
+    queries (CaptureQueriesContext), wall time and peak Python memory
+    (tracemalloc, which also slows the request down: compare wall times only
+    with runs measured the same way).
+    Results can be saved to a JSON baseline, keyed by dataset scale, that
+    later runs are compared against.
+    """
+    METRICS = ('queries', 'wall_ms', 'peak_kb')
+    # Smaller differences are noise, whatever the tolerance
+    NOISE = {'queries': 0, 'wall_ms': 25, 'peak_kb': 256}
+
+    def __init__(self, client):
+        self.client = client
+        self.results = {}
+        self.queries = {}  # SQL of each request, to diagnose budget overruns
+
+    def measure(self, name, method, path, data=None, items=1, **extra):
+        """
+        Make one request and record its metrics under `name`. `items` is the
+        number of rows the request works on, for queries_per_item.
+        Returns (response, metrics).
+        """
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(path, data, **extra)
+                if response.streaming:
+                    # Streamed responses run their queries while being read
+                    for _ in response.streaming_content:
+                        pass
+            wall_ms = (time.perf_counter() - started) * 1000
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        metrics = {
+            "status": response.status_code,
+            "queries": len(queries),
+            "wall_ms": round(wall_ms, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "items": items,
+            "queries_per_item": round(len(queries) / items, 4) if items else None,
+        }
+        self.results[name] = metrics
+        self.queries[name] = [query['sql'] for query in queries.captured_queries]
+        return response, metrics
+
+    @staticmethod
+    def load_baseline(path, scale):
+        """
+        Metrics recorded for `scale` in the baseline file, or None
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text()).get(str(scale))
+
+    @staticmethod
+    def save_baseline(path, scale, results):
+        """
+        Record `results` as the baseline of `scale`, keeping other scales
+        """
+        path = Path(path)
+        baselines = json.loads(path.read_text()) if path.exists() else {}
+        baselines[str(scale)] = dict(sorted(results.items()))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(dict(sorted(baselines.items(), key=lambda item: int(item[0]))), indent=2) + "\n")
+
+    @staticmethod
+    def compare(results, baseline, tolerance=0.5):
+        """
+        Compare results with a baseline. Returns {metric: [messages]} for
+        every endpoint doing more queries than its baseline, or taking more
+        than (1 + tolerance) times its baseline wall time or peak memory.
+        """
+        regressions = {metric: [] for metric in EndpointBenchmark.METRICS}
+        for name, metrics in sorted(results.items()):
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            for metric in EndpointBenchmark.METRICS:
+                limit = expected[metric] if metric == 'queries' else expected[metric] * (1 + tolerance)
+                if metrics[metric] > limit and metrics[metric] - expected[metric] > EndpointBenchmark.NOISE[metric]:
+                    regressions[metric].append(f"{name}: {metric} {metrics[metric]} > baseline {expected[metric]}")
+        return regressions
@@ -0,0 +1,117 @@
+from django.conf import settings
+import asyncio
+import time
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+    closed: requests flow; `failure_threshold` consecutive provider errors open it.
+    open: requests are refused until `cooldown_seconds` have passed.
+    half_open: a single probe request is let through; success closes the
+    breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=None, cooldown_seconds=None):
+        self.failure_threshold = failure_threshold or getattr(settings, 'EXTERNAL_BREAKER_FAILURE_THRESHOLD', 5)
+        self.cooldown_seconds = cooldown_seconds or getattr(settings, 'EXTERNAL_BREAKER_COOLDOWN_SECONDS', 30)
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_failure_reason = None
+        self._probe_in_flight = False
+
+    def allow(self):
+        """
+        Whether a request may be sent now
+        """
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.state = 'half_open'
+
+        if self.state == 'half_open':
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+
+        return True
+
+    @property
+    def probing(self):
+        """
+        Whether the half-open probe is still waiting for its answer
+        """
+        return self.state == 'half_open' and self._probe_in_flight
+
+    def record_success(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, reason=None):
+        self.consecutive_failures += 1
+        self.last_failure_reason = reason
+        if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def trip(self, retry_in, reason=None):
+        """
+        Open the breaker for `retry_in` seconds, e.g. when another process
+        reported the provider down
+        """
+        self.state = 'open'
+        self.opened_at = time.monotonic() - max(0.0, self.cooldown_seconds - retry_in)
+        self.last_failure_reason = reason
+        self._probe_in_flight = False
+
+    def retry_in(self):
+        """
+        Seconds until the breaker lets a request through again
+        """
+        if self.state != 'open':
+            return 0
+        return max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts with AIMD: every success adds
+    `increase` requests/second, every provider error or throttling response
+    multiplies the rate by `decrease_factor`.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None, increase=None, decrease_factor=None):
+        self.rate = initial_rate or getattr(settings, 'EXTERNAL_RATE_LIMIT_INITIAL', 20.0)
+        self.min_rate = min_rate or getattr(settings, 'EXTERNAL_RATE_LIMIT_MIN', 1.0)
+        self.max_rate = max_rate or getattr(settings, 'EXTERNAL_RATE_LIMIT_MAX', 200.0)
+        self.increase = increase or getattr(settings, 'EXTERNAL_RATE_LIMIT_INCREASE', 1.0)
+        self.decrease_factor = decrease_factor or getattr(settings, 'EXTERNAL_RATE_LIMIT_DECREASE_FACTOR', 0.5)
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        # Bursts are capped at one second worth of requests
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """
+        Wait until a request may be sent
+        """
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_failure(self):
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
@@ -0,0 +1,262 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from pathlib import Path
+from ..models import Account, BankProvider, GroupRecipient, PaymentTemplate, RecipientGroup, TemplateRecipient, User
+from .recipient_resolver_services import chunked
+from .services import logger
+import csv
+import json
+import random
+
+
+class DemoDataGenerator:
+    """
+    Generates synthetic banks, users, accounts, recipient groups and payment
+    templates at any scale, with bulk INSERTs in chunks of
+    DEMO_DATA_BATCH_SIZE rows, so millions of accounts take minutes.
+
+    Distributions follow the Mauritanian market: 8-digit mobile numbers
+    whose prefix follows the operators' shares, bank market shares
+    decreasing with rank (the demo banks first), most users with a single
+    account, log-normal balances and payment amounts. The same seed always
+    generates the same data, and running it again only adds what is missing.
+    """
+    BANKS = [
+        ('SEDAD', 'Sedad Bank', 'https://api.sedad.test.com'),
+        ('BIMBANK', 'Bimbank Bank', 'https://api.bimbank.test.com'),
+        ('BANKILY', 'bankily Bank', 'https://api.bankily.test.com'),
+    ]
+    USERS = [
+        ('20593670', 'Med yahya', 'Mohamed'),
+        ('42563512', 'Selemhe', 'Med salem'),
+        ('36459515', 'Aichetou', 'Mohamed'),
+        ('26456565', 'Ahmed', 'Lemine'),
+        ('26594815', 'Sidi', 'Lemine'),
+    ]
+    ACCOUNTS = [
+        ('20593670', 'ACC001', Decimal('10000.00'), 'SEDAD'),
+        ('42563512', 'ACC002', Decimal('5000.00'), 'SEDAD'),
+        ('36459515', 'ACC003', Decimal('7500.00'), 'BIMBANK'),
+        ('26456565', 'ACC004', Decimal('3000.00'), 'BIMBANK'),
+        ('26594815', 'ACC005', Decimal('12000.00'), 'BANKILY'),
+    ]
+    # Share of mobile numbers by first digit (operator)
+    PHONE_PREFIXES = {4: 0.45, 3: 0.35, 2: 0.20}
+    FIRST_NAMES = ['Mohamed', 'Ahmed', 'Sidi', 'Aichetou', 'Fatimetou', 'Mariem', 'Cheikh', 'Khadijetou', 'Brahim', 'Zeinabou']
+    LAST_NAMES = ['Lemine', 'Mohamed', 'Salem', 'Vall', 'Ely', 'Abdallahi', 'Cheikh', 'Moctar']
+    MOTIVES = ['Salaire', 'Prime', 'Remboursement', 'Indemnité', '']
+
+    def __init__(self, seed=0, batch_size=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size or getattr(settings, 'DEMO_DATA_BATCH_SIZE', 5000)
+
+    def create_demo_users(self):
+        """
+        Create the fixed demo users and their accounts (ACC001 to ACC005)
+        """
+        User.objects.bulk_create([
+            User(phone_number=phone_number, first_name=first_name, last_name=last_name)
+            for phone_number, first_name, last_name in self.USERS
+        ], ignore_conflicts=True)
+
+        user_ids = dict(User.objects.filter(
+            phone_number__in=[phone_number for phone_number, _, _ in self.USERS]
+        ).values_list('phone_number', 'id'))
+        Account.objects.bulk_create([
+            Account(
+                user_id=user_ids[phone_number],
+                account_number=account_number,
+                balance=balance,
+                is_active=True,
+                is_blocked=False,
+                bank_code=bank_code
+            )
+            for phone_number, account_number, balance, bank_code in self.ACCOUNTS
+        ], ignore_conflicts=True)
+
+    def create_banks(self, count=3):
+        """
+        Create the demo bank providers, and synthetic ones beyond the first
+        three. Returns {bank_code: market share}.
+        """
+        banks = list(self.BANKS[:count])
+        for number in range(len(banks) + 1, count + 1):
+            banks.append((f'BANK{number:03d}', f'Bank {number}', f'https://api.bank{number:03d}.test.com'))
+
+        BankProvider.objects.bulk_create([
+            BankProvider(bank_code=code, name=name, is_active=True, api_endpoint=api)
+            for code, name, api in banks
+        ], ignore_conflicts=True)
+
+        # Zipf-like shares: the n-th bank gets 1/n of the first one's customers
+        weights = [1 / rank for rank in range(1, count + 1)]
+        return {code: weight / sum(weights) for (code, _, _), weight in zip(banks, weights)}
+
+    def phone_numbers(self, count):
+        """
+        `count` distinct 8-digit phone numbers, split between the operator prefixes
+        """
+        prefixes = self.random.choices(list(self.PHONE_PREFIXES), weights=list(self.PHONE_PREFIXES.values()), k=count)
+        numbers = []
+        for prefix in self.PHONE_PREFIXES:
+            block = range(prefix * 10 ** 7, (prefix + 1) * 10 ** 7)
+            numbers.extend(map(str, self.random.sample(block, prefixes.count(prefix))))
+        self.random.shuffle(numbers)
+        return numbers
+
+    @classmethod
+    def full_name(cls, phone_number):
+        """
+        Name of a generated user, derived from the phone number so it need not be kept
+        """
+        number = int(phone_number)
+        return (
+            cls.FIRST_NAMES[number % len(cls.FIRST_NAMES)],
+            cls.LAST_NAMES[number // len(cls.FIRST_NAMES) % len(cls.LAST_NAMES)]
+        )
+
+    def balance(self):
+        return Decimal(round(min(self.random.lognormvariate(9, 1.5), 10 ** 8), 2)).quantize(Decimal('0.01'))
+
+    def amount(self):
+        return Decimal(round(min(max(self.random.lognormvariate(8, 0.8), 100), 10 ** 6), 2)).quantize(Decimal('0.01'))
+
+    def create_users(self, count, banks, accounts_per_user=1):
+        """
+        Create `count` users with between 1 and `accounts_per_user` accounts
+        each (half as many users for every extra account), at banks drawn from
+        `banks` ({bank_code: share}). Returns [(phone_number, [bank_code])].
+        """
+        bank_codes = list(banks)
+        bank_weights = list(banks.values())
+        account_counts = range(1, min(accounts_per_user, len(bank_codes)) + 1)
+        count_weights = [2 ** -number for number in account_counts]
+
+        users = []
+        for chunk in chunked(self.phone_numbers(count), self.batch_size):
+            chunk_users = []
+            for phone_number, account_count in zip(chunk, self.random.choices(account_counts, count_weights, k=len(chunk))):
+                user_banks = []
+                while len(user_banks) < account_count:
+                    bank_code = self.random.choices(bank_codes, bank_weights)[0]
+                    if bank_code not in user_banks:
+                        user_banks.append(bank_code)
+                chunk_users.append((phone_number, user_banks))
+
+            with transaction.atomic():
+                User.objects.bulk_create([
+                    User(phone_number=phone_number, first_name=first_name, last_name=last_name)
+                    for phone_number, _ in chunk_users
+                    for first_name, last_name in [self.full_name(phone_number)]
+                ], ignore_conflicts=True)
+
+                # ignore_conflicts does not return ids: read them back
+                user_ids = dict(User.objects.filter(phone_number__in=chunk).values_list('phone_number', 'id'))
+                Account.objects.bulk_create([
+                    Account(
+                        user_id=user_ids[phone_number],
+                        account_number=f"{bank_code}{phone_number}",
+                        balance=self.balance(),
+                        bank_code=bank_code
+                    )
+                    for phone_number, user_banks in chunk_users
+                    for bank_code in user_banks
+                ], ignore_conflicts=True)
+
+            users.extend(chunk_users)
+            logger.info(f"Created {len(users)} of {count} demo users")
+
+        return users
+
+    def sample_recipients(self, users, count):
+        """
+        Draw `count` distinct recipients from `users` (see create_users()).
+        Returns [(phone_number, bank_code, amount, motive)].
+        """
+        return [
+            (phone_number, self.random.choice(user_banks), self.amount(), self.random.choice(self.MOTIVES))
+            for phone_number, user_banks in self.random.sample(users, min(count, len(users)))
+        ]
+
+    def create_group(self, name, recipients):
+        """
+        Create (or complete) a recipient group holding `recipients`
+        """
+        group, _ = RecipientGroup.objects.get_or_create(name=name, owner=None)
+        for chunk in chunked(recipients, self.batch_size):
+            GroupRecipient.objects.bulk_create([
+                GroupRecipient(
+                    group=group,
+                    phone_number=phone_number,
+                    bank_code=bank_code,
+                    full_name=' '.join(self.full_name(phone_number)),
+                    default_amount=amount,
+                    motive=motive
+                )
+                for phone_number, bank_code, amount, motive in chunk
+            ], ignore_conflicts=True)
+        return group
+
+    def create_template(self, name, recipients):
+        """
+        Create (or complete) a payment template holding `recipients`
+        """
+        template, _ = PaymentTemplate.objects.get_or_create(name=name, owner=None)
+        for chunk in chunked(recipients, self.batch_size):
+            TemplateRecipient.objects.bulk_create([
+                TemplateRecipient(
+                    template=template,
+                    phone_number=phone_number,
+                    bank_code=bank_code,
+                    name=' '.join(self.full_name(phone_number)),
+                    default_amount=amount
+                )
+                for phone_number, bank_code, amount, _ in chunk
+            ], ignore_conflicts=True)
+        return template
+
+    def create_recipients(self, count, name=None):
+        """
+        Create `count` users with an account each, and a recipient group and a
+        payment template holding all of them.
+        Returns {"group", "template", "recipients": [(phone_number, bank_code, amount, motive)]}.
+        """
+        users = self.create_users(count, self.create_banks())
+        recipients = self.sample_recipients(users, count)
+
+        name = name or f"Demo {count} recipients"
+        group = self.create_group(name, recipients)
+        template = self.create_template(name, recipients)
+
+        logger.info(f"Created {count} demo recipients in group {group.id} and template {template.id}")
+        return {"group": group, "template": template, "recipients": recipients}
+
+    @staticmethod
+    def write_recipient_files(recipients, directory, name, formats=('csv',)):
+        """
+        Write `recipients` as upload files (columns phone_number, amount,
+        bank_code, motive) named `name`.csv / `name`.ndjson in `directory`.
+        Returns the paths written.
+        """
+        paths = []
+        for file_format in formats:
+            path = Path(directory) / f"{name}.{file_format}"
+            with open(path, 'w', newline='', encoding='utf-8') as output:
+                if file_format == 'csv':
+                    writer = csv.writer(output)
+                    writer.writerow(['phone_number', 'amount', 'bank_code', 'motive'])
+                    writer.writerows(
+                        (phone_number, amount, bank_code, motive)
+                        for phone_number, bank_code, amount, motive in recipients
+                    )
+                else:
+                    for phone_number, bank_code, amount, motive in recipients:
+                        output.write(json.dumps({
+                            "phone_number": phone_number,
+                            "amount": str(amount),
+                            "bank_code": bank_code,
+                            "motive": motive,
+                        }) + "\n")
+            paths.append(path)
+        return paths
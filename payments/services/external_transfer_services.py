@@ -0,0 +1,355 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ..models import BankProviderHealth
+from .circuit_breaker_services import AdaptiveRateLimiter, CircuitBreaker
+from .processing_metrics_services import ProcessingMetrics
+from .recipient_resolver_services import chunked
+from .services import logger
+import asyncio
+import concurrent.futures
+import httpx
+import threading
+import time
+
+
+class ProviderError(Exception):
+    """
+    The provider could not handle the request; counts against its circuit breaker
+    """
+    pass
+
+
+class BusinessError(Exception):
+    """
+    The provider answered, but not with a usable result
+    """
+    pass
+
+
+class ExternalTransferDispatcher:
+    """
+    Sends external transfers to the bank providers' APIs.
+
+    Requests run on one background asyncio event loop per process, with a
+    keep-alive connection pool and a concurrency limit per provider, so every
+    worker thread shares the same connections. Providers that support it get
+    transfers in batches.
+
+    Each provider also has a circuit breaker and an adaptive rate limiter.
+    Provider errors (timeouts, connection errors, 5xx, 429) slow the provider
+    down and eventually open its breaker; transfers that hit a provider error
+    or an open breaker come back 'parked' so they can be retried later with
+    the same reference. Breaker state is shared with the other processes
+    through BankProviderHealth.
+
+    Provider protocol (JSON over HTTP):
+        POST {api_endpoint}/transfers        {"reference", "phone_number", "amount"}
+            -> {"status": "success"} or {"status": "failed", "reason": "..."}
+        POST {api_endpoint}/transfers/batch  {"transfers": [...]}
+            -> {"results": [{"reference", "status", "reason"}, ...]}
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """
+        Return the process-wide dispatcher, starting its event loop on first use
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name='external-transfer-dispatcher',
+            daemon=True
+        )
+        self._thread.start()
+        self._clients = {}  # bank_code -> (client, semaphore, provider settings)
+        self._breakers = defaultdict(CircuitBreaker)
+        self._limiters = defaultdict(AdaptiveRateLimiter)
+
+    def dispatch(self, transfers, providers):
+        """
+        Send transfers and wait for all of their outcomes.
+
+        `transfers` is a list of {"id", "reference", "bank_code", "phone_number", "amount"}
+        and `providers` maps each bank_code to its BankProvider; transfers to a
+        bank missing from `providers` fail.
+        Returns {transfer id: (status, failure reason)} where status is
+        'success', 'failed' (rejected by the provider) or 'parked' (to be retried).
+        Raises ProviderError if the providers have not all answered within
+        EXTERNAL_DISPATCH_TIMEOUT_SECONDS.
+        """
+        settings_by_bank = {
+            bank_code: {
+                'api_endpoint': provider.api_endpoint,
+                'max_concurrency': max(1, provider.max_concurrency),
+                'supports_batch': provider.supports_batch,
+                'max_batch_size': max(1, provider.max_batch_size),
+                'timeout_seconds': provider.timeout_seconds,
+            }
+            for bank_code, provider in providers.items()
+        }
+
+        # Breakers opened by other processes
+        now = timezone.now()
+        open_elsewhere = {
+            health.bank_code: ((health.open_until - now).total_seconds(), health.last_failure_reason)
+            for health in BankProviderHealth.objects.filter(
+                bank_code__in=settings_by_bank.keys(),
+                state='open',
+                open_until__gt=now
+            )
+        }
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._dispatch(transfers, settings_by_bank, open_elsewhere), self._loop
+        )
+        timeout = getattr(settings, 'EXTERNAL_DISPATCH_TIMEOUT_SECONDS', 600)
+        try:
+            results, health = future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Cancelling releases the providers' probes and semaphores
+            future.cancel()
+            raise ProviderError(f"External dispatch timed out after {timeout}s")
+
+        self._save_health(health)
+        return results
+
+    async def _dispatch(self, transfers, providers, open_elsewhere):
+        transfers_by_bank = defaultdict(list)
+        for transfer in transfers:
+            transfers_by_bank[transfer['bank_code']].append(transfer)
+
+        results = {}
+        requests = []
+        for bank_code, bank_transfers in list(transfers_by_bank.items()):
+            provider = providers.get(bank_code)
+            if provider is None:
+                # Deleted or deactivated since the items were priced
+                results.update(
+                    (transfer['id'], ('failed', f"Bank provider {bank_code} is no longer available"))
+                    for transfer in bank_transfers
+                )
+                del transfers_by_bank[bank_code]
+                continue
+
+            breaker = self._breakers[bank_code]
+            if bank_code in open_elsewhere and breaker.state == 'closed':
+                breaker.trip(*open_elsewhere[bank_code])
+
+            client, semaphore = await self._client_for(bank_code, provider)
+            if provider['supports_batch'] and len(bank_transfers) > 1:
+                for batch in chunked(bank_transfers, provider['max_batch_size']):
+                    requests.append(self._send(
+                        bank_code, semaphore, self._send_batch(client, batch), batch, provider['timeout_seconds']
+                    ))
+            else:
+                requests.extend(
+                    self._send(
+                        bank_code, semaphore, self._send_one(client, transfer), [transfer], provider['timeout_seconds']
+                    )
+                    for transfer in bank_transfers
+                )
+
+        for outcome in await asyncio.gather(*requests):
+            results.update(outcome)
+        return results, {bank_code: self._health(bank_code) for bank_code in transfers_by_bank}
+
+    async def _send(self, bank_code, semaphore, request, transfers, probe_wait_seconds=30):
+        """
+        Run one provider request through the provider's breaker and rate limiter.
+        `request` returns its outcomes, or raises ProviderError. Any other
+        error (including an unusable reply) also counts as a provider failure,
+        and the breaker always learns the outcome, so a half-open probe can
+        never stay in flight. Requests waiting for the probe's outcome give up
+        after `probe_wait_seconds` and are parked.
+        """
+        breaker = self._breakers[bank_code]
+        limiter = self._limiters[bank_code]
+        async with semaphore:
+            # While the half-open probe is in flight, wait for its outcome
+            deadline = time.monotonic() + probe_wait_seconds
+            while not breaker.allow() and breaker.probing:
+                if time.monotonic() >= deadline:
+                    request.close()
+                    reason = f"Bank provider {bank_code} unavailable (circuit probe still in flight)"
+                    return {transfer['id']: ('parked', reason) for transfer in transfers}
+                await asyncio.sleep(0.05)
+            if breaker.state == 'open':
+                request.close()
+                reason = f"Bank provider {bank_code} unavailable (circuit open)"
+                return {transfer['id']: ('parked', reason) for transfer in transfers}
+
+            await limiter.acquire()
+            started = time.perf_counter()
+            recorded = False
+            try:
+                outcomes = await request
+            except Exception as e:
+                if not isinstance(e, ProviderError):
+                    logger.error(f"Unexpected error from bank provider {bank_code}: {type(e).__name__}: {str(e)}")
+                    e = ProviderError(f"Bank provider error: {type(e).__name__}: {str(e)}")
+                ProcessingMetrics.EXTERNAL_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, bank_code=bank_code, status='provider_error'
+                )
+                breaker.record_failure(str(e))
+                limiter.on_failure()
+                recorded = True
+                if breaker.state == 'open':
+                    logger.warning(f"Circuit opened for bank provider {bank_code}: {str(e)}")
+                return {transfer['id']: ('parked', str(e)) for transfer in transfers}
+            else:
+                ProcessingMetrics.EXTERNAL_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, bank_code=bank_code, status='answered'
+                )
+                breaker.record_success()
+                limiter.on_success()
+                recorded = True
+            finally:
+                if not recorded:
+                    # Cancelled (dispatch timeout): release the probe
+                    breaker.record_failure("Request cancelled")
+
+        return outcomes
+
+    def _health(self, bank_code):
+        breaker = self._breakers[bank_code]
+        return {
+            'state': breaker.state,
+            'consecutive_failures': breaker.consecutive_failures,
+            'open_until': (
+                timezone.now() + timedelta(seconds=breaker.retry_in())
+                if breaker.state == 'open' else None
+            ),
+            'current_rate': self._limiters[bank_code].rate,
+            'last_failure_reason': breaker.last_failure_reason,
+        }
+
+    @staticmethod
+    def _save_health(health):
+        for bank_code, values in health.items():
+            try:
+                BankProviderHealth.objects.update_or_create(bank_code=bank_code, defaults=values)
+            except Exception as e:
+                logger.error(f"Error saving health of bank provider {bank_code}: {str(e)}")
+
+    async def _client_for(self, bank_code, provider):
+        """
+        Return the pooled client of a provider, replacing it if its settings changed
+        """
+        cached = self._clients.get(bank_code)
+        if cached is not None and cached[2] == provider:
+            return cached[0], cached[1]
+        if cached is not None:
+            await cached[0].aclose()
+
+        client = httpx.AsyncClient(
+            base_url=provider['api_endpoint'],
+            limits=httpx.Limits(
+                max_connections=provider['max_concurrency'],
+                max_keepalive_connections=provider['max_concurrency']
+            ),
+            timeout=provider['timeout_seconds']
+        )
+        semaphore = asyncio.Semaphore(provider['max_concurrency'])
+        self._clients[bank_code] = (client, semaphore, provider)
+        return client, semaphore
+
+    @staticmethod
+    def _payload(transfer):
+        return {
+            'reference': transfer['reference'],
+            'phone_number': transfer['phone_number'],
+            'amount': transfer['amount'],
+        }
+
+    async def _send_one(self, client, transfer):
+        try:
+            body = await self._post(client, 'transfers', self._payload(transfer))
+        except BusinessError as e:
+            return {transfer['id']: ('failed', str(e))}
+
+        return {transfer['id']: self._outcome(body)}
+
+    async def _send_batch(self, client, batch):
+        try:
+            body = await self._post(
+                client,
+                'transfers/batch',
+                {'transfers': [self._payload(transfer) for transfer in batch]}
+            )
+        except BusinessError as e:
+            return {transfer['id']: ('failed', str(e)) for transfer in batch}
+
+        results = body.get('results')
+        if not isinstance(results, list):
+            raise ProviderError("Bank provider error: batch reply without a results list")
+        results = {result.get('reference'): result for result in results if isinstance(result, dict)}
+
+        return {
+            transfer['id']: self._outcome(results.get(transfer['reference'], {
+                'status': 'failed',
+                'reason': "No result returned by bank provider"
+            }))
+            for transfer in batch
+        }
+
+    @staticmethod
+    async def _post(client, path, payload):
+        """
+        POST to a provider and return the JSON object it replied.
+        Raises ProviderError when the provider is unreachable, overloaded or
+        broken (worth retrying later, including replies that are not a JSON
+        object), BusinessError for any other bad answer.
+        """
+        try:
+            response = await client.post(path, json=payload)
+        except httpx.TimeoutException:
+            raise ProviderError("Bank provider timed out")
+        except httpx.HTTPError as e:
+            raise ProviderError(f"Bank provider error: {str(e)}")
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ProviderError(f"Bank provider error: HTTP {response.status_code}")
+        try:
+            response.raise_for_status()
+            body = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise BusinessError(f"Bank provider error: {str(e)}")
+        if not isinstance(body, dict):
+            # Not the protocol: the provider is broken rather than refusing the transfer
+            raise ProviderError(f"Bank provider error: unexpected reply {type(body).__name__}")
+        return body
+
+    @staticmethod
+    def _outcome(body):
+        if body.get('status') == 'success':
+            return 'success', None
+        return 'failed', body.get('reason') or "Rejected by bank provider"
+
+    def close(self):
+        """
+        Close the provider connection pools and stop the event loop
+        """
+        async def close_clients():
+            for client, _, _ in self._clients.values():
+                await client.aclose()
+            self._clients.clear()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_clients(), self._loop).result()
+        except Exception as e:
+            logger.error(f"Error closing bank provider connections: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+        with ExternalTransferDispatcher._instance_lock:
+            if ExternalTransferDispatcher._instance is self:
+                ExternalTransferDispatcher._instance = None
@@ -0,0 +1,101 @@
+from decimal import Decimal
+from django.conf import settings
+from ..models import FeeSchedule
+from .services import logger
+import numpy as np
+import threading
+import time
+
+
+class FeeScheduleRegistry:
+    """
+    Process-local cache of the active FeeSchedule tiers, compiled for BatchPricer.
+
+    Tiers are grouped by schedule key (initiator_account_id, bank_code,
+    transfer_type), None standing for "any", and each schedule is compiled
+    into three int64 arrays sorted by min_amount (min_amounts, flat_fees in
+    cents, percentage fees in basis points), so that pricing a batch is a
+    binary search per item and never queries the rules.
+    post_save/post_delete signals on FeeSchedule clear the cache; other
+    processes pick changes up after FEE_SCHEDULE_REGISTRY_TTL_SECONDS
+    (0 or None: no expiry).
+    """
+    _cache = None  # (schedules by key, load time)
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load(cls):
+        ttl = getattr(settings, 'FEE_SCHEDULE_REGISTRY_TTL_SECONDS', 300)
+        cache = cls._cache
+        if cache is not None and (not ttl or time.monotonic() - cache[1] < ttl):
+            return cache[0]
+
+        with cls._lock:
+            # Another thread may have reloaded it while we waited
+            if cls._cache is not None and cls._cache is not cache:
+                return cls._cache[0]
+
+            schedules = cls.compile(FeeSchedule.objects.filter(is_active=True))
+            cls._cache = (schedules, time.monotonic())
+            logger.debug(f"Compiled {len(schedules)} fee schedules")
+            return schedules
+
+    @staticmethod
+    def compile(tiers):
+        """
+        Compile FeeSchedule rows into {(initiator_account_id, bank_code, transfer_type):
+        (min_amounts, flat_fees, basis_points)}. Adds the flat
+        MASS_PAYMENT_DEFAULT_FEE as the catch-all schedule when there is none.
+        """
+        rows = {}
+        for tier in tiers:
+            key = (
+                tier.initiator_account_id,
+                tier.bank_code or None,
+                None if tier.transfer_type == 'any' else tier.transfer_type
+            )
+            # The amount fields have 2 decimal places: cents and basis points are exact
+            rows.setdefault(key, []).append((
+                int(tier.min_amount * 100),
+                int(tier.flat_fee * 100),
+                int(tier.percentage_fee * 100)
+            ))
+
+        if (None, None, None) not in rows:
+            default_fee = Decimal(str(getattr(settings, 'MASS_PAYMENT_DEFAULT_FEE', '0.50')))
+            rows[(None, None, None)] = [(0, int(default_fee * 100), 0)]
+
+        return {
+            key: tuple(np.array(column, dtype=np.int64) for column in zip(*sorted(key_rows)))
+            for key, key_rows in rows.items()
+        }
+
+    @classmethod
+    def schedules(cls):
+        """
+        Return the compiled schedules (see compile())
+        """
+        return cls._load()
+
+    @staticmethod
+    def lookup(schedules, initiator_account_id, bank_code, transfer_type):
+        """
+        Return the most specific schedule of `schedules` for an item: an
+        initiator's own schedules come first, then bank-specific ones, then
+        those for the transfer type.
+        """
+        for initiator in (initiator_account_id, None) if initiator_account_id is not None else (None,):
+            for bank in (bank_code, None) if bank_code is not None else (None,):
+                for kind in (transfer_type, None) if transfer_type is not None else (None,):
+                    schedule = schedules.get((initiator, bank, kind))
+                    if schedule is not None:
+                        return schedule
+        return schedules[(None, None, None)]
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drop the compiled schedules; the next lookup recompiles them
+        """
+        with cls._lock:
+            cls._cache = None
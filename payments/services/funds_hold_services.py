@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import Account, FundsHold
+from .services import logger
+
+
+class InsufficientFundsError(Exception):
+    """
+    Raised when the initiator balance cannot cover a reservation
+    """
+    pass
+
+
+class FundsHoldService:
+    """
+    Reserves the funds of a mass payment on the initiator account up front.
+    The reserved amount leaves the balance when the hold is taken; posting
+    items then consumes the hold instead of debiting the account, and the
+    unspent part is given back when the hold is settled.
+    """
+
+    @staticmethod
+    def reserve(mass_payment, amount):
+        """
+        Take `amount` from the initiator's balance into a hold for the mass payment.
+        Returns the hold, or None if the balance is insufficient.
+        """
+        with transaction.atomic():
+            account = Account.objects.select_for_update().get(id=mass_payment.initiator_account_id)
+            if account.balance < amount:
+                return None
+
+            Account.objects.filter(id=account.id).update(balance=F('balance') - amount)
+            hold = FundsHold.objects.create(
+                account=account,
+                mass_payment=mass_payment,
+                amount=amount
+            )
+            logger.info(f"Reserved {amount} on account {account.account_number} "
+                        f"for mass payment {mass_payment.id}")
+            return hold
+
+    @staticmethod
+    def extend(mass_payment, amount):
+        """
+        Take `amount` more from the initiator's balance into the mass payment's
+        hold, creating the hold on first use. Used when the total is only known
+        as the items are created.
+        Returns the hold, or None if the balance is insufficient.
+        """
+        with transaction.atomic():
+            account = Account.objects.select_for_update().get(id=mass_payment.initiator_account_id)
+            if account.balance < amount:
+                return None
+
+            Account.objects.filter(id=account.id).update(balance=F('balance') - amount)
+            hold, created = FundsHold.objects.get_or_create(
+                mass_payment=mass_payment,
+                defaults={'account': account, 'amount': amount}
+            )
+            if not created:
+                FundsHold.objects.filter(id=hold.id).update(
+                    amount=F('amount') + amount,
+                    updated_at=timezone.now()
+                )
+            return hold
+
+    @staticmethod
+    def consume(mass_payment, amount):
+        """
+        Record that `amount` of the hold was spent on posted items
+        """
+        if amount:
+            FundsHold.objects.filter(mass_payment=mass_payment, status='active').update(
+                consumed_amount=F('consumed_amount') + amount,
+                updated_at=timezone.now()
+            )
+
+    @staticmethod
+    def settle(mass_payment):
+        """
+        Close the hold and give its unspent part back to the account.
+        Safe to call more than once.
+        """
+        with transaction.atomic():
+            try:
+                hold = FundsHold.objects.select_for_update().get(mass_payment=mass_payment, status='active')
+            except FundsHold.DoesNotExist:
+                return None
+
+            remainder = hold.amount - hold.consumed_amount
+            if remainder:
+                Account.objects.filter(id=hold.account_id).update(balance=F('balance') + remainder)
+
+            hold.released_amount = remainder
+            hold.status = 'settled' if hold.consumed_amount else 'released'
+            hold.save(update_fields=['released_amount', 'status', 'updated_at'])
+            return hold
@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from ..models import IdempotencyKey
+from .services import logger
+import functools
+import hashlib
+import json
+
+
+class IdempotencyService:
+    """
+    Idempotency-Key support for the mass payment creation endpoints.
+
+    The first request with a key claims it; its successful response is stored
+    with the key, in the same transaction as the payment it created. Retries
+    with the same key and the same request get the stored response back from
+    a single unique-index lookup, without running the view again. A key reused
+    for a different request gets a 422, one whose first request is still
+    running a 409. Failed requests release the key so they can be retried.
+    Keys belong to the initiator account of the request: two accounts using
+    the same key do not see each other's payments.
+    Keys expire after IDEMPOTENCY_KEY_TTL_SECONDS.
+    """
+    HEADER = 'Idempotency-Key'
+    MAX_KEY_LENGTH = 255
+
+    @staticmethod
+    def fingerprint(request):
+        """
+        SHA-256 of the method, full path and body of a request.
+        Uploaded files are hashed chunk by chunk and rewound.
+        """
+        digest = hashlib.sha256(f"{request.method} {request.get_full_path()}\n".encode())
+
+        data = request.data
+        if hasattr(data, 'lists'):
+            # Form data: fields in name order, files by content
+            for name, values in sorted(data.lists(), key=lambda item: item[0]):
+                digest.update(f"{name}\n".encode())
+                for value in values:
+                    if isinstance(value, UploadedFile):
+                        for chunk in value.chunks():
+                            digest.update(chunk)
+                        value.seek(0)
+                    else:
+                        digest.update(f"{value}\n".encode())
+        else:
+            digest.update(json.dumps(data, sort_keys=True, cls=JSONEncoder).encode())
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def scope(request):
+        """
+        Initiator account number of a request, the namespace of its keys
+        """
+        data = request.data
+        account_number = data.get('initiator_account_number') if hasattr(data, 'get') else None
+        return str(account_number or '')[:IdempotencyKey._meta.get_field('scope').max_length]
+
+    @staticmethod
+    def run(key, request, handler):
+        """
+        Run `handler` (which returns a Response) once per idempotency key
+        """
+        if len(key) > IdempotencyService.MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{IdempotencyService.HEADER} must be at most {IdempotencyService.MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        scope = IdempotencyService.scope(request)
+        fingerprint = IdempotencyService.fingerprint(request)
+        now = timezone.now()
+
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is not None:
+            lock_seconds = getattr(settings, 'IDEMPOTENCY_KEY_LOCK_SECONDS', 600)
+            abandoned = (
+                record.status == 'processing'
+                and record.created_at <= now - timezone.timedelta(seconds=lock_seconds)
+            )
+            if record.expires_at <= now or abandoned:
+                # Stale: let this request claim the key again
+                IdempotencyKey.objects.filter(id=record.id, status=record.status).delete()
+            elif record.request_fingerprint != fingerprint:
+                return Response(
+                    {"error": f"{IdempotencyService.HEADER} was already used for a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            elif record.status == 'processing':
+                return IdempotencyService._in_progress()
+            else:
+                logger.info(f"Replaying the response stored for idempotency key {key} of account {scope}")
+                response = Response(record.response_body, status=record.response_status)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    scope=scope,
+                    key=key,
+                    request_fingerprint=fingerprint,
+                    expires_at=now + timezone.timedelta(
+                        seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL_SECONDS', 86400)
+                    )
+                )
+        except IntegrityError:
+            # A concurrent request claimed the key first
+            return IdempotencyService._in_progress()
+
+        try:
+            with transaction.atomic():
+                response = handler()
+                if status.is_success(response.status_code):
+                    # Stored as the JSON renderer would send it
+                    body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                    IdempotencyKey.objects.filter(id=record.id).update(
+                        status='completed',
+                        response_status=response.status_code,
+                        response_body=body,
+                        mass_payment_id=body.get('mass_payment_id') if isinstance(body, dict) else None
+                    )
+                    return response
+        except Exception:
+            IdempotencyKey.objects.filter(id=record.id).delete()
+            raise
+
+        IdempotencyKey.objects.filter(id=record.id).delete()
+        return response
+
+    @staticmethod
+    def _in_progress():
+        return Response(
+            {"error": f"A request with this {IdempotencyService.HEADER} is still being processed"},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    @staticmethod
+    def purge_expired():
+        """
+        Delete expired keys. Returns the number deleted.
+        """
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+def idempotent(view_method):
+    """
+    Make a viewset creation method honour the Idempotency-Key header
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IdempotencyService.HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        return IdempotencyService.run(key, request, lambda: view_method(self, request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,275 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from ..models import ProcessingJob
+from .services import logger
+import os
+import socket
+import threading
+
+
+class JobQueue:
+    """
+    Durable job queue stored in the ProcessingJob table.
+    Workers claim jobs under a lease that they renew with heartbeats; a job
+    whose lease expires (worker crash or restart) becomes claimable again.
+    """
+
+    @staticmethod
+    def enqueue(job_type, object_id=None, payload=None, delay_seconds=0):
+        """
+        Add a job to the queue. Called inside the caller's transaction, the job
+        only becomes visible to workers once that transaction commits.
+        """
+        return ProcessingJob.objects.create(
+            job_type=job_type,
+            object_id=object_id,
+            payload=payload or {},
+            max_attempts=getattr(settings, 'PAYMENT_JOB_MAX_ATTEMPTS', 5),
+            available_at=timezone.now() + timedelta(seconds=delay_seconds)
+        )
+
+    @staticmethod
+    def claim(worker_id, lease_seconds=None, job_types=None):
+        """
+        Claim the next available job for `worker_id`, or return None.
+        Uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it,
+        and a compare-and-swap UPDATE otherwise (SQLite).
+        """
+        lease_seconds = lease_seconds or getattr(settings, 'PAYMENT_JOB_LEASE_SECONDS', 60)
+        now = timezone.now()
+
+        claimable = ProcessingJob.objects.filter(
+            Q(status='pending', available_at__lte=now) |
+            Q(status='running', lease_expires_at__lt=now)
+        )
+        if job_types:
+            claimable = claimable.filter(job_type__in=job_types)
+        claimable = claimable.order_by('available_at', 'id')
+
+        while True:
+            if connection.features.has_select_for_update_skip_locked:
+                with transaction.atomic():
+                    job = claimable.select_for_update(skip_locked=True).first()
+                    if job is None:
+                        return None
+                    job.status = 'running'
+                    job.lease_owner = worker_id
+                    job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+                    job.heartbeat_at = now
+                    job.attempts += 1
+                    job.save(update_fields=[
+                        'status', 'lease_owner', 'lease_expires_at', 'heartbeat_at', 'attempts', 'updated_at'
+                    ])
+            else:
+                job = None
+                for candidate in claimable[:10]:
+                    # Only succeeds if nobody claimed the row since we read it
+                    claimed = ProcessingJob.objects.filter(
+                        id=candidate.id,
+                        status=candidate.status,
+                        attempts=candidate.attempts,
+                        lease_owner=candidate.lease_owner
+                    ).update(
+                        status='running',
+                        lease_owner=worker_id,
+                        lease_expires_at=now + timedelta(seconds=lease_seconds),
+                        heartbeat_at=now,
+                        attempts=F('attempts') + 1,
+                        updated_at=now
+                    )
+                    if claimed:
+                        job = ProcessingJob.objects.get(id=candidate.id)
+                        break
+                if job is None:
+                    return None
+
+            # A job that keeps losing its lease (e.g. crashing the worker) is given up
+            if job.attempts > job.max_attempts:
+                JobQueue.fail(job, worker_id, job.last_error or "Lease expired too many times", retry=False)
+                continue
+
+            return job
+
+    @staticmethod
+    def heartbeat(job, worker_id, lease_seconds=None):
+        """
+        Extend the lease of a running job. Returns False if the lease was lost.
+        """
+        lease_seconds = lease_seconds or getattr(settings, 'PAYMENT_JOB_LEASE_SECONDS', 60)
+        now = timezone.now()
+        return bool(ProcessingJob.objects.filter(
+            id=job.id,
+            status='running',
+            lease_owner=worker_id
+        ).update(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+            updated_at=now
+        ))
+
+    @staticmethod
+    def complete(job, worker_id):
+        """
+        Mark a job as completed
+        """
+        ProcessingJob.objects.filter(id=job.id, lease_owner=worker_id).update(
+            status='completed',
+            lease_owner='',
+            lease_expires_at=None,
+            updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def fail(job, worker_id, error, retry=True):
+        """
+        Record a failed attempt; the job is retried with exponential backoff
+        until it runs out of attempts.
+        """
+        now = timezone.now()
+        if retry and job.attempts < job.max_attempts:
+            base = getattr(settings, 'PAYMENT_JOB_RETRY_BACKOFF_SECONDS', 10)
+            cap = getattr(settings, 'PAYMENT_JOB_MAX_BACKOFF_SECONDS', 600)
+            delay = min(cap, base * 2 ** (job.attempts - 1))
+            status, available_at = 'pending', now + timedelta(seconds=delay)
+        else:
+            status, available_at = 'failed', job.available_at
+
+        ProcessingJob.objects.filter(id=job.id, lease_owner=worker_id).update(
+            status=status,
+            available_at=available_at,
+            lease_owner='',
+            lease_expires_at=None,
+            last_error=error,
+            updated_at=now
+        )
+
+
+class PaymentWorkerPool:
+    """
+    Bounded pool of worker threads that claim and run jobs from the JobQueue.
+    `recovery`, if given, is called when the pool starts and then every
+    `recovery_interval` seconds from a separate thread.
+    """
+
+    def __init__(self, handlers, concurrency=None, lease_seconds=None, poll_interval=None, job_types=None,
+                 recovery=None, recovery_interval=None):
+        self.handlers = handlers
+        self.concurrency = concurrency or getattr(settings, 'PAYMENT_WORKER_CONCURRENCY', 4)
+        self.lease_seconds = lease_seconds or getattr(settings, 'PAYMENT_JOB_LEASE_SECONDS', 60)
+        self.poll_interval = poll_interval or getattr(settings, 'PAYMENT_WORKER_POLL_INTERVAL', 1.0)
+        self.job_types = job_types
+        self.recovery = recovery
+        self.recovery_interval = recovery_interval or getattr(settings, 'MASS_PAYMENT_RECOVERY_INTERVAL_SECONDS', 60)
+        self._stop = threading.Event()
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def run(self, drain=False):
+        """
+        Start the workers and block until they stop.
+        With drain=True each worker exits as soon as the queue is empty.
+        """
+        threads = [
+            threading.Thread(
+                target=self._worker_loop,
+                args=(f"{self._prefix}:{number}", drain),
+                name=f"payment-worker-{number}",
+                daemon=True
+            )
+            for number in range(self.concurrency)
+        ]
+        # Recover abandoned work before the workers start claiming jobs
+        workers_done = threading.Event()
+        if self.recovery is not None:
+            self._run_recovery()
+            recovery = threading.Thread(
+                target=self._recovery_loop,
+                args=(workers_done,),
+                name='payment-recovery',
+                daemon=True
+            )
+            recovery.start()
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # Join with a timeout so the main thread stays responsive to signals
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+        workers_done.set()
+
+    def stop(self):
+        """
+        Ask the workers to exit once their current job is finished
+        """
+        self._stop.set()
+
+    def _worker_loop(self, worker_id, drain):
+        try:
+            while not self._stop.is_set():
+                try:
+                    job = JobQueue.claim(worker_id, self.lease_seconds, self.job_types)
+                except Exception as e:
+                    logger.error(f"Worker {worker_id} could not claim a job: {str(e)}")
+                    job = None
+
+                if job is None:
+                    if drain:
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                self._run_job(job, worker_id)
+        finally:
+            connection.close()
+
+    def _run_job(self, job, worker_id):
+        handler = self.handlers.get(job.job_type)
+        if handler is None:
+            JobQueue.fail(job, worker_id, f"No handler for job type {job.job_type}", retry=False)
+            return
+
+        # Keep the lease alive while the handler runs
+        finished = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop,
+            args=(job, worker_id, finished),
+            daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            handler(job.object_id, **job.payload)
+            JobQueue.complete(job, worker_id)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.job_type} #{job.object_id}) failed "
+                         f"on attempt {job.attempts}: {str(e)}")
+            JobQueue.fail(job, worker_id, str(e))
+        finally:
+            finished.set()
+            heartbeat.join()
+
+    def _run_recovery(self):
+        try:
+            recovered = self.recovery()
+            if recovered:
+                logger.warning(f"Recovery scan resumed {recovered} abandoned mass payments")
+        except Exception as e:
+            logger.error(f"Recovery scan failed: {str(e)}")
+        finally:
+            connection.close()
+
+    def _recovery_loop(self, workers_done):
+        while not workers_done.wait(self.recovery_interval) and not self._stop.is_set():
+            self._run_recovery()
+
+    def _heartbeat_loop(self, job, worker_id, finished):
+        try:
+            while not finished.wait(self.lease_seconds / 3):
+                if not JobQueue.heartbeat(job, worker_id, self.lease_seconds):
+                    logger.warning(f"Worker {worker_id} lost the lease on job {job.id}")
+                    return
+        finally:
+            connection.close()
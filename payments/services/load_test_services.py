@@ -0,0 +1,371 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.test import Client
+from django.urls import Resolver404, resolve
+from ..middleware import QueryCounter, QueryCountMiddleware
+from .services import logger
+import csv
+import io
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+
+class HttpLoadTarget:
+    """
+    Sends load test requests to a running server with httpx. Query counts
+    come from the X-DB-Query-Count header (QUERY_COUNT_HEADER setting of the
+    server), None when the server does not send it.
+    """
+
+    def __init__(self, base_url, timeout=30.0, concurrency=10):
+        import httpx
+
+        self.client = httpx.Client(
+            base_url=base_url.rstrip('/'),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        )
+
+    def request(self, method, path, json=None, data=None, files=None, headers=None):
+        """
+        Returns (status code, decoded JSON body or None, queries or None)
+        """
+        response = self.client.request(method, path, json=json, data=data, files=files, headers=headers)
+        queries = response.headers.get(QueryCountMiddleware.HEADER)
+        body = None
+        if response.headers.get('content-type', '').startswith('application/json'):
+            body = response.json()
+        return response.status_code, body, int(queries) if queries is not None else None
+
+    def close(self):
+        self.client.close()
+
+
+class TestClientLoadTarget:
+    """
+    Sends load test requests to this process's Django application, with one
+    test client (and database connection) per worker thread, and counts the
+    SQL queries of each request, streamed content included.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, json=None, data=None, files=None, headers=None):
+        """
+        Returns (status code, decoded JSON body or None, queries)
+        """
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+
+        kwargs = {'headers': headers or {}}
+        if json is not None:
+            kwargs.update(data=json, content_type='application/json')
+        elif files:
+            kwargs['data'] = dict(data or {})
+            for name, (filename, content) in files.items():
+                upload = io.BytesIO(content)
+                upload.name = filename
+                kwargs['data'][name] = upload
+        elif data is not None:
+            kwargs['data'] = data
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = getattr(client, method.lower())(path, **kwargs)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+
+        body = None
+        if not response.streaming and response.get('Content-Type', '').startswith('application/json'):
+            body = response.json()
+        return response.status_code, body, counter.count
+
+    def close(self):
+        pass
+
+
+class LoadTrafficSynthesizer:
+    """
+    Generates a mix of API requests from a pool of existing accounts:
+    mass payment creation (JSON and CSV upload), payment template and
+    recipient group creation, and polling of the mass payments created.
+    Amounts are small so the initiator's balance lasts the whole run.
+    """
+    KINDS = ('create', 'upload', 'template', 'group', 'poll')
+
+    def __init__(self, pool, initiator_account_number, mix, recipients=10, seed=0):
+        self.pool = pool  # [(phone_number, bank_code)]
+        self.initiator_account_number = initiator_account_number
+        self.recipients = min(recipients, len(pool))
+        self.random = random.Random(seed)
+        self.kinds = [kind for kind in self.KINDS if mix.get(kind)]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.mass_payment_ids = []
+        self.lock = threading.Lock()
+        self.run_id = uuid.uuid4().hex[:8]
+        self.counter = itertools.count(1)
+
+    @staticmethod
+    def bootstrap(target, pool_size, initiator_account_number=None):
+        """
+        Read up to `pool_size` active accounts (and the latest mass payments)
+        through the API. Without initiator, the richest account is used.
+        Returns (pool, initiator account number, mass payment ids).
+        """
+        accounts = []
+        for page in range(1, math.ceil(pool_size / 10) + 1):
+            status, body, _ = target.request('GET', f'/api/accounts/?page={page}')
+            if status != 200 or not body:
+                break
+            accounts.extend(account for account in body['results'] if account['is_active'] and not account['is_blocked'])
+            if not body.get('next'):
+                break
+
+        if not initiator_account_number and accounts:
+            initiator_account_number = max(accounts, key=lambda account: float(account['balance']))['account_number']
+
+        pool = [
+            (account['user_details']['phone_number'], account['bank_code'])
+            for account in accounts[:pool_size]
+            if account['account_number'] != initiator_account_number
+        ]
+
+        status, body, _ = target.request('GET', '/api/mass-payments/')
+        mass_payment_ids = [payment['id'] for payment in body['results']] if status == 200 and body else []
+        return pool, initiator_account_number, mass_payment_ids
+
+    def amount(self):
+        return f"{self.random.randint(100, 1000) / 100:.2f}"
+
+    def sample(self):
+        with self.lock:
+            return [(phone_number, bank_code, self.amount()) for phone_number, bank_code in self.random.sample(self.pool, self.recipients)]
+
+    def next_request(self):
+        """
+        Next request of the mix, as a dict of LoadTestRunner.send() arguments
+        """
+        with self.lock:
+            kind = self.random.choices(self.kinds, self.weights)[0]
+            number = next(self.counter)
+        if kind == 'poll' and not self.mass_payment_ids:
+            kind = 'create'
+
+        if kind == 'create':
+            return {
+                "name": "mass-payments-create",
+                "method": 'POST',
+                "path": '/api/mass-payments/?summary_only=true',
+                "json": {
+                    "initiator_account_number": self.initiator_account_number,
+                    "description": f"Load test {self.run_id}",
+                    "recipients": [
+                        {"phone_number": phone_number, "bank_code": bank_code, "amount": amount}
+                        for phone_number, bank_code, amount in self.sample()
+                    ],
+                },
+            }
+        if kind == 'upload':
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(['phone_number', 'amount', 'bank_code'])
+            writer.writerows((phone_number, amount, bank_code) for phone_number, bank_code, amount in self.sample())
+            return {
+                "name": "mass-payments-upload",
+                "method": 'POST',
+                "path": '/api/mass-payments/upload/?summary_only=true',
+                "data": {"initiator_account_number": self.initiator_account_number},
+                "files": {"file": ('recipients.csv', output.getvalue().encode())},
+            }
+        if kind == 'template':
+            return {
+                "name": "payment-templates-create",
+                "method": 'POST',
+                "path": '/api/payment-templates/',
+                "json": {
+                    "name": f"Load test {self.run_id} {number}",
+                    "recipients": [
+                        {"phone_number": phone_number, "bank_code": bank_code, "default_amount": amount}
+                        for phone_number, bank_code, amount in self.sample()
+                    ],
+                },
+            }
+        if kind == 'group':
+            return {
+                "name": "recipient-groups-create",
+                "method": 'POST',
+                "path": '/api/recipient-groups/',
+                "json": {"name": f"Load test {self.run_id} {number}"},
+            }
+
+        with self.lock:
+            mass_payment_id = self.random.choice(self.mass_payment_ids[-50:])
+        if number % 2:
+            return {"name": "mass-payments-detail", "method": 'GET', "path": f'/api/mass-payments/{mass_payment_id}/'}
+        return {"name": "mass-payments-items", "method": 'GET', "path": f'/api/mass-payments/{mass_payment_id}/items/'}
+
+    def record(self, request, status, body):
+        """
+        Remember the mass payments created, for the polling requests
+        """
+        if status == 201 and isinstance(body, dict) and body.get('mass_payment_id'):
+            with self.lock:
+                self.mass_payment_ids.append(body['mass_payment_id'])
+
+
+class LoadTestReplay:
+    """
+    Requests recorded one JSON object per line: {"method", "path", and
+    optionally "json", "data", "headers", "name"}. Lines that are not
+    requests are skipped. The requests are replayed in a loop.
+    """
+
+    def __init__(self, path):
+        self.requests = []
+        self.skipped = 0
+        with open(path, encoding='utf-8') as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.skipped += 1
+                    continue
+                if not isinstance(record, dict) or not record.get('method') or not str(record.get('path', '')).startswith('/'):
+                    self.skipped += 1
+                    continue
+                self.requests.append({
+                    key: record[key] for key in ('name', 'method', 'path', 'json', 'data', 'headers') if key in record
+                })
+        self.cycle = itertools.cycle(self.requests)
+        self.lock = threading.Lock()
+
+    def next_request(self):
+        with self.lock:
+            return dict(next(self.cycle))
+
+    def record(self, request, status, body):
+        pass
+
+
+class LoadTestRunner:
+    """
+    Sends requests at a target rate (requests per second, 0 for as fast as
+    possible) with at most `concurrency` requests in flight: when all
+    workers are busy the schedule waits, so the achieved throughput shows
+    the capacity of the target.
+    """
+
+    def __init__(self, target, rps=10, concurrency=10):
+        self.target = target
+        self.rps = rps
+        self.concurrency = concurrency
+        self.results = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_name(method, path):
+        """
+        Name results of requests without one after their URL pattern
+        """
+        try:
+            url_name = resolve(path.split('?')[0]).url_name
+        except Resolver404:
+            url_name = path.split('?')[0]
+        return f"{method.upper()} {url_name}"
+
+    def send(self, source, request, slots):
+        name = request.pop('name', None) or self.endpoint_name(request['method'], request['path'])
+        started = time.perf_counter()
+        status, body, queries, error = None, None, None, None
+        try:
+            status, body, queries = self.target.request(**request)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            slots.release()
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        source.record(request, status, body)
+        with self.lock:
+            self.results.append({
+                "name": name,
+                "status": status,
+                "latency_ms": latency_ms,
+                "queries": queries,
+                "error": error,
+            })
+
+    def run(self, source, requests=None, duration=None):
+        """
+        Send requests from `source` (next_request() / record()) until
+        `requests` were sent or `duration` seconds elapsed.
+        Returns the elapsed seconds.
+        """
+        slots = threading.BoundedSemaphore(self.concurrency)
+        started = time.perf_counter()
+        sent = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while (requests is None or sent < requests) and (duration is None or time.perf_counter() - started < duration):
+                if self.rps:
+                    delay = started + sent / self.rps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                slots.acquire()
+                executor.submit(self.send, source, source.next_request(), slots)
+                sent += 1
+                if sent % 100 == 0:
+                    logger.info(f"Load test: {sent} requests sent")
+        return time.perf_counter() - started
+
+    @staticmethod
+    def percentile(values, percent):
+        """
+        Nearest-rank percentile of sorted values
+        """
+        if not values:
+            return None
+        return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+    @staticmethod
+    def summarize(results, elapsed):
+        """
+        Per endpoint (and 'total'): requests, errors (no response or status
+        >= 400), error rate, responses by status, latency percentiles,
+        throughput and queries.
+        """
+        by_endpoint = {}
+        for result in results:
+            by_endpoint.setdefault(result["name"], []).append(result)
+
+        report = {}
+        for name, endpoint_results in sorted(by_endpoint.items()) + [("total", results)]:
+            latencies = sorted(result["latency_ms"] for result in endpoint_results)
+            errors = sum(1 for result in endpoint_results if result["status"] is None or result["status"] >= 400)
+            counted = [result["queries"] for result in endpoint_results if result["queries"] is not None]
+            statuses = {}
+            for result in endpoint_results:
+                status = str(result["status"] or result["error"])
+                statuses[status] = statuses.get(status, 0) + 1
+            report[name] = {
+                "requests": len(endpoint_results),
+                "errors": errors,
+                "error_rate": round(errors / len(endpoint_results), 4) if endpoint_results else 0,
+                "statuses": dict(sorted(statuses.items())),
+                "p50_ms": round(LoadTestRunner.percentile(latencies, 50) or 0, 1),
+                "p95_ms": round(LoadTestRunner.percentile(latencies, 95) or 0, 1),
+                "p99_ms": round(LoadTestRunner.percentile(latencies, 99) or 0, 1),
+                "throughput_rps": round(len(endpoint_results) / elapsed, 2) if elapsed else None,
+                "queries": sum(counted) if counted else None,
+                "queries_per_request": round(sum(counted) / len(counted), 1) if counted else None,
+            }
+        return report
@@ -1,25 +1,51 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
 from django.db import transaction
-from ..models import Account, GroupRecipient, RecipientGroup, Transaction, MassPayment, MassPaymentItem, BankProvider, User
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from ..models import Account, FundsHold, GroupRecipient, ProcessingJob, RecipientGroup, Transaction, MassPayment, MassPaymentItem, BankProvider, User
 import logging
 from .services import logger
+from .bank_provider_registry_services import BankProviderRegistry
+from .external_transfer_services import ExternalTransferDispatcher
+from .funds_hold_services import FundsHoldService
+from .job_queue_services import JobQueue
+from .processing_metrics_services import StageTimer
+from .recipient_resolver_services import RecipientResolver, chunked
+import os
+import socket
+import threading
 
 
 class PaymentProcessor:
     @staticmethod
     def process_mass_payment(mass_payment_id):
         """
-        Process all items in a mass payment
+        Process all items in a mass payment, under a lease on the payment.
+        Progress is checkpointed after every chunk, so a run that resumes a
+        crashed one starts after the last posted item. Errors are re-raised:
+        the payment stays 'processing' with its hold active, and the job retry
+        (or the recovery scan) resumes it from the checkpoint.
         """
+        # Another worker is processing it; the recovery scan takes over if it dies
+        lease_owner = PaymentProcessor.lease_owner()
+        if not PaymentProcessor.acquire_lease(mass_payment_id, lease_owner):
+            logger.info(f"Mass payment {mass_payment_id} is leased by another worker, skipping")
+            return
+
+        timer = StageTimer()
         try:
-            mass_payment = MassPayment.objects.select_for_update().get(id=mass_payment_id)
+            mass_payment = MassPayment.objects.select_related('initiator_account').get(id=mass_payment_id)
             
-            # Skip if already completed or failed
-            if mass_payment.status in ['completed', 'failed']:
+            # Skip if already finished
+            if mass_payment.status in ['completed', 'failed', 'partially_completed']:
                 return
             
             # Update status to processing
             mass_payment.status = 'processing'
-            mass_payment.save()
+            mass_payment.save(update_fields=['status', 'updated_at'])
             
             # Get all pending payment items
             payment_items = MassPaymentItem.objects.filter(
@@ -27,28 +53,587 @@ class PaymentProcessor:
                 status='pending'
             )
             
-            # Process each payment item
-            for item in payment_items:
-                PaymentProcessor._process_payment_item(mass_payment, item)
+            # Funds reserved at creation: items are posted against the hold,
+            # without per-item balance checks
+            reserved = FundsHold.objects.filter(mass_payment=mass_payment, status='active').exists()
             
-            # Update mass payment status
-            PaymentProcessor._update_mass_payment_status(mass_payment)
+            if getattr(settings, 'MASS_PAYMENT_BATCH_POSTING', True):
+                # Large payments are split into shards processed by several workers
+                if PaymentProcessor._start_sharded_processing(mass_payment, reserved):
+                    return
+
+                # Post items chunk by chunk with set-based writes
+                PaymentProcessor._process_in_batches(
+                    mass_payment, payment_items, reserved=reserved, lease_owner=lease_owner, timer=timer
+                )
+            elif reserved or getattr(settings, 'EXTERNAL_TRANSFER_DISPATCH', False):
+                # One item at a time, external transfers being sent to their provider
+                PaymentProcessor._post_items_individually(mass_payment, payment_items, reserved=reserved, timer=timer)
+            else:
+                # Process each payment item
+                for item in payment_items:
+                    PaymentProcessor._process_payment_item(mass_payment, item, timer=timer)
+            
+            # Give back what was reserved for failed items and update the
+            # status, unless external transfers are parked for a retry
+            PaymentProcessor._finish_processing(mass_payment.id)
             
+        except MassPayment.DoesNotExist:
+            # Deleted since it was queued: nothing to resume or settle
+            logger.error(f"Mass payment {mass_payment_id} no longer exists, nothing to process")
         except Exception as e:
-            logger.error(f"Error processing mass payment {mass_payment_id}: {str(e)}")
-            # In case of error, mark as failed if possible
-            try:
-                mass_payment.status = 'failed'
-                mass_payment.save()
-            except:
-                pass
+            # Chunks up to the checkpoint are posted: never fail or settle the
+            # payment here, the rest of it must still be paid
+            logger.error(f"Error processing mass payment {mass_payment_id}, leaving it to be resumed "
+                         f"from its checkpoint: {str(e)}")
+            raise
+        finally:
+            PaymentProcessor._save_timings(mass_payment_id, timer)
+            PaymentProcessor.release_lease(mass_payment_id, lease_owner)
+
+    @staticmethod
+    def _save_timings(mass_payment_id, timer):
+        """
+        Log where a processing run spent its time and add it to the payment's
+        timing breakdown; never fails the run
+        """
+        if not timer.calls and not timer.chunks:
+            return
+        logger.info(f"Mass payment {mass_payment_id}: {timer.items} items in {timer.chunks} chunks, {timer.summary()}")
+        try:
+            timer.save(mass_payment_id)
+        except Exception as e:
+            logger.error(f"Could not save the timings of mass payment {mass_payment_id}: {str(e)}")
+
+    @staticmethod
+    def lease_owner():
+        """
+        Identify the current worker thread as a lease owner
+        """
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    @staticmethod
+    def acquire_lease(mass_payment_id, owner):
+        """
+        Take the processing lease of a mass payment, unless another owner holds
+        an unexpired one. Returns whether it was acquired.
+        """
+        now = timezone.now()
+        return bool(MassPayment.objects.filter(id=mass_payment_id).filter(
+            Q(lease_owner='') | Q(lease_owner=owner) | Q(lease_expires_at__lt=now)
+        ).update(
+            lease_owner=owner,
+            lease_expires_at=now + timedelta(seconds=getattr(settings, 'MASS_PAYMENT_LEASE_SECONDS', 120)),
+            updated_at=now
+        ))
+
+    @staticmethod
+    def release_lease(mass_payment_id, owner):
+        MassPayment.objects.filter(id=mass_payment_id, lease_owner=owner).update(
+            lease_owner='',
+            lease_expires_at=None,
+            updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def _checkpoint(mass_payment, last_item_id, owner):
+        """
+        Record that every item up to `last_item_id` has been posted and renew
+        the lease. Returns False if the lease was lost to another worker.
+        """
+        now = timezone.now()
+        mass_payment.checkpoint_item_id = last_item_id
+        return bool(MassPayment.objects.filter(id=mass_payment.id, lease_owner=owner).update(
+            checkpoint_item_id=last_item_id,
+            checkpoint_at=now,
+            lease_expires_at=now + timedelta(seconds=getattr(settings, 'MASS_PAYMENT_LEASE_SECONDS', 120)),
+            updated_at=now
+        ))
     
     @staticmethod
-    def _process_payment_item(mass_payment, payment_item):
+    def _start_sharded_processing(mass_payment, reserved=False):
         """
-        Process a single payment item
+        Split the pending items of a large mass payment into shards and queue one
+        job per shard. The whole amount must be reserved first (payments created
+        before holds existed are reserved here), so shards never touch the
+        initiator account row.
+        Returns False if the payment should be processed in a single pass instead.
         """
+        if not getattr(settings, 'MASS_PAYMENT_SHARDING', True):
+            return False
+
+        # Already split by a previous run of this job, and the shards are still at work
+        if ProcessingJob.objects.filter(
+            job_type='mass_payment_shard',
+            object_id=mass_payment.id,
+            status__in=['pending', 'running']
+        ).exists():
+            return True
+
+        pending_items = MassPaymentItem.objects.filter(mass_payment=mass_payment, status='pending')
+        shards = PaymentProcessor._plan_shards(
+            pending_items,
+            shard_size=getattr(settings, 'MASS_PAYMENT_SHARD_SIZE', 5000),
+            strategy=getattr(settings, 'MASS_PAYMENT_SHARD_STRATEGY', 'id_range')
+        )
+        if len(shards) < 2:
+            return False
+
         with transaction.atomic():
+            if not reserved:
+                # Without enough funds for everything, a single pass reports which items failed
+                totals = pending_items.aggregate(amount=Sum('amount'), fees=Sum('fee_amount'))
+                if FundsHoldService.reserve(mass_payment, totals['amount'] + totals['fees']) is None:
+                    return False
+
+            for number, shard in enumerate(shards):
+                JobQueue.enqueue('mass_payment_shard', mass_payment.id, payload=dict(shard, shard=number))
+
+        logger.info(f"Split mass payment {mass_payment.id} into {len(shards)} shards")
+        return True
+
+    @staticmethod
+    def _plan_shards(payment_items, shard_size, strategy='id_range'):
+        """
+        Describe the shards of a set of items, either as contiguous id ranges of
+        at most `shard_size` items or as one shard per destination bank.
+        """
+        if strategy == 'bank':
+            bank_codes = payment_items.order_by().values_list('destination_bank_code', flat=True).distinct()
+            return [{'bank_code': bank_code} for bank_code in sorted(bank_codes)]
+
+        ids = list(payment_items.order_by('id').values_list('id', flat=True))
+        return [
+            {'min_id': chunk[0], 'max_id': chunk[-1]}
+            for chunk in chunked(ids, shard_size)
+        ]
+
+    @staticmethod
+    def process_shard(mass_payment_id, min_id=None, max_id=None, bank_code=None, shard=None):
+        """
+        Process the pending items of one shard of a mass payment against its funds hold
+        """
+        mass_payment = MassPayment.objects.select_related('initiator_account').get(id=mass_payment_id)
+
+        payment_items = MassPaymentItem.objects.filter(mass_payment=mass_payment, status='pending')
+        if min_id is not None:
+            payment_items = payment_items.filter(id__gte=min_id, id__lte=max_id)
+        if bank_code is not None:
+            payment_items = payment_items.filter(destination_bank_code=bank_code)
+
+        timer = StageTimer()
+        try:
+            PaymentProcessor._process_in_batches(mass_payment, payment_items, reserved=True, timer=timer)
+        finally:
+            PaymentProcessor._save_timings(mass_payment_id, timer)
+        PaymentProcessor._finish_processing(mass_payment_id)
+
+    @staticmethod
+    def _finish_processing(mass_payment_id):
+        """
+        Once no item is left pending or waiting for its bank provider, release
+        the unspent reservation and set the final status. Only the last shard
+        or retry to finish gets past the check.
+        """
+        with transaction.atomic():
+            mass_payment = MassPayment.objects.select_for_update().get(id=mass_payment_id)
+            if mass_payment.status != 'processing':
+                return
+            if MassPaymentItem.objects.filter(mass_payment=mass_payment, status__in=['pending', 'processing']).exists():
+                return
+
+            FundsHoldService.settle(mass_payment)
+            PaymentProcessor._update_mass_payment_status(mass_payment)
+
+    @staticmethod
+    def _process_in_batches(mass_payment, payment_items, reserved=False, chunk_size=None, lease_owner=None, timer=None):
+        """
+        Process pending payment items in chunks, in id order.
+        With reserved=True the funds come from the payment's hold.
+        With a lease_owner, processing resumes after the payment's checkpoint,
+        records one after every chunk and stops if the lease is lost.
+        Time spent in each stage is recorded in `timer` (a StageTimer).
+        """
+        chunk_size = chunk_size or getattr(settings, 'MASS_PAYMENT_POSTING_CHUNK_SIZE', 500)
+        last_id = mass_payment.checkpoint_item_id if lease_owner else 0
+        while True:
+            chunk = list(payment_items.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            try:
+                dispatched_items = PaymentProcessor._post_chunk(mass_payment, chunk, reserved=reserved, timer=timer)
+            except Exception as e:
+                # The chunk was rolled back: replay it item by item so that
+                # each failure is recorded on its own item
+                logger.error(f"Batch posting failed for mass payment {mass_payment.id}, "
+                             f"falling back to per-item processing: {str(e)}")
+                PaymentProcessor._post_items_individually(mass_payment, chunk, reserved=reserved, timer=timer)
+            else:
+                PaymentProcessor._dispatch_external_transfers(mass_payment, dispatched_items, reserved=reserved, timer=timer)
+
+            if lease_owner and not PaymentProcessor._checkpoint(mass_payment, last_id, lease_owner):
+                logger.warning(f"Lost the lease on mass payment {mass_payment.id} after item {last_id}, stopping")
+                return
+
+    @staticmethod
+    def _post_items_individually(mass_payment, payment_items, reserved=False, timer=None):
+        """
+        Post items one at a time, marking each item that cannot be posted as failed
+        """
+        for item in MassPaymentItem.objects.filter(
+            id__in=[item.id for item in payment_items],
+            status='pending'
+        ).order_by('id'):
+            try:
+                dispatched_items = PaymentProcessor._post_chunk(mass_payment, [item], reserved=reserved, timer=timer)
+            except Exception as e:
+                logger.error(f"Error processing payment item {item.id}: {str(e)}")
+                MassPaymentItem.objects.filter(id=item.id).update(status='failed', failure_reason=str(e))
+                PaymentProcessor._update_counters(mass_payment, failed=1)
+                continue
+
+            PaymentProcessor._dispatch_external_transfers(mass_payment, dispatched_items, reserved=reserved, timer=timer)
+
+    @staticmethod
+    def reconcile_counters(mass_payment_ids=None, dry_run=False):
+        """
+        Recompute success/failure/pending counters from the payment items.
+        One aggregate query finds the payments whose counters drifted; each of
+        those is then recounted under a lock on its row, so that chunks being
+        posted concurrently apply their F() updates on top of the fixed values.
+        Returns {mass_payment_id: (stored counters, actual counters)} for the
+        payments that were (or, with dry_run, would be) fixed.
+        """
+        payments = MassPayment.objects.all()
+        if mass_payment_ids:
+            payments = payments.filter(id__in=mass_payment_ids)
+
+        drifted = payments.annotate(**PaymentProcessor._item_counts('items__')).exclude(
+            success_count=F('actual_success'),
+            failure_count=F('actual_failure'),
+            pending_count=F('actual_pending')
+        ).values_list('id', flat=True)
+
+        fixed = {}
+        for mass_payment_id in drifted:
+            with transaction.atomic():
+                mass_payment = MassPayment.objects.select_for_update().get(id=mass_payment_id)
+                actual = MassPaymentItem.objects.filter(mass_payment_id=mass_payment_id).aggregate(
+                    **PaymentProcessor._item_counts()
+                )
+                stored = (mass_payment.success_count, mass_payment.failure_count, mass_payment.pending_count)
+                counted = (actual['actual_success'], actual['actual_failure'], actual['actual_pending'])
+                if stored == counted:
+                    continue
+
+                fixed[mass_payment_id] = (stored, counted)
+                logger.warning(f"Counters of mass payment {mass_payment_id} drifted: "
+                               f"stored {stored}, counted {counted} (success, failure, pending)")
+                if not dry_run:
+                    MassPayment.objects.filter(id=mass_payment_id).update(
+                        success_count=counted[0],
+                        failure_count=counted[1],
+                        pending_count=counted[2],
+                        updated_at=timezone.now()
+                    )
+        return fixed
+
+    @staticmethod
+    def _item_counts(prefix=''):
+        """
+        Count() expressions of the items by counter; items waiting for their
+        bank provider ('processing') are still counted as pending
+        """
+        return {
+            'actual_success': Count(f'{prefix}id', filter=Q(**{f'{prefix}status': 'success'})),
+            'actual_failure': Count(f'{prefix}id', filter=Q(**{f'{prefix}status': 'failed'})),
+            'actual_pending': Count(f'{prefix}id', filter=Q(**{f'{prefix}status__in': ['pending', 'processing']})),
+        }
+
+    @staticmethod
+    def _update_counters(mass_payment, succeeded=0, failed=0):
+        """
+        Move items from pending to success/failure with a single atomic UPDATE,
+        mirrored on the in-memory instance
+        """
+        MassPayment.objects.filter(id=mass_payment.id).update(
+            pending_count=F('pending_count') - (succeeded + failed),
+            success_count=F('success_count') + succeeded,
+            failure_count=F('failure_count') + failed,
+            updated_at=timezone.now()
+        )
+        mass_payment.pending_count -= succeeded + failed
+        mass_payment.success_count += succeeded
+        mass_payment.failure_count += failed
+
+    @staticmethod
+    def _post_chunk(mass_payment, payment_items, reserved=False, timer=None):
+        """
+        Post a chunk of payment items with set-based writes: one bulk insert of
+        transactions, one F() credit per destination account, a single debit of
+        the initiator and one bulk update of the items.
+        Outcomes are the same as processing the items one by one, in order.
+        With reserved=True the funds were already taken into the payment's hold:
+        the initiator row is neither locked nor checked, the hold is consumed instead.
+        When external dispatch is enabled, external items are debited but left
+        'processing' with a pending transaction; they are returned for dispatch.
+        Items no longer pending when the chunk starts (posted by another
+        worker) are skipped, so an item is never debited twice.
+        """
+        dispatch_external = getattr(settings, 'EXTERNAL_TRANSFER_DISPATCH', False)
+        timer = timer if timer is not None else StageTimer()
+
+        with timer.chunk() as posted_chunk, transaction.atomic():
+            # Lock the items and keep those still pending
+            with timer.stage('item_lock'):
+                pending_ids = set(MassPaymentItem.objects.select_for_update().filter(
+                    id__in=[item.id for item in payment_items],
+                    status='pending'
+                ).values_list('id', flat=True))
+            payment_items = [item for item in payment_items if item.id in pending_ids]
+            if not payment_items:
+                return []
+            posted_chunk.extend(payment_items)
+
+            # Resolve destinations and external providers for the whole chunk
+            with timer.stage('resolution'):
+                accounts, _ = RecipientResolver.resolve(
+                    (item.destination_phone_number, item.destination_bank_code) for item in payment_items
+                )
+                active_providers = set(BankProviderRegistry.get_many(
+                    (item.destination_bank_code for item in payment_items),
+                    active_only=True
+                ))
+
+            with timer.stage('balance_check'):
+                if reserved:
+                    initiator_account = mass_payment.initiator_account
+                else:
+                    initiator_account = Account.objects.select_for_update().get(
+                        id=mass_payment.initiator_account_id
+                    )
+
+                balance = initiator_account.balance
+                total_debit = Decimal('0.00')
+                credits = defaultdict(Decimal)
+                transactions = []
+                posted_items = []
+                dispatched_items = []
+
+                for item in payment_items:
+                    debit = item.amount + item.fee_amount
+
+                    # Validate initiator has sufficient funds
+                    if not reserved and balance < debit:
+                        item.status = 'failed'
+                        item.failure_reason = "Insufficient funds"
+                        continue
+
+                    # Internal transfer if the destination account exists, external otherwise
+                    destination_account = accounts.get(
+                        (item.destination_phone_number, item.destination_bank_code)
+                    )
+                    if destination_account is None and item.destination_bank_code not in active_providers:
+                        item.status = 'failed'
+                        item.failure_reason = "Bank provider not supported"
+                        continue
+
+                    balance -= debit
+                    total_debit += debit
+                    if destination_account is not None:
+                        credits[destination_account.id] += item.amount
+                        if destination_account.id == initiator_account.id:
+                            balance += item.amount
+
+                    # External transfers are confirmed by the provider after the chunk commits
+                    dispatched = destination_account is None and dispatch_external
+                    transactions.append(Transaction(
+                        transaction_type='transfer',
+                        status='pending' if dispatched else 'success',
+                        amount=item.amount,
+                        source_account=initiator_account,
+                        destination_account=destination_account,
+                        fee_amount=item.fee_amount
+                    ))
+                    posted_items.append(item)
+                    if dispatched:
+                        dispatched_items.append(item)
+
+            with timer.stage('transaction_creation'):
+                Transaction.objects.bulk_create(transactions)
+
+            # Update account balances
+            with timer.stage('account_update'):
+                if reserved:
+                    FundsHoldService.consume(mass_payment, total_debit)
+                elif total_debit:
+                    Account.objects.filter(id=initiator_account.id).update(balance=F('balance') - total_debit)
+                for account_id, amount in credits.items():
+                    Account.objects.filter(id=account_id).update(balance=F('balance') + amount)
+
+            # Link transactions to payment items
+            with timer.stage('item_update'):
+                for item, item_transaction in zip(posted_items, transactions):
+                    item.transaction = item_transaction
+                    item.status = 'success'
+                for item in dispatched_items:
+                    item.status = 'processing'
+                MassPaymentItem.objects.bulk_update(payment_items, ['status', 'transaction', 'failure_reason'])
+
+                # Update counters (dispatched items stay pending until the provider answers)
+                PaymentProcessor._update_counters(
+                    mass_payment,
+                    succeeded=len(posted_items) - len(dispatched_items),
+                    failed=len(payment_items) - len(posted_items)
+                )
+
+        if not reserved:
+            mass_payment.initiator_account.balance = balance
+        return dispatched_items
+
+    @staticmethod
+    def _dispatch_external_transfers(mass_payment, payment_items, reserved=False, timer=None):
+        """
+        Send posted external items to their bank providers and record the outcomes.
+        Failed transfers are refunded (amount and fee) to the hold or the initiator.
+        Transfers parked by a provider's circuit breaker stay 'processing' and are
+        retried by an 'external_retry' job, up to EXTERNAL_TRANSFER_MAX_ATTEMPTS sends.
+        """
+        if not payment_items:
+            return
+        timer = timer if timer is not None else StageTimer()
+
+        providers = BankProviderRegistry.get_many((item.destination_bank_code for item in payment_items), active_only=True)
+        transfers = [
+            {
+                'id': item.id,
+                'reference': f"{mass_payment.reference_code}-{item.id}",
+                'bank_code': item.destination_bank_code,
+                'phone_number': item.destination_phone_number,
+                'amount': str(item.amount),
+            }
+            for item in payment_items
+        ]
+        try:
+            with timer.stage('external_call'):
+                results = ExternalTransferDispatcher.get().dispatch(transfers, providers)
+        except Exception as e:
+            logger.error(f"External dispatch failed for mass payment {mass_payment.id}: {str(e)}")
+            results = {item.id: ('parked', str(e)) for item in payment_items}
+
+        max_attempts = getattr(settings, 'EXTERNAL_TRANSFER_MAX_ATTEMPTS', 5)
+        retry_at = timezone.now() + timedelta(seconds=getattr(settings, 'EXTERNAL_BREAKER_COOLDOWN_SECONDS', 30))
+        now = timezone.now()
+        with timer.stage('external_update'), transaction.atomic():
+            refund = Decimal('0.00')
+            failed = 0
+            parked = 0
+            answered = []
+            for item in payment_items:
+                status, reason = results.get(item.id, ('failed', "No result returned by bank provider"))
+                item.dispatch_attempts += 1
+                if status == 'parked' and item.dispatch_attempts < max_attempts:
+                    # Keep the debit and the pending transaction until the retry
+                    item.next_dispatch_at = retry_at
+                    parked += 1
+                    continue
+
+                item.next_dispatch_at = None
+                item.transaction.updated_at = now
+                if status == 'success':
+                    item.status = 'success'
+                    item.transaction.status = 'success'
+                else:
+                    item.status = 'failed'
+                    item.failure_reason = f"External transfer failed: {reason}"
+                    item.transaction.status = 'failure'
+                    refund += item.amount + item.fee_amount
+                    failed += 1
+                answered.append(item)
+
+            MassPaymentItem.objects.bulk_update(
+                payment_items, ['status', 'failure_reason', 'dispatch_attempts', 'next_dispatch_at']
+            )
+            Transaction.objects.bulk_update(
+                [item.transaction for item in answered], ['status', 'updated_at']
+            )
+
+            if refund:
+                if reserved:
+                    FundsHoldService.consume(mass_payment, -refund)
+                else:
+                    Account.objects.filter(id=mass_payment.initiator_account_id).update(balance=F('balance') + refund)
+                    mass_payment.initiator_account.balance += refund
+
+            PaymentProcessor._update_counters(
+                mass_payment,
+                succeeded=len(answered) - failed,
+                failed=failed
+            )
+
+            if parked:
+                logger.warning(f"Parked {parked} external transfers of mass payment {mass_payment.id} until {retry_at}")
+                PaymentProcessor._schedule_external_retry(mass_payment, retry_at)
+
+    @staticmethod
+    def _schedule_external_retry(mass_payment, retry_at):
+        """
+        Queue an 'external_retry' job for the parked items of a mass payment,
+        unless one is already waiting
+        """
+        if ProcessingJob.objects.filter(
+            job_type='external_retry',
+            object_id=mass_payment.id,
+            status='pending'
+        ).exists():
+            return
+        JobQueue.enqueue(
+            'external_retry',
+            mass_payment.id,
+            delay_seconds=max(0.0, (retry_at - timezone.now()).total_seconds())
+        )
+
+    @staticmethod
+    def retry_parked_transfers(mass_payment_id):
+        """
+        Send again the external transfers of a mass payment whose retry time has
+        come, then finish the payment if nothing is left in flight
+        """
+        mass_payment = MassPayment.objects.select_related('initiator_account').get(id=mass_payment_id)
+        reserved = FundsHold.objects.filter(mass_payment=mass_payment, status='active').exists()
+
+        parked_items = MassPaymentItem.objects.filter(
+            mass_payment=mass_payment,
+            status='processing',
+            next_dispatch_at__isnull=False
+        )
+        due_items = list(
+            parked_items.filter(next_dispatch_at__lte=timezone.now()).select_related('transaction').order_by('id')
+        )
+        timer = StageTimer()
+        try:
+            for chunk in chunked(due_items, getattr(settings, 'MASS_PAYMENT_POSTING_CHUNK_SIZE', 500)):
+                PaymentProcessor._dispatch_external_transfers(mass_payment, chunk, reserved=reserved, timer=timer)
+        finally:
+            PaymentProcessor._save_timings(mass_payment_id, timer)
+
+        # Items parked by another worker in the meantime
+        next_retry = parked_items.order_by('next_dispatch_at').values_list('next_dispatch_at', flat=True).first()
+        if next_retry is not None:
+            PaymentProcessor._schedule_external_retry(mass_payment, next_retry)
+
+        PaymentProcessor._finish_processing(mass_payment_id)
+
+    @staticmethod
+    def _process_payment_item(mass_payment, payment_item, timer=None):
+        """
+        Process a single payment item
+        """
+        timer = timer if timer is not None else StageTimer()
+        with timer.chunk() as posted_chunk, transaction.atomic():
+            posted_chunk.append(payment_item)
             try:
                 # Mark as processing
                 payment_item.status = 'processing'
@@ -62,49 +647,44 @@ class PaymentProcessor:
                     payment_item.save()
                     
                     # Update counters
-                    mass_payment.pending_count -= 1
-                    mass_payment.failure_count += 1
-                    mass_payment.save()
+                    PaymentProcessor._update_counters(mass_payment, failed=1)
                     return
                 
                 # Try to find destination account
                 destination_account = None
-                try:
-                    # Find user by phone number
-                    destination_user = initiator_account.user.__class__.objects.get(
-                        phone_number=payment_item.destination_phone_number
-                    )
-                    
-                    # Find corresponding account 
-                    destination_account = Account.objects.filter(
-                        user=destination_user,
-                        bank_code=payment_item.destination_bank_code,
-                        is_active=True,
-                        is_blocked=False
-                    ).first()
-                except:
-                    # Account not found - would be an external transfer
-                    pass
+                with timer.stage('resolution'):
+                    try:
+                        # Find user by phone number
+                        destination_user = initiator_account.user.__class__.objects.get(
+                            phone_number=payment_item.destination_phone_number
+                        )
+
+                        # Find corresponding account
+                        destination_account = Account.objects.filter(
+                            user=destination_user,
+                            bank_code=payment_item.destination_bank_code,
+                            is_active=True,
+                            is_blocked=False
+                        ).first()
+                    except:
+                        # Account not found - would be an external transfer
+                        pass
                 
-                # Handle based on internal vs external transfer
-                if destination_account:
-                    # Internal transfer
-                    success = PaymentProcessor._process_internal_transfer(
-                        payment_item, initiator_account, destination_account
-                    )
-                else:
-                    # External transfer - would go to external API
-                    success = PaymentProcessor._process_external_transfer(
-                        payment_item, initiator_account
-                    )
+                # Handle based on internal vs external transfer (transaction and balances together)
+                with timer.stage('transfer'):
+                    if destination_account:
+                        # Internal transfer
+                        success = PaymentProcessor._process_internal_transfer(
+                            payment_item, initiator_account, destination_account
+                        )
+                    else:
+                        # External transfer - would go to external API
+                        success = PaymentProcessor._process_external_transfer(
+                            payment_item, initiator_account
+                        )
                 
                 # Update counters
-                mass_payment.pending_count -= 1
-                if success:
-                    mass_payment.success_count += 1
-                else:
-                    mass_payment.failure_count += 1
-                mass_payment.save()
+                PaymentProcessor._update_counters(mass_payment, succeeded=int(success), failed=int(not success))
                 
             except Exception as e:
                 logger.error(f"Error processing payment item {payment_item.id}: {str(e)}")
@@ -113,9 +693,7 @@ class PaymentProcessor:
                 payment_item.save()
                 
                 # Update counters
-                mass_payment.pending_count -= 1
-                mass_payment.failure_count += 1
-                mass_payment.save()
+                PaymentProcessor._update_counters(mass_payment, failed=1)
     
     @staticmethod
     def _process_internal_transfer(payment_item, source_account, destination_account):
@@ -161,16 +739,13 @@ class PaymentProcessor:
     @staticmethod
     def _process_external_transfer(payment_item, source_account):
         """
-        Process transfer to external bank
+        Process transfer to external bank, without calling the provider: only
+        used when EXTERNAL_TRANSFER_DISPATCH is off
         """
         try:
             # Check if bank provider exists
-            try:
-                bank_provider = BankProvider.objects.get(
-                    bank_code=payment_item.destination_bank_code,
-                    is_active=True
-                )
-            except BankProvider.DoesNotExist:
+            bank_provider = BankProviderRegistry.get(payment_item.destination_bank_code, active_only=True)
+            if bank_provider is None:
                 payment_item.status = 'failed'
                 payment_item.failure_reason = "Bank provider not supported"
                 payment_item.save()
@@ -211,7 +786,8 @@ class PaymentProcessor:
     @staticmethod
     def _update_mass_payment_status(mass_payment):
         """
-        Update the overall status of a mass payment
+        Update the overall status of a mass payment from its counters.
+        Only the status is written: the counters are maintained with F() updates.
         """
         if mass_payment.pending_count == 0:
             if mass_payment.failure_count == 0:
@@ -220,4 +796,4 @@ class PaymentProcessor:
                 mass_payment.status = 'failed'
             else:
                 mass_payment.status = 'partially_completed'
-            mass_payment.save()
+            mass_payment.save(update_fields=['status', 'updated_at'])
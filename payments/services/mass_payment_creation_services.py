@@ -0,0 +1,302 @@
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from ..models import MassPayment, MassPaymentItem
+from .funds_hold_services import FundsHoldService, InsufficientFundsError
+from .pricing_services import BatchPricer
+from .recipient_resolver_services import RecipientResolver, chunked
+from .services import logger
+import uuid
+
+
+class InvalidRecipientsError(Exception):
+    """
+    Raised when rows of a recipients file cannot be paid.
+    `errors` lists the first invalid rows, `error_count` counts those found.
+    """
+
+    def __init__(self, errors, error_count=None):
+        super().__init__(f"{error_count or len(errors)} invalid recipients")
+        self.errors = errors
+        self.error_count = error_count or len(errors)
+
+
+class DuplicateReferenceError(Exception):
+    """
+    Raised when a mass payment with the same reference code already exists
+    """
+    pass
+
+
+class MassPaymentCreator:
+    """
+    Materialises a mass payment and its items with chunked bulk inserts.
+    """
+
+    @staticmethod
+    def create(initiator_account, recipients, total_amount, fee_amount,
+               description='', reference='', batch_size=None):
+        """
+        Create a mass payment and all of its items in one transaction, reserving
+        total_amount + fee_amount on the initiator account. Recipients carry
+        their fee_amount (see BatchPricer.price_recipients).
+        Returns (mass_payment, items); raises InsufficientFundsError if the
+        balance cannot cover the reservation, DuplicateReferenceError if the
+        reference is taken.
+        """
+        with transaction.atomic():
+            # Generate a reference code if none provided
+            if not reference:
+                reference = f"MP{uuid.uuid4().hex[:8].upper()}"
+
+            mass_payment = MassPaymentCreator._create_mass_payment(
+                initiator_account=initiator_account,
+                total_amount=total_amount,
+                fee_amount=fee_amount,
+                status='processing',
+                description=description,
+                reference_code=reference,
+                pending_count=len(recipients)
+            )
+
+            # Reserve the funds under a lock on the initiator account, so that
+            # concurrent batches cannot spend the same balance
+            if FundsHoldService.reserve(mass_payment, total_amount + fee_amount) is None:
+                raise InsufficientFundsError("Insufficient funds for the total amount and fees")
+
+            items = MassPaymentCreator.create_items(
+                mass_payment, recipients, batch_size=batch_size
+            )
+
+        return mass_payment, items
+
+    @staticmethod
+    def price_and_create(initiator_account, recipients, description='', reference='', summary_only=False):
+        """
+        Price validated recipients (see RecipientResolver), create the mass
+        payment, its items and its funds hold, and build the 201 payload.
+        Entry point of every endpoint creating a payment from a list of
+        recipients (JSON, template, recipient group).
+        Raises PricingError, InsufficientFundsError or DuplicateReferenceError.
+        """
+        pricing = BatchPricer.price_recipients(recipients, initiator_account)
+        mass_payment, items = MassPaymentCreator.create(
+            initiator_account=initiator_account,
+            recipients=recipients,
+            total_amount=pricing["total_amount"],
+            fee_amount=pricing["fee_amount"],
+            description=description,
+            reference=reference
+        )
+        return MassPaymentCreator.build_response(mass_payment, items, initiator_account, summary_only=summary_only)
+
+    @staticmethod
+    def create_from_rows(initiator_account, rows, description='', reference='', chunk_size=None):
+        """
+        Create a mass payment straight from a stream of recipient rows
+        ({"phone_number", "amount", "bank_code" (optional)}), without holding
+        the whole list in memory. Each chunk is resolved, inserted and its
+        amount plus fees added to the funds hold, so a payment that cannot be
+        covered stops at the first chunk that overdraws the account.
+
+        Every row must be valid: the payment is only committed if all of them
+        are. Raises InvalidRecipientsError, InsufficientFundsError or
+        DuplicateReferenceError.
+        Returns (mass_payment, summary) where summary holds the recipient counts.
+        """
+        chunk_size = chunk_size or getattr(settings, 'MASS_PAYMENT_UPLOAD_CHUNK_SIZE', 1000)
+        max_errors = getattr(settings, 'MASS_PAYMENT_UPLOAD_MAX_ERRORS', 100)
+        errors = []
+        error_count = 0
+        summary = {"recipients_count": 0, "external_recipients_count": 0}
+        schedule = BatchPricer.load_schedule()
+
+        with transaction.atomic():
+            # Generate a reference code if none provided
+            if not reference:
+                reference = f"MP{uuid.uuid4().hex[:8].upper()}"
+
+            mass_payment = MassPaymentCreator._create_mass_payment(
+                initiator_account=initiator_account,
+                total_amount=Decimal('0.00'),
+                fee_amount=Decimal('0.00'),
+                status='processing',
+                description=description,
+                reference_code=reference
+            )
+
+            row_number = 0
+            for chunk in chunked(rows, chunk_size):
+                recipients = []
+                for row in chunk:
+                    row_number += 1
+                    recipient, error = MassPaymentCreator._parse_row(row, row_number)
+                    if error is not None:
+                        error_count += 1
+                        if len(errors) < max_errors:
+                            errors.append(error)
+                        continue
+                    recipients.append(recipient)
+
+                accounts, failures = RecipientResolver.resolve(
+                    (recipient['phone_number'], recipient['bank_code']) for recipient in recipients
+                )
+                for index, failure in failures.items():
+                    error_count += 1
+                    if len(errors) < max_errors:
+                        errors.append(dict(failure, row=recipients[index]['row']))
+
+                if error_count:
+                    # Keep validating to report the errors, but stop writing
+                    if len(errors) >= max_errors:
+                        break
+                    continue
+
+                for recipient in recipients:
+                    account = accounts[(recipient['phone_number'], recipient['bank_code'])]
+                    recipient['destination_account'] = account
+                    recipient['bank_code'] = account.bank_code
+
+                pricing = BatchPricer.price_recipients(recipients, initiator_account, schedule=schedule)
+                MassPaymentCreator.create_items(mass_payment, recipients, batch_size=chunk_size)
+
+                chunk_amount = pricing["total_amount"]
+                chunk_fees = pricing["fee_amount"]
+                if FundsHoldService.extend(mass_payment, chunk_amount + chunk_fees) is None:
+                    raise InsufficientFundsError(
+                        f"Insufficient funds for the total amount and fees "
+                        f"(exceeded after {row_number} rows)"
+                    )
+
+                mass_payment.total_amount += chunk_amount
+                mass_payment.fee_amount += chunk_fees
+                summary["recipients_count"] += len(recipients)
+                summary["external_recipients_count"] += sum(
+                    1 for recipient in recipients
+                    if recipient['bank_code'] != initiator_account.bank_code
+                )
+
+            if error_count:
+                raise InvalidRecipientsError(sorted(errors, key=lambda error: error['row']), error_count)
+            if not summary["recipients_count"]:
+                raise InvalidRecipientsError([{"row": None, "field": "file", "error": "No recipients in file"}])
+
+            mass_payment.pending_count = summary["recipients_count"]
+            mass_payment.save(update_fields=['total_amount', 'fee_amount', 'pending_count', 'updated_at'])
+
+        logger.info(f"Created mass payment {mass_payment.id} from {summary['recipients_count']} uploaded rows")
+        return mass_payment, summary
+
+    @staticmethod
+    def _create_mass_payment(**fields):
+        """
+        Insert the MassPayment row, turning a reference_code clash into DuplicateReferenceError
+        """
+        try:
+            with transaction.atomic():
+                return MassPayment.objects.create(**fields)
+        except IntegrityError:
+            if MassPayment.objects.filter(reference_code=fields['reference_code']).exists():
+                raise DuplicateReferenceError(
+                    f"A mass payment with reference {fields['reference_code']} already exists"
+                )
+            raise
+
+    @staticmethod
+    def _parse_row(row, row_number):
+        """
+        Validate one uploaded row. Returns (recipient, None) or (None, error).
+        """
+        phone_number = str(row.get('phone_number') or '').strip()
+        bank_code = str(row.get('bank_code') or '').strip() or None
+        if not phone_number:
+            return None, {"row": row_number, "field": "phone_number", "error": "This field is required."}
+
+        try:
+            amount = Decimal(str(row.get('amount') or '').strip())
+        except InvalidOperation:
+            return None, {"row": row_number, "field": "amount", "error": "A valid number is required."}
+        if not amount.is_finite() or amount <= 0:
+            return None, {"row": row_number, "field": "amount", "error": "Amount must be greater than zero."}
+        if amount >= Decimal('1e13') or amount != amount.quantize(Decimal('0.01')):
+            return None, {
+                "row": row_number,
+                "field": "amount",
+                "error": "Ensure that there are no more than 15 digits and 2 decimal places."
+            }
+
+        return {
+            "row": row_number,
+            "phone_number": phone_number,
+            "bank_code": bank_code,
+            "amount": amount.quantize(Decimal('0.01')),
+        }, None
+
+    @staticmethod
+    def create_items(mass_payment, recipients, batch_size=None):
+        """
+        Insert the payment items of a mass payment, `batch_size` rows per INSERT
+        """
+        batch_size = batch_size or getattr(settings, 'MASS_PAYMENT_BULK_CREATE_BATCH_SIZE', 1000)
+        items = []
+        for chunk in chunked(recipients, batch_size):
+            items.extend(MassPaymentItem.objects.bulk_create([
+                MassPaymentItem(
+                    mass_payment=mass_payment,
+                    destination_phone_number=recipient['phone_number'],
+                    destination_account=recipient['destination_account'],
+                    destination_bank_code=recipient['bank_code'],
+                    amount=recipient['amount'],
+                    fee_amount=recipient['fee_amount']
+                )
+                for recipient in chunk
+            ]))
+        return items
+
+    @staticmethod
+    def build_response(mass_payment, items, initiator_account, summary_only=False):
+        """
+        Build the 201 payload of a mass payment creation.
+        With summary_only the per-recipient echo is left out.
+        """
+        response_data = MassPaymentCreator.build_summary(
+            mass_payment,
+            recipients_count=len(items),
+            external_recipients_count=sum(
+                1 for item in items
+                if item.destination_bank_code != initiator_account.bank_code
+            )
+        )
+
+        if not summary_only:
+            response_data["recipients"] = [
+                {
+                    "id": item.id,
+                    "phone_number": item.destination_phone_number,
+                    "bank_code": item.destination_bank_code,
+                    "amount": item.amount,
+                    "fee_amount": item.fee_amount,
+                    "status": item.status
+                }
+                for item in items
+            ]
+
+        return response_data
+
+    @staticmethod
+    def build_summary(mass_payment, recipients_count, external_recipients_count):
+        """
+        Build the summary part of a mass payment creation payload
+        """
+        return {
+            "mass_payment_id": mass_payment.id,
+            "reference_code": mass_payment.reference_code,
+            "status": mass_payment.status,
+            "total_amount": mass_payment.total_amount,
+            "fee_amount": mass_payment.fee_amount,
+            "created_at": mass_payment.created_at,
+            "recipients_count": recipients_count,
+            "external_recipients_count": external_recipients_count,
+            "estimated_completion_time": timezone.now() + timezone.timedelta(minutes=30),
+        }
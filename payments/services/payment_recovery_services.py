@@ -0,0 +1,149 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, Min, OuterRef, Q
+from django.utils import timezone
+from ..models import MassPayment, MassPaymentItem, ProcessingJob
+from .job_queue_services import JobQueue
+from .mass_payement_services import PaymentProcessor
+from .recipient_resolver_services import chunked
+from .services import logger
+
+
+class PaymentRecovery:
+    """
+    Finds mass payments abandoned in 'processing' by a crashed worker and
+    resumes them.
+
+    A payment is abandoned when its lease has expired and no job is queued or
+    running for it. Its items left 'processing' are reconciled against their
+    Transaction: transfers already confirmed are marked successful, posted
+    transfers whose provider answer was lost are parked for an 'external_retry'
+    (sent again with the same reference, never debited again) and items without
+    a transaction go back to pending. A new 'mass_payment' job then resumes
+    the posting from the payment's checkpoint.
+    Runs at worker startup and every MASS_PAYMENT_RECOVERY_INTERVAL_SECONDS
+    (see manage.py run_payment_workers), or with manage.py recover_mass_payments.
+    """
+    JOB_TYPES = ('mass_payment', 'mass_payment_shard', 'external_retry')
+
+    @staticmethod
+    def abandoned_payments(now=None):
+        """
+        Mass payments in 'processing' that nobody is working on
+        """
+        now = now or timezone.now()
+        live_jobs = ProcessingJob.objects.filter(
+            object_id=OuterRef('id'),
+            job_type__in=PaymentRecovery.JOB_TYPES
+        ).filter(
+            Q(status='pending') | Q(status='running', lease_expires_at__gte=now)
+        )
+        return MassPayment.objects.filter(status='processing').filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+        ).exclude(Exists(live_jobs))
+
+    @staticmethod
+    def scan():
+        """
+        Recover every abandoned mass payment. Returns the number recovered.
+        """
+        recovered = 0
+        for mass_payment_id in PaymentRecovery.abandoned_payments().values_list('id', flat=True):
+            try:
+                if PaymentRecovery.recover(mass_payment_id):
+                    recovered += 1
+            except Exception as e:
+                logger.error(f"Could not recover mass payment {mass_payment_id}: {str(e)}")
+        return recovered
+
+    @staticmethod
+    def recover(mass_payment_id):
+        """
+        Reconcile and resume one abandoned mass payment.
+        Returns False if it is no longer abandoned or was given up.
+        """
+        max_recoveries = getattr(settings, 'MASS_PAYMENT_MAX_RECOVERIES', 5)
+
+        with transaction.atomic():
+            mass_payment = PaymentRecovery.abandoned_payments().select_for_update(of=('self',)).filter(
+                id=mass_payment_id
+            ).select_related('initiator_account').first()
+            if mass_payment is None:
+                return False
+
+            if mass_payment.recovery_count >= max_recoveries:
+                logger.error(f"Mass payment {mass_payment_id} was recovered {mass_payment.recovery_count} "
+                             f"times without finishing, leaving it for manual review")
+                return False
+
+            reconciled = PaymentRecovery._reconcile_items(mass_payment)
+
+            MassPayment.objects.filter(id=mass_payment_id).update(
+                lease_owner='',
+                lease_expires_at=None,
+                checkpoint_item_id=mass_payment.checkpoint_item_id,
+                recovery_count=F('recovery_count') + 1,
+                updated_at=timezone.now()
+            )
+
+            items = MassPaymentItem.objects.filter(mass_payment_id=mass_payment_id)
+            resume = items.filter(status='pending').exists()
+            if resume:
+                JobQueue.enqueue('mass_payment', mass_payment_id)
+
+            next_retry = items.filter(
+                status='processing',
+                next_dispatch_at__isnull=False
+            ).aggregate(next_retry=Min('next_dispatch_at'))['next_retry']
+            if next_retry is not None:
+                PaymentProcessor._schedule_external_retry(mass_payment, next_retry)
+
+        logger.warning(f"Recovered mass payment {mass_payment_id} from checkpoint {mass_payment.checkpoint_item_id}: "
+                       f"{reconciled['succeeded']} confirmed, {reconciled['parked']} to send again, "
+                       f"{reconciled['reset']} back to pending")
+
+        # Nothing left to do but settle
+        if not resume and next_retry is None:
+            PaymentProcessor._finish_processing(mass_payment_id)
+        return True
+
+    @staticmethod
+    def _reconcile_items(mass_payment):
+        """
+        Settle the items left 'processing' without a scheduled retry, in the
+        caller's transaction. Returns the counts of each outcome.
+        """
+        counts = {"succeeded": 0, "parked": 0, "reset": 0}
+        orphans = list(MassPaymentItem.objects.filter(
+            mass_payment=mass_payment,
+            status='processing',
+            next_dispatch_at__isnull=True
+        ).select_related('transaction').order_by('id'))
+
+        now = timezone.now()
+        for chunk in chunked(orphans, getattr(settings, 'MASS_PAYMENT_POSTING_CHUNK_SIZE', 500)):
+            succeeded = 0
+            for item in chunk:
+                if item.transaction is None:
+                    # Never posted: the posting transaction rolled back
+                    item.status = 'pending'
+                    counts["reset"] += 1
+                    # Post it again even if it is behind the checkpoint
+                    mass_payment.checkpoint_item_id = min(mass_payment.checkpoint_item_id, item.id - 1)
+                elif item.transaction.status == 'success':
+                    item.status = 'success'
+                    succeeded += 1
+                elif item.transaction.status == 'pending':
+                    # Debited, but the provider's answer was lost: send it again
+                    item.next_dispatch_at = now
+                    counts["parked"] += 1
+                else:
+                    logger.error(f"Payment item {item.id} is processing with a failed transaction, "
+                                 f"leaving it for manual review")
+
+            MassPaymentItem.objects.bulk_update(chunk, ['status', 'next_dispatch_at'])
+            if succeeded:
+                PaymentProcessor._update_counters(mass_payment, succeeded=succeeded)
+            counts["succeeded"] += succeeded
+
+        return counts
@@ -0,0 +1,156 @@
+from decimal import Decimal
+from itertools import repeat
+from .fee_schedule_registry_services import FeeScheduleRegistry
+import numpy as np
+
+
+class PricingError(Exception):
+    """
+    Raised when a batch of amounts cannot be priced
+    """
+    pass
+
+
+class BatchPricer:
+    """
+    Prices a whole batch of payment items in one vectorised pass.
+
+    Amounts are converted once to integer minor units (cents) in an int64
+    array; fees, totals and per-bank subtotals are computed with NumPy integer
+    arithmetic and converted back to Decimal, so results are exact.
+    Fees follow the compiled FeeSchedule tiers of FeeScheduleRegistry.
+    """
+    MAX_TOTAL_MINOR = 10 ** 15  # max_digits=15, decimal_places=2
+
+    @staticmethod
+    def load_schedule():
+        """
+        Return the compiled fee schedules, to price several batches with the same rules
+        """
+        return FeeScheduleRegistry.schedules()
+
+    @staticmethod
+    def to_minor(amount):
+        """
+        Convert a Decimal amount to an int number of cents.
+        Raises PricingError if it has more than 2 decimal places or 15 digits.
+        """
+        minor = Decimal(amount).scaleb(2)
+        if not minor.is_finite() or minor != minor.to_integral_value():
+            raise PricingError(f"Invalid amount {amount}: at most 2 decimal places are allowed")
+        if abs(minor) >= BatchPricer.MAX_TOTAL_MINOR:
+            raise PricingError(f"Invalid amount {amount}: at most 15 digits are allowed")
+        return int(minor)
+
+    @staticmethod
+    def to_decimal(minor):
+        """
+        Convert an int number of cents back to a Decimal amount
+        """
+        return Decimal(int(minor)).scaleb(-2)
+
+    @staticmethod
+    def to_minor_array(amounts):
+        """
+        Convert a list of Decimal amounts to an int64 array of cents
+        """
+        try:
+            # map() keeps the per-item work in C
+            scaled = list(map(Decimal.scaleb, amounts, repeat(2)))
+            minor = list(map(int, scaled))
+            if scaled == minor:
+                array = np.array(minor, dtype=np.int64)
+                if not len(array) or np.abs(array).max() < BatchPricer.MAX_TOTAL_MINOR:
+                    return array
+        except (TypeError, ValueError, OverflowError):
+            pass
+
+        # Slow path, to report the offending amount
+        return np.fromiter(map(BatchPricer.to_minor, amounts), dtype=np.int64, count=len(amounts))
+
+    @staticmethod
+    def price(amounts, bank_codes, initiator_account=None, schedule=None):
+        """
+        Price a batch given its amount and destination bank columns.
+        Destinations outside the initiator account's bank are external
+        transfers. Returns {"fees": [Decimal per item], "total_amount",
+        "fee_amount", "by_bank": {bank_code: {"count", "amount", "fee_amount"}}}.
+        Raises PricingError for non-positive amounts or totals that do not fit
+        the amount fields.
+        """
+        count = len(amounts)
+        schedules = schedule if schedule is not None else BatchPricer.load_schedule()
+
+        minor = BatchPricer.to_minor_array(amounts)
+        if count and minor.min() <= 0:
+            raise PricingError("Amounts must be greater than zero")
+        # Keeps the int64 sums below from overflowing
+        if count and int(minor.max()) * count >= np.iinfo(np.int64).max:
+            raise PricingError("Batch total is too large")
+
+        # Index the destination banks: the batch is priced bank by bank
+        bank_index = {bank_code: index for index, bank_code in enumerate(dict.fromkeys(bank_codes))}
+        banks = np.fromiter(map(bank_index.__getitem__, bank_codes), dtype=np.intp, count=count)
+
+        initiator_account_id = initiator_account.id if initiator_account is not None else None
+        fees = np.zeros(count, dtype=np.int64)
+        by_bank = {}
+        for bank_code, index in bank_index.items():
+            mask = banks == index
+            bank_amounts = minor[mask]
+
+            if initiator_account is None:
+                transfer_type = None
+            elif bank_code == initiator_account.bank_code:
+                transfer_type = 'internal'
+            else:
+                transfer_type = 'external'
+            min_amounts, flat_fees, basis_points = FeeScheduleRegistry.lookup(
+                schedules, initiator_account_id, bank_code, transfer_type
+            )
+            # Tier of each amount; amounts below the first tier use it too
+            tier = np.maximum(np.searchsorted(min_amounts, bank_amounts, side='right') - 1, 0)
+
+            # flat + amount * rate / 10000, rounded half up, without overflowing int64
+            rate = basis_points[tier]
+            whole, rest = np.divmod(bank_amounts, 10000)
+            bank_fees = flat_fees[tier] + whole * rate + (rest * rate + 5000) // 10000
+            fees[mask] = bank_fees
+
+            by_bank[bank_code] = {
+                "count": len(bank_amounts),
+                "amount": BatchPricer.to_decimal(bank_amounts.sum()),
+                "fee_amount": BatchPricer.to_decimal(bank_fees.sum()),
+            }
+
+        total_amount = int(minor.sum())
+        fee_amount = int(fees.sum())
+        if total_amount + fee_amount >= BatchPricer.MAX_TOTAL_MINOR:
+            raise PricingError("Batch total is too large")
+
+        # Few distinct fees in practice: convert each once
+        fee_values = fees.tolist()
+        decimals = {fee: BatchPricer.to_decimal(fee) for fee in set(fee_values)}
+
+        return {
+            "fees": list(map(decimals.__getitem__, fee_values)),
+            "total_amount": BatchPricer.to_decimal(total_amount),
+            "fee_amount": BatchPricer.to_decimal(fee_amount),
+            "by_bank": by_bank,
+        }
+
+    @staticmethod
+    def price_recipients(recipients, initiator_account=None, schedule=None):
+        """
+        Price a list of recipient dicts ({"amount", "bank_code", ...}), setting
+        each one's "fee_amount". Returns the result of price().
+        """
+        pricing = BatchPricer.price(
+            [recipient['amount'] for recipient in recipients],
+            [recipient['bank_code'] for recipient in recipients],
+            initiator_account=initiator_account,
+            schedule=schedule
+        )
+        for recipient, fee in zip(recipients, pricing["fees"]):
+            recipient['fee_amount'] = fee
+        return pricing
@@ -0,0 +1,252 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from django.db import transaction
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ..models import MassPayment
+import bisect
+import threading
+import time
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels, kept in memory by the process
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, count=1, **labels):
+        """
+        Record `count` observations of `value` seconds
+        """
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if position < len(self.buckets):
+                series[0][position] += count
+            series[1] += value * count
+            series[2] += count
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (
+            (name, value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+            for name, value in pairs
+        )
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+    def expose(self):
+        """
+        Lines of the Prometheus text format
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(buckets), total, count) for key, (buckets, total, count) in self._series.items())
+        for key, buckets, total, count in series:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(pairs + [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{self._labels(pairs)} {total!r}")
+            lines.append(f"{self.name}_count{self._labels(pairs)} {count}")
+        return lines
+
+
+class ProcessingMetrics:
+    """
+    Process-wide timing histograms of mass payment processing, served in the
+    Prometheus text format by GET /metrics (web process) and by
+    run_payment_workers --metrics-port (payment workers).
+    """
+    SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    STAGE_SECONDS = Histogram(
+        'mass_payment_stage_seconds',
+        'Time spent in a processing stage, per chunk of items',
+        ['stage'], SECONDS_BUCKETS
+    )
+    CHUNK_SECONDS = Histogram(
+        'mass_payment_chunk_seconds',
+        'Time to post a chunk of items, commit included',
+        [], SECONDS_BUCKETS
+    )
+    ITEM_SECONDS = Histogram(
+        'mass_payment_item_seconds',
+        'Posting time per item (share of its chunk when posted in batches), by destination bank and outcome',
+        ['bank_code', 'status'], SECONDS_BUCKETS
+    )
+    EXTERNAL_REQUEST_SECONDS = Histogram(
+        'mass_payment_external_request_seconds',
+        'Duration of the requests to the bank providers, by provider and outcome',
+        ['bank_code', 'status'], SECONDS_BUCKETS
+    )
+    HISTOGRAMS = (STAGE_SECONDS, CHUNK_SECONDS, ITEM_SECONDS, EXTERNAL_REQUEST_SECONDS)
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    @staticmethod
+    def observe_items(seconds, items):
+        """
+        Share `seconds` between posted `items`, by destination bank and status
+        """
+        if not items:
+            return
+        per_item = seconds / len(items)
+        for (bank_code, status), count in Counter(
+            (item.destination_bank_code, item.status) for item in items
+        ).items():
+            ProcessingMetrics.ITEM_SECONDS.observe(per_item, count, bank_code=bank_code, status=status)
+
+    @staticmethod
+    def expose():
+        """
+        Every histogram in the Prometheus text format
+        """
+        lines = []
+        for histogram in ProcessingMetrics.HISTOGRAMS:
+            lines.extend(histogram.expose())
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def reset():
+        for histogram in ProcessingMetrics.HISTOGRAMS:
+            histogram.reset()
+
+    @staticmethod
+    def serve(port, host='0.0.0.0'):
+        """
+        Serve GET /metrics from a background thread (processes without the
+        web application, such as the payment workers). Returns the server.
+        """
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') not in ('', '/metrics'):
+            self.send_error(404)
+            return
+        data = ProcessingMetrics.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', ProcessingMetrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StageTimer:
+    """
+    Time spent by one processing run (a job, a shard or a retry of external
+    transfers) in each stage, also observed in ProcessingMetrics.STAGE_SECONDS.
+    save() adds it to the payment's timing breakdown (MassPayment.timings).
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.chunks = 0
+        self.items = 0
+        self.chunk_seconds = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds[name] += elapsed
+            self.calls[name] += 1
+            ProcessingMetrics.STAGE_SECONDS.observe(elapsed, stage=name)
+
+    @contextmanager
+    def chunk(self):
+        """
+        Time the posting of a chunk, commit included. The block adds the items
+        it posted to the yielded list; once it exits they carry their outcome
+        and are observed per item (not if the block raised: it was rolled back).
+        """
+        items = []
+        started = time.perf_counter()
+        try:
+            yield items
+        except BaseException:
+            items = []
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.chunks += 1
+            self.items += len(items)
+            self.chunk_seconds += elapsed
+            ProcessingMetrics.CHUNK_SECONDS.observe(elapsed)
+            ProcessingMetrics.observe_items(elapsed, items)
+
+    def summary(self):
+        """
+        Posting time and stages by decreasing time, for the logs
+        """
+        return ", ".join([f"posting {self.chunk_seconds:.3f}s"] + [
+            f"{name} {seconds:.3f}s" for name, seconds in sorted(self.seconds.items(), key=lambda stage: -stage[1])
+        ])
+
+    def merge(self, timings):
+        """
+        Add this run to a stored breakdown: {"runs", "chunks", "items",
+        "chunk_seconds" (posting time, commits included), "stages": {stage:
+        {"seconds", "calls"}}}, stages by decreasing time
+        """
+        timings = dict(timings or {})
+        stages = dict(timings.get('stages', {}))
+        for name, seconds in self.seconds.items():
+            stored = stages.get(name, {"seconds": 0, "calls": 0})
+            stages[name] = {
+                "seconds": round(stored["seconds"] + seconds, 6),
+                "calls": stored["calls"] + self.calls[name],
+            }
+        timings.update(
+            runs=timings.get('runs', 0) + 1,
+            chunks=timings.get('chunks', 0) + self.chunks,
+            items=timings.get('items', 0) + self.items,
+            chunk_seconds=round(timings.get('chunk_seconds', 0) + self.chunk_seconds, 6),
+            stages=dict(sorted(stages.items(), key=lambda stage: -stage[1]["seconds"])),
+        )
+        return timings
+
+    def save(self, mass_payment_id):
+        """
+        Add this run to the mass payment's timing breakdown, under a lock on
+        its row since shards of the same payment finish concurrently
+        """
+        if not self.calls and not self.chunks:
+            return
+        with transaction.atomic():
+            mass_payment = MassPayment.objects.select_for_update().only('id', 'timings').filter(
+                id=mass_payment_id
+            ).first()
+            if mass_payment is None:
+                return
+            mass_payment.timings = self.merge(mass_payment.timings)
+            mass_payment.save(update_fields=['timings'])
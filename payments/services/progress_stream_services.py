@@ -0,0 +1,148 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from ..models import MassPayment, MassPaymentItem
+import asyncio
+import json
+import time
+
+
+class MassPaymentProgressStream:
+    """
+    Server-Sent Events stream of a mass payment's progress.
+
+    The processor moves the payment's counters with one F() update per
+    committed chunk, so the stream watches that single row: every
+    MASS_PAYMENT_EVENTS_POLL_INTERVAL seconds it reads a few columns by
+    primary key and, only when they changed, sends a 'progress' event (counts,
+    delta since the previous event, throughput, ETA) and, if items failed, a
+    'failures' event with those recorded past the last reported one (at most
+    MASS_PAYMENT_EVENTS_MAX_FAILURES, read from the (mass_payment, status, id)
+    index). An 'end' event closes the stream once the payment is finished.
+    """
+    FIELDS = ('status', 'success_count', 'failure_count', 'pending_count')
+    FINAL_STATUSES = ('completed', 'failed', 'partially_completed')
+
+    @staticmethod
+    def format_event(event, data, event_id=None):
+        """
+        Encode one SSE event
+        """
+        lines = []
+        if event_id is not None:
+            lines.append(f"id: {event_id}")
+        lines.append(f"event: {event}")
+        lines.append(f"data: {json.dumps(data, cls=DjangoJSONEncoder)}")
+        return "\n".join(lines) + "\n\n"
+
+    @staticmethod
+    async def snapshot(mass_payment_id):
+        """
+        Current counters of a mass payment, or None if it does not exist
+        """
+        return await MassPayment.objects.filter(id=mass_payment_id).values(
+            *MassPaymentProgressStream.FIELDS
+        ).afirst()
+
+    @staticmethod
+    async def failures_after(mass_payment_id, last_failure_id, limit):
+        """
+        Failed items with an id above last_failure_id, in id order
+        """
+        items = MassPaymentItem.objects.filter(
+            mass_payment_id=mass_payment_id,
+            status='failed',
+            id__gt=last_failure_id
+        ).order_by('id').values(
+            'id', 'destination_phone_number', 'destination_bank_code', 'amount', 'failure_reason'
+        )[:limit]
+        return [item async for item in items]
+
+    @staticmethod
+    def progress(snapshot, previous, elapsed):
+        """
+        Build the payload of a 'progress' event from two snapshots
+        """
+        processed = snapshot['success_count'] + snapshot['failure_count']
+        total = processed + snapshot['pending_count']
+        delta = {
+            name: snapshot[name] - previous[name]
+            for name in ('success_count', 'failure_count', 'pending_count')
+        } if previous is not None else None
+
+        items_per_second = None
+        eta_seconds = None
+        if delta is not None and elapsed > 0:
+            items_per_second = round((delta['success_count'] + delta['failure_count']) / elapsed, 1)
+            if items_per_second > 0:
+                eta_seconds = round(snapshot['pending_count'] / items_per_second)
+
+        return {
+            **snapshot,
+            "processed_count": processed,
+            "total_count": total,
+            "percentage": round(processed * 100 / total, 2) if total else 100.0,
+            "delta": delta,
+            "items_per_second": items_per_second,
+            "eta_seconds": eta_seconds,
+        }
+
+    @staticmethod
+    async def events(mass_payment_id, last_failure_id=0):
+        """
+        Yield the SSE events of a mass payment until it is finished.
+        Event ids are the last reported failed item id, so a reconnecting
+        client (Last-Event-ID) does not get the same failures twice.
+        """
+        poll_interval = getattr(settings, 'MASS_PAYMENT_EVENTS_POLL_INTERVAL', 1.0)
+        heartbeat_seconds = getattr(settings, 'MASS_PAYMENT_EVENTS_HEARTBEAT_SECONDS', 15)
+        max_failures = getattr(settings, 'MASS_PAYMENT_EVENTS_MAX_FAILURES', 20)
+
+        # Tell EventSource how long to wait before reconnecting
+        yield f"retry: {int(poll_interval * 1000) * 3}\n\n"
+
+        previous = None
+        more_failures = False
+        previous_at = time.monotonic()
+        last_sent_at = previous_at
+        while True:
+            snapshot = await MassPaymentProgressStream.snapshot(mass_payment_id)
+            if snapshot is None:
+                yield MassPaymentProgressStream.format_event('end', {"status": "deleted"}, last_failure_id)
+                return
+
+            now = time.monotonic()
+            if snapshot != previous:
+                yield MassPaymentProgressStream.format_event(
+                    'progress',
+                    MassPaymentProgressStream.progress(snapshot, previous, now - previous_at),
+                    last_failure_id
+                )
+
+            if previous is None or snapshot['failure_count'] != previous['failure_count'] or more_failures:
+                failures = await MassPaymentProgressStream.failures_after(
+                    mass_payment_id, last_failure_id, max_failures
+                )
+                # A full page: report the rest at the next poll
+                more_failures = len(failures) == max_failures
+                if failures:
+                    last_failure_id = failures[-1]['id']
+                    yield MassPaymentProgressStream.format_event('failures', failures, last_failure_id)
+                    last_sent_at = now
+
+            if snapshot != previous:
+                previous = snapshot
+                previous_at = now
+                last_sent_at = now
+            elif now - last_sent_at >= heartbeat_seconds:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                last_sent_at = now
+
+            if snapshot['status'] in MassPaymentProgressStream.FINAL_STATUSES:
+                if more_failures:
+                    # Drain the remaining failures before closing
+                    continue
+                yield MassPaymentProgressStream.format_event('end', {"status": snapshot['status']}, last_failure_id)
+                return
+
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,153 @@
+from io import TextIOWrapper
+from pathlib import Path
+import csv
+import gzip
+import json
+
+# Optional decoders
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class UnsupportedFileFormat(Exception):
+    """
+    Raised when a recipient file cannot be decoded
+    """
+    pass
+
+
+class RecipientFileReader:
+    """
+    Decodes recipient files into a lazy stream of row dicts
+    ({"phone_number", "amount", "motive"}) for RecipientImporter.
+
+    Supported: CSV and NDJSON, optionally gzip- or zstd-compressed (zstd needs
+    the zstandard package), and Parquet or Arrow IPC files (need pyarrow).
+    Compression is recognised by its magic bytes, the format by the file
+    extension or, failing that, by the content.
+    """
+    GZIP_MAGIC = b'\x1f\x8b'
+    ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+    PARQUET_MAGIC = b'PAR1'
+    ARROW_MAGIC = b'ARROW1'
+    ARROW_STREAM_MAGIC = b'\xff\xff\xff\xff'  # Continuation marker of the first IPC message
+
+    FORMATS_BY_EXTENSION = {
+        '.csv': 'csv',
+        '.txt': 'csv',
+        '.ndjson': 'ndjson',
+        '.jsonl': 'ndjson',
+        '.parquet': 'parquet',
+        '.arrow': 'arrow',
+        '.arrows': 'arrow',
+        '.feather': 'arrow',
+        '.ipc': 'arrow',
+    }
+    COMPRESSED_EXTENSIONS = ('.gz', '.gzip', '.zst', '.zstd')
+
+    # Rows decoded at a time from columnar files
+    COLUMNAR_BATCH_SIZE = 10000
+
+    @staticmethod
+    def detect(source, file_name=''):
+        """
+        Return (compression, format) of a seekable binary file, leaving it at
+        its start. Raises UnsupportedFileFormat.
+        """
+        head = source.read(8)
+        source.seek(0)
+
+        if head.startswith(RecipientFileReader.GZIP_MAGIC):
+            compression = 'gzip'
+        elif head.startswith(RecipientFileReader.ZSTD_MAGIC):
+            if zstandard is None:
+                raise UnsupportedFileFormat("zstd-compressed files require the zstandard package")
+            compression = 'zstd'
+        else:
+            compression = None
+
+        suffixes = [suffix.lower() for suffix in Path(file_name or '').suffixes]
+        if suffixes and suffixes[-1] in RecipientFileReader.COMPRESSED_EXTENSIONS:
+            suffixes.pop()
+        file_format = RecipientFileReader.FORMATS_BY_EXTENSION.get(suffixes[-1] if suffixes else None)
+
+        if compression is None and head.startswith(RecipientFileReader.PARQUET_MAGIC):
+            file_format = 'parquet'
+        elif compression is None and head.startswith((RecipientFileReader.ARROW_MAGIC,
+                                                      RecipientFileReader.ARROW_STREAM_MAGIC)):
+            file_format = 'arrow'
+        elif file_format is None:
+            # Unknown extension: NDJSON if the content starts with an object
+            sample = RecipientFileReader._decompressed(source, compression).read(64)
+            source.seek(0)
+            file_format = 'ndjson' if sample.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'{') else 'csv'
+
+        if file_format in ('parquet', 'arrow'):
+            if compression is not None:
+                raise UnsupportedFileFormat(f"Compressed {file_format} files are not supported")
+            if pyarrow is None:
+                raise UnsupportedFileFormat(f"{file_format} files require the pyarrow package")
+
+        return compression, file_format
+
+    @staticmethod
+    def rows(source, file_name=''):
+        """
+        Yield the rows of a seekable binary file as dicts, decoding it as it is read
+        """
+        compression, file_format = RecipientFileReader.detect(source, file_name)
+
+        if file_format == 'parquet':
+            return RecipientFileReader._parquet_rows(source)
+        if file_format == 'arrow':
+            return RecipientFileReader._arrow_rows(source)
+
+        text = TextIOWrapper(RecipientFileReader._decompressed(source, compression), encoding='utf-8-sig')
+        if file_format == 'ndjson':
+            return RecipientFileReader._ndjson_rows(text)
+        return csv.DictReader(text)
+
+    @staticmethod
+    def _decompressed(source, compression):
+        if compression == 'gzip':
+            return gzip.GzipFile(fileobj=source, mode='rb')
+        if compression == 'zstd':
+            return zstandard.ZstdDecompressor().stream_reader(source, read_across_frames=True, closefd=False)
+        return source
+
+    @staticmethod
+    def _ndjson_rows(text):
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise UnsupportedFileFormat(f"Invalid JSON on line {line_number}")
+            yield row if isinstance(row, dict) else {}
+
+    @staticmethod
+    def _parquet_rows(source):
+        parquet_file = pyarrow.parquet.ParquetFile(source)
+        for batch in parquet_file.iter_batches(batch_size=RecipientFileReader.COLUMNAR_BATCH_SIZE):
+            yield from batch.to_pylist()
+
+    @staticmethod
+    def _arrow_rows(source):
+        if source.read(6) == RecipientFileReader.ARROW_MAGIC:
+            source.seek(0)
+            reader = pyarrow.ipc.open_file(source)
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        else:
+            source.seek(0)
+            batches = pyarrow.ipc.open_stream(source)
+        for batch in batches:
+            yield from batch.to_pylist()
@@ -1,8 +1,16 @@
+from django.conf import settings
 from django.db import transaction
 from ..models import Account, GroupRecipient, RecipientGroup, User
+from .recipient_resolver_services import RecipientResolver
 from .services import logger
 
 class RecipientGroupProcessor:
+    # Same messages as validate_recipient()
+    VALIDATION_ERRORS = {
+        'phone_number': "User not found with the provided phone number",
+        'bank_code': "No active account found for the user with the provided bank code",
+    }
+
     @staticmethod
     def create_recipient_group(name, owner):
         """
@@ -99,13 +107,21 @@ class RecipientGroupProcessor:
     def process_group_recipients(group_id):
         """
         Process all recipients in a group.
+        Pending recipients are validated chunk by chunk, each chunk with a few
+        IN queries (RecipientResolver) and one bulk UPDATE.
         """
         try:
             group = RecipientGroup.objects.get(id=group_id)
-            recipients = group.recipients.filter(status='pending')
+            chunk_size = getattr(settings, 'MASS_PAYMENT_RESOLVER_CHUNK_SIZE', 500)
 
-            for recipient in recipients:
-                RecipientGroupProcessor._process_recipient(recipient)
+            last_id = 0
+            while True:
+                # Keyset pagination: processed recipients leave 'pending'
+                recipients = list(group.recipients.filter(status='pending', id__gt=last_id).order_by('id')[:chunk_size])
+                if not recipients:
+                    break
+                last_id = recipients[-1].id
+                RecipientGroupProcessor._process_recipients(recipients)
 
             # Update group status
             if group.recipients.filter(status='failed').exists():
@@ -121,30 +137,27 @@ class RecipientGroupProcessor:
             raise
 
     @staticmethod
-    def _process_recipient(recipient):
+    def _process_recipients(recipients):
         """
-        Process a single recipient.
+        Validate a chunk of recipients
         """
-        try:
-            with transaction.atomic():
-                # Validate recipient
-                validation_result = RecipientGroupProcessor.validate_recipient(
-                    recipient.phone_number,
-                    recipient.bank_code
-                )
+        _, failures = RecipientResolver.resolve(
+            (recipient.phone_number, recipient.bank_code) for recipient in recipients
+        )
 
-                if not validation_result['exists']:
-                    recipient.status = 'failed'
-                    recipient.failure_reason = validation_result.get('error', 'Validation failed')
-                    recipient.save()
-                    return
-
-                # If validation passes, mark as validated
-                recipient.status = 'validated'
-                recipient.save()
+        # One UPDATE per outcome rather than per recipient
+        validated = []
+        failed = {}
+        for index, recipient in enumerate(recipients):
+            failure = failures.get(index)
+            if failure is None:
+                validated.append(recipient.id)
+            else:
+                reason = RecipientGroupProcessor.VALIDATION_ERRORS.get(failure['field'], failure['error'])
+                failed.setdefault(reason, []).append(recipient.id)
 
-        except Exception as e:
-            logger.error(f"Error processing recipient {recipient.id}: {str(e)}")
-            recipient.status = 'failed'
-            recipient.failure_reason = str(e)
-            recipient.save()
\ No newline at end of file
+        with transaction.atomic():
+            if validated:
+                GroupRecipient.objects.filter(id__in=validated).update(status='validated')
+            for reason, recipient_ids in failed.items():
+                GroupRecipient.objects.filter(id__in=recipient_ids).update(status='failed', failure_reason=reason)
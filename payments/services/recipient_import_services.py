@@ -0,0 +1,298 @@
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from itertools import islice
+from pathlib import Path
+from ..models import GroupRecipient, RecipientImport
+from .job_queue_services import JobQueue
+from .recipient_file_services import RecipientFileReader
+from .recipient_resolver_services import RecipientResolver, chunked
+from .services import logger
+import csv
+import os
+import uuid
+
+
+class RecipientImporter:
+    """
+    Imports recipient rows ({"phone_number", "amount", "motive"}, see
+    RecipientFileReader for the file formats) into a
+    recipient group chunk by chunk: each chunk is resolved with a few IN
+    queries, checked against the group with one lookup and inserted with one
+    bulk INSERT, so memory stays bounded whatever the size of the file.
+    """
+    MISSING_FIELDS = "Missing required fields (phone_number or amount)"
+    INVALID_AMOUNT = "Invalid amount"
+    NON_POSITIVE_AMOUNT = "Amount must be greater than zero"
+    USER_NOT_FOUND = "User not found with this phone number"
+    ALREADY_IN_GROUP = "Recipient already exists in this group"
+
+    @staticmethod
+    def import_rows(group, rows, chunk_size=None, on_chunk=None, collect_failures=True):
+        """
+        Import an iterable of rows into `group`, consuming it lazily.
+        `on_chunk(summary, chunk_failures)` is called after every chunk, inside
+        the chunk's transaction, so progress recorded there commits with the rows.
+        Returns {"total_count", "successful_count", "failed_count", "failed_records"};
+        failed_records stays empty with collect_failures=False.
+        """
+        chunk_size = chunk_size or getattr(settings, 'RECIPIENT_IMPORT_CHUNK_SIZE', 1000)
+        summary = {
+            "total_count": 0,
+            "successful_count": 0,
+            "failed_count": 0,
+            "failed_records": [],
+        }
+
+        for number, chunk in enumerate(chunked(rows, chunk_size)):
+            with transaction.atomic():
+                successful, failures = RecipientImporter._import_chunk(group, chunk)
+
+                summary["total_count"] += len(chunk)
+                summary["successful_count"] += successful
+                summary["failed_count"] += len(failures)
+                if collect_failures:
+                    summary["failed_records"].extend(failures)
+
+                if on_chunk is not None:
+                    on_chunk(summary, failures)
+
+            logger.info(f"Imported chunk {number} into recipient group {group.id}: "
+                        f"{successful} added, {len(failures)} failed, {summary['total_count']} rows so far")
+
+        return summary
+
+    @staticmethod
+    def _import_chunk(group, rows):
+        """
+        Validate, resolve and insert one chunk of rows, in the caller's transaction.
+        Returns (number of recipients added, failed records).
+        """
+        failures = []
+        candidates = []  # (row, phone_number, amount)
+        for row in rows:
+            # Columnar and JSON files may hold numbers
+            phone_number = str(row.get('phone_number') or '').strip()
+            amount = row.get('amount')
+
+            # Validate required fields
+            if not phone_number or amount in (None, ''):
+                failures.append({"row": row, "error": RecipientImporter.MISSING_FIELDS})
+                continue
+            amount, error = RecipientImporter._parse_amount(amount)
+            if error:
+                failures.append({"phone_number": phone_number, "error": error})
+                continue
+
+            candidates.append((row, phone_number, amount))
+
+        # Resolve every phone number of the chunk to its first active account at once
+        accounts, resolve_failures = RecipientResolver.resolve(
+            (phone_number, None) for _, phone_number, _ in candidates
+        )
+
+        recipients = []
+        for index, (row, phone_number, amount) in enumerate(candidates):
+            if index in resolve_failures:
+                failure = resolve_failures[index]
+                failures.append({
+                    "phone_number": phone_number,
+                    "error": (
+                        RecipientImporter.USER_NOT_FOUND
+                        if failure['error'] == RecipientResolver.USER_NOT_FOUND
+                        else failure['error']
+                    )
+                })
+                continue
+
+            # Use the first active account found
+            account = accounts[(phone_number, None)]
+            recipients.append(GroupRecipient(
+                group=group,
+                phone_number=phone_number,
+                bank_code=account.bank_code,
+                full_name=f"{account.user.first_name} {account.user.last_name}",
+                default_amount=amount,
+                motive=str(row.get('motive') or ''),
+                status='validated'
+            ))
+
+        # Recipients already in the group, from earlier uploads or earlier chunks
+        existing = set(GroupRecipient.objects.filter(
+            group=group,
+            phone_number__in={recipient.phone_number for recipient in recipients}
+        ).values_list('phone_number', 'bank_code'))
+
+        new_recipients = []
+        for recipient in recipients:
+            key = (recipient.phone_number, recipient.bank_code)
+            if key in existing:
+                failures.append({
+                    "phone_number": recipient.phone_number,
+                    "error": RecipientImporter.ALREADY_IN_GROUP
+                })
+                continue
+            existing.add(key)
+            new_recipients.append(recipient)
+
+        # A concurrent upload may still insert the same recipient first:
+        # the unique (group, phone_number, bank_code) constraint keeps one row
+        GroupRecipient.objects.bulk_create(new_recipients, ignore_conflicts=True)
+
+        return len(new_recipients), failures
+
+    @staticmethod
+    def _parse_amount(value):
+        """
+        Validate an amount against GroupRecipient.default_amount, so that one
+        bad row cannot fail the chunk's INSERT. Returns (amount quantized to
+        the field's decimal places, None) or (None, error).
+        """
+        field = GroupRecipient._meta.get_field('default_amount')
+        try:
+            amount = Decimal(str(value).strip())
+        except InvalidOperation:
+            return None, RecipientImporter.INVALID_AMOUNT
+        if not amount.is_finite():
+            return None, RecipientImporter.INVALID_AMOUNT
+        if amount <= 0:
+            return None, RecipientImporter.NON_POSITIVE_AMOUNT
+
+        quantum = Decimal(1).scaleb(-field.decimal_places)
+        if amount >= Decimal(10) ** (field.max_digits - field.decimal_places) or amount != amount.quantize(quantum):
+            return None, (f"Ensure that there are no more than {field.max_digits} digits "
+                          f"and {field.decimal_places} decimal places")
+        return amount.quantize(quantum), None
+
+    @staticmethod
+    def update_group_status(group, summary):
+        """
+        Set the group status from the outcome of an import
+        """
+        if summary["successful_count"] == summary["total_count"]:
+            group.status = 'completed'
+        elif summary["successful_count"] > 0:
+            group.status = 'partially_completed'
+        else:
+            group.status = 'failed'
+        group.save()
+
+
+class RecipientImportJob:
+    """
+    Background imports of recipient files. The upload is spooled to
+    RECIPIENT_IMPORT_DIR and a 'recipient_import' job feeds it to
+    RecipientImporter, recording progress on the RecipientImport row and
+    failures in a CSV report next to the file.
+    """
+
+    @staticmethod
+    def spool(group, uploaded_file):
+        """
+        Save an uploaded file to disk and queue its import.
+        Returns the RecipientImport.
+        """
+        # Reject undecodable files before queuing anything
+        RecipientFileReader.detect(uploaded_file.file, uploaded_file.name)
+
+        import_dir = Path(getattr(settings, 'RECIPIENT_IMPORT_DIR', settings.BASE_DIR / 'imports'))
+        import_dir.mkdir(parents=True, exist_ok=True)
+        path = import_dir / f"{uuid.uuid4().hex}{Path(uploaded_file.name).suffix}"
+        with open(path, 'wb') as destination:
+            for data in uploaded_file.chunks():
+                destination.write(data)
+
+        with transaction.atomic():
+            recipient_import = RecipientImport.objects.create(
+                group=group,
+                file_name=uploaded_file.name,
+                file_path=str(path),
+                file_size=uploaded_file.size
+            )
+            JobQueue.enqueue('recipient_import', recipient_import.id)
+
+        logger.info(f"Spooled {uploaded_file.name} ({uploaded_file.size} bytes) "
+                    f"for import {recipient_import.id} into recipient group {group.id}")
+        return recipient_import
+
+    @staticmethod
+    def run(import_id):
+        """
+        Import a spooled file. Progress commits with each chunk, so a retried
+        job resumes after the last committed row.
+        """
+        recipient_import = RecipientImport.objects.select_related('group').get(id=import_id)
+        if recipient_import.status == 'completed':
+            return
+
+        report_path = recipient_import.failure_report_path or f"{recipient_import.file_path}.failures.csv"
+        RecipientImport.objects.filter(id=import_id).update(
+            status='running',
+            error=None,
+            failure_report_path=report_path,
+            started_at=recipient_import.started_at or timezone.now(),
+            updated_at=timezone.now()
+        )
+
+        # Already committed by a previous attempt
+        skipped = recipient_import.rows_processed
+        succeeded = recipient_import.rows_succeeded
+        failed = recipient_import.rows_failed
+
+        try:
+            with open(recipient_import.file_path, 'rb') as source, \
+                    open(report_path, 'a', newline='', encoding='utf-8') as report:
+                writer = csv.writer(report)
+                if report.tell() == 0:
+                    writer.writerow(['phone_number', 'error'])
+
+                reader = RecipientFileReader.rows(source, recipient_import.file_name)
+
+                def record_progress(summary, failures):
+                    for failure in failures:
+                        phone_number = failure.get('phone_number', (failure.get('row') or {}).get('phone_number'))
+                        writer.writerow([phone_number or '', failure['error']])
+                    report.flush()
+
+                    RecipientImport.objects.filter(id=import_id).update(
+                        rows_processed=skipped + summary['total_count'],
+                        rows_succeeded=succeeded + summary['successful_count'],
+                        rows_failed=failed + summary['failed_count'],
+                        bytes_processed=source.tell(),
+                        updated_at=timezone.now()
+                    )
+
+                summary = RecipientImporter.import_rows(
+                    recipient_import.group,
+                    islice(reader, skipped, None),
+                    on_chunk=record_progress,
+                    collect_failures=False
+                )
+        except Exception as e:
+            logger.error(f"Import {import_id} into recipient group {recipient_import.group_id} failed: {str(e)}")
+            RecipientImport.objects.filter(id=import_id).update(
+                status='failed',
+                error=str(e),
+                updated_at=timezone.now()
+            )
+            raise
+
+        total = {
+            "total_count": skipped + summary['total_count'],
+            "successful_count": succeeded + summary['successful_count'],
+        }
+        RecipientImporter.update_group_status(recipient_import.group, total)
+
+        failed += summary['failed_count']
+        if not failed:
+            os.remove(report_path)
+        RecipientImport.objects.filter(id=import_id).update(
+            status='completed',
+            bytes_processed=recipient_import.file_size,
+            failure_report_path=report_path if failed else None,
+            finished_at=timezone.now(),
+            updated_at=timezone.now()
+        )
+        os.remove(recipient_import.file_path)
+        logger.info(f"Import {import_id} completed: {total['successful_count']} of {total['total_count']} rows added")
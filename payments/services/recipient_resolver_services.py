@@ -0,0 +1,87 @@
+from collections import defaultdict
+from django.conf import settings
+from itertools import islice
+from ..models import Account, User
+
+
+def chunked(values, size):
+    """
+    Yield successive lists of at most `size` elements from any iterable,
+    consuming it lazily
+    """
+    iterator = iter(values)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class RecipientResolver:
+    """
+    Resolves whole recipient lists to destination accounts with a few
+    chunked IN queries instead of one User/Account lookup per row.
+    """
+    USER_NOT_FOUND = "No user found with the provided phone number."
+    ACCOUNT_NOT_FOUND = "No active account found for the user with the provided bank code."
+    NO_ACTIVE_ACCOUNT = "No active account found for this user"
+
+    @staticmethod
+    def resolve(recipients, chunk_size=None):
+        """
+        Resolve (phone_number, bank_code) pairs to active, unblocked accounts.
+
+        A bank_code of None matches the user's first active account, whatever its bank.
+        Returns (accounts, failures): `accounts` maps every resolvable pair to its
+        Account (with the user preloaded), `failures` maps the row index of every
+        unresolvable pair to {"field": ..., "error": ...}.
+        """
+        chunk_size = chunk_size or getattr(settings, 'MASS_PAYMENT_RESOLVER_CHUNK_SIZE', 500)
+        pairs = [(str(phone_number), bank_code) for phone_number, bank_code in recipients]
+        phone_numbers = sorted({phone_number for phone_number, _ in pairs})
+
+        # Load every active account of every phone number, one query per chunk
+        accounts_by_phone = defaultdict(list)
+        for chunk in chunked(phone_numbers, chunk_size):
+            accounts = Account.objects.select_related('user').filter(
+                user__phone_number__in=chunk,
+                is_active=True,
+                is_blocked=False
+            ).order_by('id')
+            for account in accounts:
+                accounts_by_phone[account.user.phone_number].append(account)
+
+        # Only phone numbers without any active account need a user lookup,
+        # to tell "unknown user" apart from "no usable account"
+        known_users = set()
+        orphan_phones = [phone for phone in phone_numbers if phone not in accounts_by_phone]
+        for chunk in chunked(orphan_phones, chunk_size):
+            known_users.update(
+                User.objects.filter(phone_number__in=chunk).values_list('phone_number', flat=True)
+            )
+
+        resolved = {}
+        failures = {}
+        for index, (phone_number, bank_code) in enumerate(pairs):
+            if (phone_number, bank_code) in resolved:
+                continue
+
+            candidates = accounts_by_phone.get(phone_number)
+            if not candidates and phone_number not in known_users:
+                failures[index] = {"field": "phone_number", "error": RecipientResolver.USER_NOT_FOUND}
+                continue
+
+            account = next(
+                (acc for acc in candidates or [] if bank_code is None or acc.bank_code == bank_code),
+                None
+            )
+            if account is None:
+                if bank_code is None:
+                    failures[index] = {"field": "phone_number", "error": RecipientResolver.NO_ACTIVE_ACCOUNT}
+                else:
+                    failures[index] = {"field": "bank_code", "error": RecipientResolver.ACCOUNT_NOT_FOUND}
+                continue
+
+            resolved[(phone_number, bank_code)] = account
+
+        return resolved, failures
@@ -1,11 +1,12 @@
 # signals.py:
 
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from .models import MassPayment, RecipientGroup
-from .tasks import process_mass_payment, process_recipient_group
-import threading
 from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import BankProvider, FeeSchedule, MassPayment, RecipientGroup
+from .services.bank_provider_registry_services import BankProviderRegistry
+from .services.fee_schedule_registry_services import FeeScheduleRegistry
+from .services.job_queue_services import JobQueue
 
 
 """
@@ -15,31 +16,41 @@ sets up an automatic trigger that activates when a new MassPayment is created
 @receiver(post_save, sender=MassPayment)
 def start_mass_payment_processing(sender, instance, created, **kwargs):
     """
-    Start processing a mass payment when it's created
+    Queue a mass payment for processing when it's created
     """
     if created:
-        # Use transaction.on_commit to ensure the transaction is complete
-        # before starting the background processing
-        transaction.on_commit(
-            lambda: threading.Thread(
-                target=process_mass_payment, 
-                args=(instance.id,),
-                daemon=False
-            ).start()
-        )
+        # The job is written in the same transaction as the mass payment,
+        # so workers only see it once the payment is committed
+        JobQueue.enqueue('mass_payment', instance.id)
 
 
 
 @receiver(post_save, sender=RecipientGroup)
 def start_recipient_group_processing(sender, instance, created, **kwargs):
     """
-    Start processing a recipient group when it's created.
+    Queue a recipient group for processing when it's created.
     """
     if created:
-        transaction.on_commit(
-            lambda: threading.Thread(
-                target=process_recipient_group, 
-                args=(instance.id,),
-                daemon=False
-            ).start()
-        )
\ No newline at end of file
+        JobQueue.enqueue('recipient_group', instance.id)
+
+
+@receiver(post_save, sender=BankProvider)
+@receiver(post_delete, sender=BankProvider)
+def invalidate_bank_provider_registry(sender, instance, **kwargs):
+    """
+    Drop the cached bank providers when one changes.
+    Cleared again on commit, in case another thread reloaded the old rows meanwhile.
+    """
+    BankProviderRegistry.invalidate()
+    transaction.on_commit(BankProviderRegistry.invalidate)
+
+
+@receiver(post_save, sender=FeeSchedule)
+@receiver(post_delete, sender=FeeSchedule)
+def invalidate_fee_schedule_registry(sender, instance, **kwargs):
+    """
+    Drop the compiled fee schedules when a tier changes.
+    Cleared again on commit, in case another thread recompiled the old rows meanwhile.
+    """
+    FeeScheduleRegistry.invalidate()
+    transaction.on_commit(FeeScheduleRegistry.invalidate)
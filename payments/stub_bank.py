@@ -0,0 +1,109 @@
+"""
+stub_bank.py:
+A local stand-in for a bank provider API, speaking the protocol used by
+ExternalTransferDispatcher. Used to exercise external transfers without a
+real bank (see manage.py run_stub_bank).
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+
+class StubBankRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep their connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._respond(400, {"error": "Invalid JSON"})
+
+        if self.server.unavailable:
+            return self._respond(503, {"error": "Service unavailable"})
+
+        path = self.path.rstrip('/')
+        if path.endswith('/transfers/batch'):
+            if not self.server.supports_batch:
+                return self._respond(404, {"error": "Batch transfers not supported"})
+            self._wait()
+            return self._respond(200, {
+                "results": [self.server.transfer(transfer) for transfer in body.get('transfers', [])]
+            })
+        if path.endswith('/transfers'):
+            self._wait()
+            return self._respond(200, self.server.transfer(body))
+
+        return self._respond(404, {"error": "Not found"})
+
+    def _wait(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _respond(self, status_code, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubBankServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server accepting every transfer, except for the phone numbers
+    in `reject_phone_numbers` and a random `failure_rate` share of requests.
+    With `unavailable` set, every request gets a 503 (provider outage).
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0,
+                 supports_batch=True, reject_phone_numbers=(), unavailable=False, seed=None, verbose=False):
+        super().__init__((host, port), StubBankRequestHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.supports_batch = supports_batch
+        self.reject_phone_numbers = set(reject_phone_numbers)
+        self.unavailable = unavailable
+        self.verbose = verbose
+        self.received = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def transfer(self, transfer):
+        with self._lock:
+            self.received.append(transfer)
+            rejected = self._random.random() < self.failure_rate
+
+        if transfer.get('phone_number') in self.reject_phone_numbers:
+            return {"reference": transfer.get('reference'), "status": "failed", "reason": "Unknown beneficiary"}
+        if rejected:
+            return {"reference": transfer.get('reference'), "status": "failed", "reason": "Transfer rejected"}
+        return {"reference": transfer.get('reference'), "status": "success"}
+
+    def start(self):
+        """
+        Serve in a background thread and return the server's base URL
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='stub-bank', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,12 +1,15 @@
 # tasks.py
 from .services.recipient_group_services import RecipientGroupProcessor
 from .services.mass_payement_services import PaymentProcessor
+from .services.recipient_import_services import RecipientImportJob
 import logging
+import time
 """
 What Does This Code Do?
+These are the job handlers run by the payment workers (manage.py run_payment_workers).
 It logs when the mass payment processing starts and ends.
 It calls PaymentProcessor.process_mass_payment(mass_payment_id), which runs the mass payment logic.
-If an error occurs, it logs the error instead of crashing the whole system.
+If an error occurs, it logs the error and re-raises it so the job queue can retry the job.
 """
 
 logger = logging.getLogger(__name__)
@@ -17,10 +20,38 @@ def process_mass_payment(mass_payment_id):
     """
     try:
         logger.info(f"Starting to process mass payment {mass_payment_id}")
+        started = time.monotonic()
         PaymentProcessor.process_mass_payment(mass_payment_id)
-        logger.info(f"Completed processing mass payment {mass_payment_id}")
+        logger.info(f"Completed processing mass payment {mass_payment_id} in {time.monotonic() - started:.2f}s")
     except Exception as e:
         logger.error(f"Error in background process for mass payment {mass_payment_id}: {str(e)}")
+        raise
+
+def process_mass_payment_shard(mass_payment_id, **shard):
+    """
+    Process one shard of a large mass payment in the background
+    """
+    try:
+        logger.info(f"Starting to process shard {shard.get('shard')} of mass payment {mass_payment_id}")
+        started = time.monotonic()
+        PaymentProcessor.process_shard(mass_payment_id, **shard)
+        logger.info(f"Completed processing shard {shard.get('shard')} of mass payment {mass_payment_id} "
+                    f"in {time.monotonic() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Error in background process for shard {shard.get('shard')} "
+                     f"of mass payment {mass_payment_id}: {str(e)}")
+        raise
+
+def retry_external_transfers(mass_payment_id):
+    """
+    Retry the external transfers of a mass payment parked by a circuit breaker
+    """
+    try:
+        logger.info(f"Retrying parked external transfers of mass payment {mass_payment_id}")
+        PaymentProcessor.retry_parked_transfers(mass_payment_id)
+    except Exception as e:
+        logger.error(f"Error retrying external transfers of mass payment {mass_payment_id}: {str(e)}")
+        raise
 
 def process_recipient_group(group_id):
     """
@@ -33,4 +64,27 @@ def process_recipient_group(group_id):
 
         logger.info(f"Completed processing recipient group {group_id}")
     except Exception as e:
-        logger.error(f"Error in background process for recipient group {group_id}: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error in background process for recipient group {group_id}: {str(e)}")
+        raise
+
+def import_recipients(import_id):
+    """
+    Import a spooled recipient file in the background
+    """
+    try:
+        logger.info(f"Starting recipient import {import_id}")
+        RecipientImportJob.run(import_id)
+        logger.info(f"Completed recipient import {import_id}")
+    except Exception as e:
+        logger.error(f"Error in background recipient import {import_id}: {str(e)}")
+        raise
+
+
+# Job type -> handler, used by the worker pool
+JOB_HANDLERS = {
+    'mass_payment': process_mass_payment,
+    'mass_payment_shard': process_mass_payment_shard,
+    'external_retry': retry_external_transfers,
+    'recipient_group': process_recipient_group,
+    'recipient_import': import_recipients,
+}
@@ -1,3 +1,2062 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pathlib import Path
+from unittest import mock, skipUnless
+from rest_framework.test import APIClient
+from .models import (
+    Account, BankProvider, FeeSchedule, FundsHold, GroupRecipient, IdempotencyKey, MassPayment, MassPaymentItem, PaymentTemplate,
+    ProcessingJob, RecipientGroup, RecipientImport, TemplateRecipient, Transaction, User
+)
+from .serializers.payment_template_serializers import PaymentTemplateListSerializer
+from .services.bank_provider_registry_services import BankProviderRegistry
+from .services.benchmark_services import EndpointBenchmark
+from .services.demo_data_services import DemoDataGenerator
+from .services.external_transfer_services import ExternalTransferDispatcher
+from .services.fee_schedule_registry_services import FeeScheduleRegistry
+from .services.funds_hold_services import FundsHoldService
+from .services.job_queue_services import JobQueue, PaymentWorkerPool
+from .services.load_test_services import LoadTestRunner, TestClientLoadTarget
+from .services.mass_payement_services import PaymentProcessor
+from .services.mass_payment_creation_services import MassPaymentCreator
+from .services.payment_recovery_services import PaymentRecovery
+from .services.pricing_services import BatchPricer, PricingError
+from .services.processing_metrics_services import Histogram, ProcessingMetrics, StageTimer
+from .services import recipient_file_services
+from .services.recipient_file_services import RecipientFileReader, UnsupportedFileFormat
+from .services.recipient_import_services import RecipientImporter
+from .services.recipient_resolver_services import RecipientResolver
+from .stub_bank import StubBankServer
+from .tasks import JOB_HANDLERS
+import gzip
+import httpx
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import warnings
 
-# Create your tests here.
+# BENCHMARK_SCALE=10000 python manage.py test payments
+BENCHMARK_SCALE = int(os.environ.get('BENCHMARK_SCALE', 1000))
+BENCHMARK_BASELINE = os.environ.get(
+    'BENCHMARK_BASELINE', Path(__file__).resolve().parent / 'benchmarks' / 'baseline.json'
+)
+BENCHMARK_UPDATE_BASELINE = os.environ.get('BENCHMARK_UPDATE_BASELINE', '').lower() in ('1', 'true', 'yes')
+BENCHMARK_TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', 0.5))
+
+
+def chunks(count, size):
+    """
+    Number of chunks of `size` rows needed for `count` rows
+    """
+    return math.ceil(count / size)
+
+
+def bulk_inserts(model, count, chunk_size):
+    """
+    Most INSERT statements needed to bulk_create `count` rows of `model` in
+    chunks of `chunk_size`: the backend splits each chunk further to stay
+    under its bound-parameter limit (999 on SQLite)
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    batch_size = connection.ops.bulk_batch_size(fields, range(chunk_size)) or chunk_size
+    return chunks(count, chunk_size) + chunks(count, min(batch_size, chunk_size))
+
+
+def create_account(phone_number, account_number, balance):
+    """
+    SEDAD account of a new user
+    """
+    user = User.objects.create(phone_number=phone_number, first_name='Test', last_name=account_number)
+    return Account.objects.create(user=user, account_number=account_number, balance=Decimal(balance), bank_code='SEDAD')
+
+
+class EndpointQueryBudgetTests(TestCase):
+    """
+    Drives every endpoint of payments/urls.py against a synthetic dataset of
+    BENCHMARK_SCALE recipients and checks its number of SQL queries against
+    a budget. Budgets do not depend on the scale, except for endpoints
+    working on every recipient, whose budget grows with the number of
+    chunks (never with the number of rows): an N+1 query fails the test.
+    Wall time, peak memory and queries per item are compared with the
+    baseline of the same scale (BENCHMARK_BASELINE): more queries than the
+    baseline fail the test, slower or bigger requests (BENCHMARK_TOLERANCE)
+    are reported as warnings. BENCHMARK_UPDATE_BASELINE=1 records the run as
+    baseline; without a baseline for the scale the comparison is skipped.
+    """
+    maxDiff = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.scale = BENCHMARK_SCALE
+        cls.dataset = DemoDataGenerator(seed=0).create_recipients(cls.scale)
+        initiator = User.objects.create(phone_number='10000000', first_name='Benchmark', last_name='Initiator')
+        cls.initiator = Account.objects.create(
+            user=initiator,
+            account_number='BENCH001',
+            balance=Decimal('1000000000.00'),
+            bank_code='SEDAD'
+        )
+
+    def setUp(self):
+        # Process-wide caches must not hide (or add) queries between runs
+        BankProviderRegistry.invalidate()
+        FeeScheduleRegistry.invalidate()
+        self.benchmark = EndpointBenchmark(APIClient())
+        # Asynchronous imports spool their file: keep it out of the project
+        self.import_dir = tempfile.mkdtemp(prefix='benchmark-imports-')
+        self.import_settings = override_settings(RECIPIENT_IMPORT_DIR=Path(self.import_dir))
+        self.import_settings.enable()
+
+    def tearDown(self):
+        self.import_settings.disable()
+        shutil.rmtree(self.import_dir, ignore_errors=True)
+
+    def recipients_csv(self, with_bank_code=True):
+        lines = ["phone_number,amount,bank_code" if with_bank_code else "phone_number,amount,motive"]
+        for phone_number, bank_code, amount, _ in self.dataset["recipients"]:
+            lines.append(f"{phone_number},{amount},{bank_code}" if with_bank_code else f"{phone_number},{amount},Benchmark")
+        return ("\n".join(lines) + "\n").encode()
+
+    def scenarios(self):
+        """
+        (name, method, path, data, items, extra request kwargs, query budget).
+        Paths may be callables, evaluated after the previous requests ran.
+        """
+        n = self.scale
+        group = self.dataset["group"]
+        template = self.dataset["template"]
+        account = self.initiator.account_number
+        phone_number, bank_code, _, _ = self.dataset["recipients"][0]
+        recipients = [
+            {"phone_number": phone_number, "bank_code": bank_code, "amount": str(amount)}
+            for phone_number, bank_code, amount, _ in self.dataset["recipients"]
+        ]
+        resolver_chunks = chunks(n, 500)
+        item_inserts = bulk_inserts(MassPaymentItem, n, 1000)
+
+        def latest_mass_payment():
+            return MassPayment.objects.latest('id').id
+
+        def latest_import():
+            return RecipientImport.objects.latest('id').id
+
+        return [
+            ("users-list", 'get', '/api/users/', None, 10, {}, 2),
+            ("users-detail", 'get', f'/api/users/{self.initiator.user_id}/', None, 1, {}, 1),
+            ("accounts-list", 'get', '/api/accounts/', None, 10, {}, 2),
+            ("accounts-detail", 'get', f'/api/accounts/{account}/', None, 1, {}, 1),
+            ("accounts-payment-templates", 'get', f'/api/accounts/{account}/payment_templates/', None, 10, {}, 3),
+            ("bank-providers-list", 'get', '/api/bank-providers/', None, 3, {}, 2),
+            ("bank-providers-detail", 'get', '/api/bank-providers/SEDAD/', None, 1, {}, 1),
+            ("bank-providers-circuit-breakers", 'get', '/api/bank-providers/circuit_breakers/', None, 3, {}, 1),
+            ("bank-providers-circuit-breaker", 'get', '/api/bank-providers/SEDAD/circuit_breaker/', None, 1, {}, 2),
+            ("payment-templates-list", 'get', '/api/payment-templates/', None, 10, {}, 2),
+            ("payment-templates-list-totals", 'get', '/api/payment-templates/?include_totals=true', None, 10, {}, 2),
+            ("payment-templates-detail", 'get', f'/api/payment-templates/{template.id}/', None, n, {}, 2),
+            ("payment-templates-create", 'post', '/api/payment-templates/',
+             {"name": "Benchmark", "recipients": recipients[:100]}, 100, {'format': 'json'},
+             4 + bulk_inserts(TemplateRecipient, 100, 100)),
+            ("recipient-groups-list", 'get', '/api/recipient-groups/', None, 10, {}, 2),
+            ("recipient-groups-list-recipients", 'get',
+             '/api/recipient-groups/?include_totals=true&include_recipients=true', None, n, {}, 3),
+            ("recipient-groups-detail", 'get', f'/api/recipient-groups/{group.id}/', None, n, {}, 2),
+            ("recipient-groups-create", 'post', '/api/recipient-groups/', {"name": "Benchmark upload"}, 1, {}, 2),
+            ("recipient-groups-validate-recipient", 'post', '/api/recipient-groups/validate_recipient/',
+             {"phone_number": phone_number, "bank_code": bank_code}, 1, {}, 2),
+            ("recipient-groups-add-recipient", 'post', f'/api/recipient-groups/{group.id}/add_recipient/',
+             {"phone_number": self.initiator.user.phone_number, "bank_code": 'SEDAD'}, 1, {}, 5),
+            ("recipient-groups-process-recipients", 'post', f'/api/recipient-groups/{group.id}/process_recipients/',
+             None, n + 1, {}, 5 + 7 * chunks(n + 1, 500)),
+            ("recipient-groups-upload-recipients-csv", 'post',
+             lambda: f"/api/recipient-groups/{self.latest_group_id()}/upload_recipients_csv/",
+             lambda: {"file": SimpleUploadedFile('recipients.csv', self.recipients_csv(with_bank_code=False))},
+             n, {'format': 'multipart'},
+             2 + 5 * chunks(n, 1000) + bulk_inserts(GroupRecipient, n, 1000)),
+            ("recipient-groups-upload-recipients-csv-async", 'post',
+             lambda: f"/api/recipient-groups/{self.latest_group_id()}/upload_recipients_csv/?async=true",
+             lambda: {"file": SimpleUploadedFile('recipients.csv', self.recipients_csv(with_bank_code=False))},
+             n, {'format': 'multipart'}, 5),
+            ("recipient-groups-imports", 'get', lambda: f"/api/recipient-groups/{self.latest_group_id()}/imports/",
+             None, 1, {}, 3),
+            ("recipient-groups-import-status", 'get',
+             lambda: f"/api/recipient-groups/{self.latest_group_id()}/imports/{latest_import()}/", None, 1, {}, 2),
+            ("recipient-groups-import-failures", 'get',
+             lambda: f"/api/recipient-groups/{self.latest_group_id()}/imports/{latest_import()}/failures/",
+             None, 1, {'expected_status': 404}, 2),
+            ("mass-payments-create", 'post', '/api/mass-payments/?summary_only=true',
+             {"initiator_account_number": account, "recipients": recipients}, n, {'format': 'json'},
+             14 + resolver_chunks + item_inserts),
+            ("mass-payments-upload", 'post', '/api/mass-payments/upload/?summary_only=true',
+             lambda: {"initiator_account_number": account,
+                      "file": SimpleUploadedFile('recipients.csv', self.recipients_csv())},
+             n, {'format': 'multipart'},
+             10 + 6 * chunks(n, 1000) + resolver_chunks + item_inserts),
+            ("mass-payments-create-from-template", 'post', '/api/mass-payments/create_from_template/?summary_only=true',
+             {"template_id": template.id, "initiator_account_number": account}, n, {'format': 'json'},
+             14 + resolver_chunks + item_inserts),
+            ("recipient-groups-create-mass-payment", 'post',
+             f'/api/recipient-groups/{group.id}/create_mass_payment/?summary_only=true',
+             {"initiator_account_number": account}, n, {'format': 'json'},
+             15 + resolver_chunks + item_inserts),
+            ("mass-payments-list", 'get', '/api/mass-payments/', None, 4, {}, 2),
+            ("mass-payments-detail", 'get', lambda: f"/api/mass-payments/{latest_mass_payment()}/", None, n, {}, 3),
+            ("mass-payments-detail-items", 'get',
+             lambda: f"/api/mass-payments/{latest_mass_payment()}/?include_items=true", None, n, {}, 5),
+            ("mass-payments-items", 'get', lambda: f"/api/mass-payments/{latest_mass_payment()}/items/?limit=1000",
+             None, min(n, 1000), {}, 2),
+            ("mass-payments-items-stream", 'get',
+             lambda: f"/api/mass-payments/{latest_mass_payment()}/items/?stream=true", None, n, {},
+             1 + chunks(n + 1, 2000)),
+            ("accounts-mass-payments", 'get', f'/api/accounts/{account}/mass_payments/', None, 4, {}, 3),
+            ("metrics", 'get', '/metrics', None, 1, {}, 0),
+        ]
+
+    def latest_group_id(self):
+        return RecipientGroup.objects.latest('id').id
+
+    def test_endpoint_query_budgets(self):
+        for name, method, path, data, items, extra, budget in self.scenarios():
+            extra = dict(extra)
+            expected_status = extra.pop('expected_status', None)
+            path = path() if callable(path) else path
+            data = data() if callable(data) else data
+
+            response, metrics = self.benchmark.measure(name, method, path, data, items=items, **extra)
+            with self.subTest(endpoint=name):
+                if expected_status is not None:
+                    self.assertEqual(response.status_code, expected_status)
+                else:
+                    self.assertLess(response.status_code, 300, getattr(response, 'data', None))
+                self.assertLessEqual(metrics["queries"], budget, f"{name} is over its query budget")
+
+        if BENCHMARK_UPDATE_BASELINE:
+            EndpointBenchmark.save_baseline(BENCHMARK_BASELINE, self.scale, self.benchmark.results)
+            return
+        baseline = EndpointBenchmark.load_baseline(BENCHMARK_BASELINE, self.scale)
+        if baseline is None:
+            return
+
+        regressions = EndpointBenchmark.compare(self.benchmark.results, baseline, BENCHMARK_TOLERANCE)
+        for metric in ('wall_ms', 'peak_kb'):
+            for message in regressions[metric]:
+                warnings.warn(f"Benchmark regression: {message}", stacklevel=2)
+        self.assertEqual(regressions['queries'], [], "Endpoints doing more queries than their baseline")
+
+
+class NonObjectReplyStubBankServer(StubBankServer):
+    """
+    Stub bank answering valid JSON that is not an object
+    """
+
+    def transfer(self, transfer):
+        super().transfer(transfer)
+        return ["ok"]
+
+
+class ExternalTransferDispatcherTests(TestCase):
+    """
+    ExternalTransferDispatcher against local stub banks (payments/stub_bank.py)
+    """
+
+    def setUp(self):
+        self.dispatcher = ExternalTransferDispatcher()
+        self.servers = []
+
+    def tearDown(self):
+        self.dispatcher.close()
+        for server in self.servers:
+            server.stop()
+
+    def start_bank(self, server_class=StubBankServer, supports_batch=False, **options):
+        server = server_class(**options)
+        self.servers.append(server)
+        provider = BankProvider(
+            bank_code='STUB',
+            name='Stub bank',
+            api_endpoint=server.start(),
+            supports_batch=supports_batch,
+            max_batch_size=10,
+            timeout_seconds=2.0
+        )
+        return server, {'STUB': provider}
+
+    @staticmethod
+    def transfers(count, start=0):
+        return [
+            {
+                'id': number,
+                'reference': f"TEST-{number}",
+                'bank_code': 'STUB',
+                'phone_number': f"4{number:07d}",
+                'amount': '10.00',
+            }
+            for number in range(start, start + count)
+        ]
+
+    def test_accepted_transfers_succeed(self):
+        server, providers = self.start_bank()
+
+        results = self.dispatcher.dispatch(self.transfers(3), providers)
+        self.assertEqual(results, {0: ('success', None), 1: ('success', None), 2: ('success', None)})
+        self.assertEqual(sorted(transfer['reference'] for transfer in server.received), ['TEST-0', 'TEST-1', 'TEST-2'])
+
+    def test_batch_provider_gets_one_request_per_batch(self):
+        server, providers = self.start_bank(supports_batch=True, reject_phone_numbers=['40000001'])
+
+        results = self.dispatcher.dispatch(self.transfers(15), providers)
+        self.assertEqual(results[1], ('failed', "Unknown beneficiary"))
+        self.assertEqual(sum(1 for status, _ in results.values() if status == 'success'), 14)
+        self.assertEqual(len(server.received), 15)
+
+    def test_business_reject_fails_the_transfer_without_tripping_the_breaker(self):
+        _, providers = self.start_bank(reject_phone_numbers=['40000000'])
+
+        results = self.dispatcher.dispatch(self.transfers(2), providers)
+        self.assertEqual(results[0], ('failed', "Unknown beneficiary"))
+        self.assertEqual(results[1], ('success', None))
+        self.assertEqual(self.dispatcher._breakers['STUB'].state, 'closed')
+        self.assertEqual(self.dispatcher._breakers['STUB'].consecutive_failures, 0)
+
+    def test_unavailable_provider_parks_transfers(self):
+        _, providers = self.start_bank(unavailable=True)
+
+        results = self.dispatcher.dispatch(self.transfers(1), providers)
+        self.assertEqual(results[0][0], 'parked')
+        self.assertIn("HTTP 503", results[0][1])
+
+    def test_transfers_to_a_removed_provider_fail_alone(self):
+        server, providers = self.start_bank()
+        transfers = self.transfers(2)
+        transfers[1]['bank_code'] = 'GONE'
+
+        results = self.dispatcher.dispatch(transfers, providers)
+
+        self.assertEqual(results, {0: ('success', None), 1: ('failed', "Bank provider GONE is no longer available")})
+        self.assertEqual([transfer['reference'] for transfer in server.received], ['TEST-0'])
+
+    @override_settings(EXTERNAL_BREAKER_FAILURE_THRESHOLD=2, EXTERNAL_BREAKER_COOLDOWN_SECONDS=0.2)
+    def test_breaker_opens_then_recovers_through_half_open_probe(self):
+        server, providers = self.start_bank(unavailable=True)
+        breaker = self.dispatcher._breakers['STUB']
+
+        self.dispatcher.dispatch(self.transfers(2), providers)
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(len(server.received), 0)  # 503s are answered before any transfer
+
+        # Open: transfers are parked without reaching the provider
+        server.unavailable = False
+        results = self.dispatcher.dispatch(self.transfers(1, 2), providers)
+        self.assertEqual(results[2], ('parked', "Bank provider STUB unavailable (circuit open)"))
+        self.assertEqual(len(server.received), 0)
+
+        # After the cooldown a probe goes through and closes the breaker
+        time.sleep(0.25)
+        results = self.dispatcher.dispatch(self.transfers(3, 3), providers)
+        self.assertEqual({status for status, _ in results.values()}, {'success'})
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(len(server.received), 3)
+
+    @override_settings(EXTERNAL_BREAKER_FAILURE_THRESHOLD=1, EXTERNAL_BREAKER_COOLDOWN_SECONDS=0.1)
+    def test_reply_that_is_not_an_object_counts_as_provider_failure(self):
+        server, providers = self.start_bank(NonObjectReplyStubBankServer)
+
+        results = self.dispatcher.dispatch(self.transfers(1), providers)
+        self.assertEqual(results[0][0], 'parked')
+        self.assertEqual(self.dispatcher._breakers['STUB'].state, 'open')
+
+        # The half-open probe gets the same reply: the breaker must not stay
+        # stuck with its probe in flight, so the next dispatch returns too
+        time.sleep(0.15)
+        for start in (1, 2):
+            results = self.dispatcher.dispatch(self.transfers(1, start), providers)
+            self.assertEqual(results[start][0], 'parked')
+        self.assertFalse(self.dispatcher._breakers['STUB'].probing)
+        self.assertEqual(len(server.received), 2)
+
+
+class PaymentProcessorTests(TestCase):
+    """
+    Outcomes of PaymentProcessor on small mass payments: internal and
+    external recipients, an unknown recipient and insufficient funds, and
+    the recovery of a payment abandoned by a crashed worker
+    """
+
+    def setUp(self):
+        BankProviderRegistry.invalidate()
+        BankProvider.objects.create(bank_code='EXTB', name='External bank', api_endpoint='http://localhost:1/')
+        self.initiator = create_account('20000000', 'INIT001', '100.00')
+        self.recipients = [create_account(f'2000000{n}', f'RCPT00{n}', '5.00') for n in range(1, 4)]
+
+    def create_mass_payment(self, lines):
+        """
+        Pending mass payment of the initiator with one item per
+        (phone number, bank code, amount, fee) line
+        """
+        mass_payment = MassPayment.objects.create(
+            initiator_account=self.initiator,
+            total_amount=sum(Decimal(amount) for _, _, amount, _ in lines),
+            fee_amount=sum(Decimal(fee) for _, _, _, fee in lines),
+            pending_count=len(lines)
+        )
+        MassPaymentItem.objects.bulk_create(
+            MassPaymentItem(
+                mass_payment=mass_payment,
+                destination_phone_number=phone_number,
+                destination_bank_code=bank_code,
+                amount=Decimal(amount),
+                fee_amount=Decimal(fee)
+            )
+            for phone_number, bank_code, amount, fee in lines
+        )
+        return mass_payment
+
+    def mixed_lines(self):
+        """
+        Against a balance of 100.00: posted, unknown recipient, posted,
+        insufficient funds, posted external, posted
+        """
+        return [
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('29999999', 'NOBANK', '20.00', '1.00'),
+            ('20000002', 'SEDAD', '40.00', '1.00'),
+            ('20000003', 'SEDAD', '40.00', '1.00'),
+            ('39999999', 'EXTB', '10.00', '0.50'),
+            ('20000003', 'SEDAD', '15.00', '0.50'),
+        ]
+
+    def outcome(self, mass_payment):
+        mass_payment.refresh_from_db()
+        return {
+            "status": mass_payment.status,
+            "counters": (mass_payment.success_count, mass_payment.failure_count, mass_payment.pending_count),
+            "balances": dict(Account.objects.values_list('account_number', 'balance')),
+            "items": list(mass_payment.items.order_by('id').values_list(
+                'destination_phone_number', 'status', 'failure_reason', 'transaction__amount', 'transaction__fee_amount'
+            )),
+            "transactions": list(Transaction.objects.filter(mass_payment_item__mass_payment=mass_payment).order_by(
+                'mass_payment_item__id'
+            ).values_list(
+                'transaction_type', 'status', 'amount', 'fee_amount',
+                'source_account__account_number', 'destination_account__account_number'
+            )),
+        }
+
+    def process(self, lines, **settings):
+        """
+        Process a new mass payment of `lines` and return its outcome, then
+        roll everything back
+        """
+        with transaction.atomic():
+            mass_payment = self.create_mass_payment(lines)
+            with override_settings(**settings):
+                PaymentProcessor.process_mass_payment(mass_payment.id)
+            outcome = self.outcome(mass_payment)
+            transaction.set_rollback(True)
+        return outcome
+
+    def test_batch_posting_matches_item_by_item_posting(self):
+        legacy = self.process(self.mixed_lines(), MASS_PAYMENT_BATCH_POSTING=False)
+        for chunk_size in (1, 2, 500):
+            with self.subTest(chunk_size=chunk_size):
+                batch = self.process(
+                    self.mixed_lines(),
+                    MASS_PAYMENT_BATCH_POSTING=True, MASS_PAYMENT_SHARDING=False, MASS_PAYMENT_POSTING_CHUNK_SIZE=chunk_size
+                )
+                self.assertEqual(batch, legacy)
+
+        self.assertEqual(legacy["status"], 'partially_completed')
+        self.assertEqual(legacy["counters"], (4, 2, 0))
+        self.assertEqual(legacy["balances"], {
+            'INIT001': Decimal('2.00'),
+            'RCPT001': Decimal('35.00'),
+            'RCPT002': Decimal('45.00'),
+            'RCPT003': Decimal('20.00'),
+        })
+        self.assertEqual([(phone_number, status, reason) for phone_number, status, reason, _, _ in legacy["items"]], [
+            ('20000001', 'success', None),
+            ('29999999', 'failed', "Bank provider not supported"),
+            ('20000002', 'success', None),
+            ('20000003', 'failed', "Insufficient funds"),
+            ('39999999', 'success', None),
+            ('20000003', 'success', None),
+        ])
+        self.assertEqual(legacy["transactions"], [
+            ('transfer', 'success', Decimal('30.00'), Decimal('1.00'), 'INIT001', 'RCPT001'),
+            ('transfer', 'success', Decimal('40.00'), Decimal('1.00'), 'INIT001', 'RCPT002'),
+            ('transfer', 'success', Decimal('10.00'), Decimal('0.50'), 'INIT001', None),
+            ('transfer', 'success', Decimal('15.00'), Decimal('0.50'), 'INIT001', 'RCPT003'),
+        ])
+
+    def test_batch_posting_of_a_payment_without_funds(self):
+        lines = [('20000001', 'SEDAD', '150.00', '1.00'), ('29999999', 'NOBANK', '10.00', '0.50')]
+        legacy = self.process(lines, MASS_PAYMENT_BATCH_POSTING=False)
+        batch = self.process(lines, MASS_PAYMENT_BATCH_POSTING=True, MASS_PAYMENT_SHARDING=False)
+
+        self.assertEqual(batch, legacy)
+        self.assertEqual(batch["status"], 'failed')
+        self.assertEqual(batch["counters"], (0, 2, 0))
+        self.assertEqual(batch["balances"]['INIT001'], Decimal('100.00'))
+        self.assertEqual(batch["transactions"], [])
+
+    def reserved_mass_payment(self, lines):
+        """
+        Mass payment whose whole amount and fees are held on the initiator
+        """
+        mass_payment = self.create_mass_payment(lines)
+        FundsHoldService.reserve(mass_payment, mass_payment.total_amount + mass_payment.fee_amount)
+        return mass_payment
+
+    def test_hold_is_settled_when_processing_succeeds(self):
+        lines = [
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('29999999', 'NOBANK', '20.00', '1.00'),
+            ('39999999', 'EXTB', '10.00', '0.50'),
+        ]
+        for batch_posting in (True, False):
+            with self.subTest(batch_posting=batch_posting), transaction.atomic():
+                mass_payment = self.reserved_mass_payment(lines)
+                self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('37.50'))
+
+                with override_settings(MASS_PAYMENT_BATCH_POSTING=batch_posting, MASS_PAYMENT_SHARDING=False):
+                    PaymentProcessor.process_mass_payment(mass_payment.id)
+
+                hold = mass_payment.funds_hold
+                hold.refresh_from_db()
+                self.assertEqual(hold.status, 'settled')
+                self.assertEqual(hold.consumed_amount, Decimal('41.50'))
+                self.assertEqual(hold.released_amount, Decimal('21.00'))
+                outcome = self.outcome(mass_payment)
+                self.assertEqual(outcome["status"], 'partially_completed')
+                self.assertEqual(outcome["balances"]['INIT001'], Decimal('58.50'))
+                self.assertEqual(outcome["balances"]['RCPT001'], Decimal('35.00'))
+                transaction.set_rollback(True)
+
+    def test_hold_is_released_when_every_item_fails(self):
+        mass_payment = self.reserved_mass_payment([('29999999', 'NOBANK', '20.00', '1.00')])
+
+        with override_settings(MASS_PAYMENT_SHARDING=False):
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+
+        hold = mass_payment.funds_hold
+        hold.refresh_from_db()
+        self.assertEqual((hold.status, hold.consumed_amount, hold.released_amount), ('released', Decimal('0.00'), Decimal('21.00')))
+        self.assertEqual(self.outcome(mass_payment)["status"], 'failed')
+        self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('100.00'))
+
+    def test_crash_leaves_the_payment_to_be_resumed(self):
+        mass_payment = self.reserved_mass_payment([
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('20000002', 'SEDAD', '20.00', '1.00'),
+            ('20000003', 'SEDAD', '10.00', '0.50'),
+        ])
+        items = list(mass_payment.items.order_by('id'))
+        checkpoint = PaymentProcessor._checkpoint
+        checkpoints = []
+
+        def crash_after_first_chunk(*args):
+            # The second chunk is posted, then the database goes away
+            if checkpoints:
+                raise OperationalError("server closed the connection unexpectedly")
+            checkpoints.append(args)
+            return checkpoint(*args)
+
+        with override_settings(MASS_PAYMENT_SHARDING=False, MASS_PAYMENT_POSTING_CHUNK_SIZE=1), \
+                mock.patch.object(PaymentProcessor, '_checkpoint', side_effect=crash_after_first_chunk), \
+                self.assertRaises(OperationalError):
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+
+        mass_payment.refresh_from_db()
+        self.assertEqual((mass_payment.status, mass_payment.lease_owner), ('processing', ''))
+        self.assertEqual(mass_payment.checkpoint_item_id, items[0].id)
+        self.assertEqual(self.outcome(mass_payment)["counters"], (2, 0, 1))
+        hold = mass_payment.funds_hold
+        hold.refresh_from_db()
+        self.assertEqual((hold.status, hold.consumed_amount), ('active', Decimal('52.00')))
+
+        # The job ran out of attempts: the recovery scan takes the payment over
+        ProcessingJob.objects.filter(job_type='mass_payment', object_id=mass_payment.id).update(status='failed')
+        self.assertTrue(PaymentRecovery.recover(mass_payment.id))
+        with override_settings(MASS_PAYMENT_SHARDING=False, MASS_PAYMENT_POSTING_CHUNK_SIZE=1):
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+
+        outcome = self.outcome(mass_payment)
+        self.assertEqual((outcome["status"], outcome["counters"]), ('completed', (3, 0, 0)))
+        self.assertEqual(len(outcome["transactions"]), 3)
+        self.assertEqual(outcome["balances"], {
+            'INIT001': Decimal('37.50'),
+            'RCPT001': Decimal('35.00'),
+            'RCPT002': Decimal('25.00'),
+            'RCPT003': Decimal('15.00'),
+        })
+        hold.refresh_from_db()
+        self.assertEqual((hold.status, hold.consumed_amount, hold.released_amount),
+                         ('settled', Decimal('62.50'), Decimal('0.00')))
+
+    def test_counters_after_shards_are_merged(self):
+        Account.objects.filter(id=self.initiator.id).update(balance=Decimal('500.00'))
+        for strategy, shard_count in (('id_range', 3), ('bank', 3)):
+            with self.subTest(strategy=strategy), transaction.atomic():
+                mass_payment = self.create_mass_payment(self.mixed_lines())
+                with override_settings(MASS_PAYMENT_SHARD_SIZE=2, MASS_PAYMENT_SHARD_STRATEGY=strategy):
+                    PaymentProcessor.process_mass_payment(mass_payment.id)
+
+                jobs = list(ProcessingJob.objects.filter(job_type='mass_payment_shard', object_id=mass_payment.id))
+                self.assertEqual(len(jobs), shard_count)
+                self.assertEqual(mass_payment.funds_hold.amount, Decimal('160.00'))
+
+                # Shards finish in any order; only the last one completes the payment
+                for job in reversed(jobs):
+                    self.assertEqual(self.outcome(mass_payment)["status"], 'processing')
+                    PaymentProcessor.process_shard(mass_payment.id, **job.payload)
+
+                outcome = self.outcome(mass_payment)
+                self.assertEqual(outcome["status"], 'partially_completed')
+                self.assertEqual(outcome["counters"], (5, 1, 0))
+                self.assertEqual(len(outcome["transactions"]), 5)
+                self.assertEqual(outcome["balances"]['INIT001'], Decimal('361.00'))
+                hold = mass_payment.funds_hold
+                hold.refresh_from_db()
+                self.assertEqual((hold.status, hold.consumed_amount, hold.released_amount),
+                                 ('settled', Decimal('139.00'), Decimal('21.00')))
+                self.assertEqual(PaymentProcessor.reconcile_counters([mass_payment.id]), {})
+                transaction.set_rollback(True)
+
+    def test_counter_updates_from_stale_instances_add_up(self):
+        mass_payment = self.create_mass_payment(self.mixed_lines())
+        first, second = MassPayment.objects.get(id=mass_payment.id), MassPayment.objects.get(id=mass_payment.id)
+
+        PaymentProcessor._update_counters(first, succeeded=2, failed=1)
+        PaymentProcessor._update_counters(second, succeeded=1)
+
+        self.assertEqual(self.outcome(mass_payment)["counters"], (3, 1, 2))
+
+    def test_reconcile_counters_recounts_drifted_payments(self):
+        with override_settings(MASS_PAYMENT_SHARDING=False):
+            mass_payment = self.create_mass_payment(self.mixed_lines())
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+            untouched = self.create_mass_payment(self.mixed_lines()[:1])
+        MassPayment.objects.filter(id=mass_payment.id).update(success_count=0, failure_count=6, pending_count=3)
+
+        output = io.StringIO()
+        call_command('reconcile_mass_payment_counters', '--dry-run', stdout=output)
+        self.assertIn(f"Mass payment {mass_payment.id}: success/failure/pending 0/6/3 -> 4/2/0", output.getvalue())
+        self.assertIn("1 mass payments would be fixed", output.getvalue())
+        self.assertEqual(self.outcome(mass_payment)["counters"], (0, 6, 3))
+
+        self.assertEqual(PaymentProcessor.reconcile_counters(), {mass_payment.id: ((0, 6, 3), (4, 2, 0))})
+        self.assertEqual(self.outcome(mass_payment)["counters"], (4, 2, 0))
+        self.assertEqual(self.outcome(untouched)["counters"], (0, 0, 1))
+        self.assertEqual(PaymentProcessor.reconcile_counters(), {})
+
+    def crashed_mass_payment(self):
+        """
+        Reserved mass payment whose worker died in the middle of its first
+        chunk (items 1 to 4, checkpoint after item 4): item 1 is posted and
+        counted, item 2 has no transaction, item 3 is posted but not marked,
+        item 4 is debited and waiting for its bank's answer; item 5 is pending
+        """
+        mass_payment = self.create_mass_payment([
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('20000002', 'SEDAD', '20.00', '1.00'),
+            ('20000003', 'SEDAD', '10.00', '0.50'),
+            ('39999999', 'EXTB', '10.00', '0.50'),
+            ('20000001', 'SEDAD', '5.00', '0.50'),
+        ])
+        FundsHoldService.reserve(mass_payment, Decimal('78.50'))
+        items = list(mass_payment.items.order_by('id'))
+
+        for item, status, item_status, destination in (
+            (items[0], 'success', 'success', self.recipients[0]),
+            (items[2], 'success', 'processing', self.recipients[2]),
+            (items[3], 'pending', 'processing', None),
+        ):
+            item.transaction = Transaction.objects.create(
+                transaction_type='transfer', status=status, amount=item.amount, fee_amount=item.fee_amount,
+                source_account=self.initiator, destination_account=destination
+            )
+            item.status = item_status
+            item.save(update_fields=['transaction', 'status'])
+            if destination is not None:
+                Account.objects.filter(id=destination.id).update(balance=F('balance') + item.amount)
+        MassPaymentItem.objects.filter(id=items[1].id).update(status='processing')
+        FundsHoldService.consume(mass_payment, Decimal('52.00'))
+
+        expired = timezone.now() - timedelta(minutes=5)
+        MassPayment.objects.filter(id=mass_payment.id).update(
+            status='processing', success_count=1, pending_count=4,
+            lease_owner='crashed-worker', lease_expires_at=expired, checkpoint_item_id=items[3].id
+        )
+        ProcessingJob.objects.filter(job_type='mass_payment', object_id=mass_payment.id).update(
+            status='running', lease_owner='crashed-worker', lease_expires_at=expired
+        )
+        return mass_payment, items
+
+    def start_external_bank(self, **options):
+        """
+        Point the EXTB provider at a stub bank, dispatched to by a dispatcher
+        of this test only
+        """
+        server = StubBankServer(**options)
+        self.addCleanup(server.stop)
+        provider = BankProvider.objects.get(bank_code='EXTB')
+        provider.api_endpoint = server.start()
+        provider.save()
+        dispatcher = ExternalTransferDispatcher()
+        self.addCleanup(dispatcher.close)
+        patcher = mock.patch.object(ExternalTransferDispatcher, 'get', return_value=dispatcher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def test_item_by_item_posting_sends_external_transfers_to_the_provider(self):
+        server = self.start_external_bank(reject_phone_numbers=['39999998'])
+        lines = [
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('39999999', 'EXTB', '10.00', '0.50'),
+            ('39999998', 'EXTB', '20.00', '0.50'),
+        ]
+        legacy = self.process(lines, MASS_PAYMENT_BATCH_POSTING=False, EXTERNAL_TRANSFER_DISPATCH=True)
+        self.assertEqual(len(server.received), 2)
+        batch = self.process(
+            lines, MASS_PAYMENT_BATCH_POSTING=True, MASS_PAYMENT_SHARDING=False, EXTERNAL_TRANSFER_DISPATCH=True
+        )
+        self.assertEqual(len(server.received), 4)
+
+        self.assertEqual(legacy, batch)
+        self.assertEqual((legacy["status"], legacy["counters"]), ('partially_completed', (2, 1, 0)))
+        self.assertEqual([(status, reason) for _, status, reason, _, _ in legacy["items"]], [
+            ('success', None),
+            ('success', None),
+            ('failed', "External transfer failed: Unknown beneficiary"),
+        ])
+        self.assertEqual(legacy["balances"]['INIT001'], Decimal('58.50'))
+        self.assertEqual([status for _, status, *_ in legacy["transactions"]], ['success', 'success', 'failure'])
+
+    def test_parked_transfer_fails_when_its_provider_is_removed(self):
+        server = self.start_external_bank(unavailable=True)
+        mass_payment = self.create_mass_payment([
+            ('20000001', 'SEDAD', '30.00', '1.00'),
+            ('39999999', 'EXTB', '10.00', '0.50'),
+        ])
+        with override_settings(MASS_PAYMENT_SHARDING=False, EXTERNAL_TRANSFER_DISPATCH=True):
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+            self.assertEqual(self.outcome(mass_payment)["counters"], (1, 0, 1))
+            self.assertEqual(self.outcome(mass_payment)["balances"]['INIT001'], Decimal('58.50'))
+
+            BankProvider.objects.filter(bank_code='EXTB').update(is_active=False)
+            BankProviderRegistry.invalidate()
+            MassPaymentItem.objects.filter(mass_payment=mass_payment).update(next_dispatch_at=timezone.now())
+            PaymentProcessor.retry_parked_transfers(mass_payment.id)
+
+        outcome = self.outcome(mass_payment)
+        self.assertEqual((outcome["status"], outcome["counters"]), ('partially_completed', (1, 1, 0)))
+        self.assertEqual(outcome["items"][1][1:3], (
+            'failed', "External transfer failed: Bank provider EXTB is no longer available"
+        ))
+        self.assertEqual(outcome["balances"]['INIT001'], Decimal('69.00'))
+        self.assertEqual(server.received, [])
+
+    def test_recovery_resumes_a_crashed_payment_without_paying_twice(self):
+        server = StubBankServer()
+        self.addCleanup(server.stop)
+        provider = BankProvider.objects.get(bank_code='EXTB')
+        provider.api_endpoint = server.start()
+        provider.save()
+        mass_payment, items = self.crashed_mass_payment()
+
+        self.assertEqual(PaymentRecovery.scan(), 1)
+
+        mass_payment.refresh_from_db()
+        self.assertEqual((mass_payment.lease_owner, mass_payment.recovery_count), ('', 1))
+        self.assertEqual(mass_payment.checkpoint_item_id, items[1].id - 1)
+        self.assertEqual(self.outcome(mass_payment)["counters"], (2, 0, 3))
+        self.assertEqual(
+            list(mass_payment.items.order_by('id').values_list('status', flat=True)),
+            ['success', 'pending', 'success', 'processing', 'pending']
+        )
+        self.assertIsNotNone(MassPaymentItem.objects.get(id=items[3].id).next_dispatch_at)
+        self.assertEqual(
+            sorted(ProcessingJob.objects.filter(object_id=mass_payment.id, status='pending').values_list('job_type', flat=True)),
+            ['external_retry', 'mass_payment']
+        )
+
+        # The jobs queued by the recovery, as a worker would run them
+        with override_settings(EXTERNAL_TRANSFER_DISPATCH=True):
+            PaymentProcessor.process_mass_payment(mass_payment.id)
+            self.assertEqual(self.outcome(mass_payment)["status"], 'processing')
+            PaymentProcessor.retry_parked_transfers(mass_payment.id)
+
+        outcome = self.outcome(mass_payment)
+        self.assertEqual(outcome["status"], 'completed')
+        self.assertEqual(outcome["counters"], (5, 0, 0))
+        self.assertEqual(Transaction.objects.filter(source_account=self.initiator).count(), 5)
+        transaction_ids = list(mass_payment.items.values_list('transaction_id', flat=True))
+        self.assertEqual(len(set(transaction_ids) - {None}), 5)
+        self.assertEqual(outcome["balances"], {
+            'INIT001': Decimal('21.50'),
+            'RCPT001': Decimal('40.00'),
+            'RCPT002': Decimal('25.00'),
+            'RCPT003': Decimal('15.00'),
+        })
+        hold = mass_payment.funds_hold
+        hold.refresh_from_db()
+        self.assertEqual((hold.status, hold.consumed_amount, hold.released_amount),
+                         ('settled', Decimal('78.50'), Decimal('0.00')))
+        self.assertEqual([transfer['reference'] for transfer in server.received],
+                         [f"{mass_payment.reference_code}-{items[3].id}"])
+
+    def test_recovery_leaves_leased_payments_alone(self):
+        mass_payment, _ = self.crashed_mass_payment()
+        MassPayment.objects.filter(id=mass_payment.id).update(lease_expires_at=timezone.now() + timedelta(minutes=1))
+
+        self.assertEqual(PaymentRecovery.scan(), 0)
+
+        mass_payment.refresh_from_db()
+        self.assertEqual((mass_payment.lease_owner, mass_payment.recovery_count), ('crashed-worker', 0))
+        self.assertEqual(self.outcome(mass_payment)["counters"], (1, 0, 4))
+
+
+class IdempotencyKeyTests(TestCase):
+    """
+    Idempotency-Key header on POST /api/mass-payments/
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.accounts = [
+            create_account(f'3000000{n}', f'IDEM00{n}', '1000.00') for n in range(1, 4)
+        ]
+
+    def payload(self, initiator='IDEM001', amount='10.00'):
+        return {
+            "initiator_account_number": initiator,
+            "recipients": [{"phone_number": '30000003', "bank_code": 'SEDAD', "amount": amount}],
+        }
+
+    def post(self, data, key='payroll-2026-10'):
+        return self.client.post('/api/mass-payments/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.post(self.payload())
+        self.assertEqual(first.status_code, 201, first.data)
+
+        with self.assertNumQueries(1):
+            retry = self.post(self.payload())
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(MassPayment.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().mass_payment_id, first.data['mass_payment_id'])
+
+    def test_same_key_for_a_different_request_is_rejected(self):
+        self.assertEqual(self.post(self.payload()).status_code, 201)
+
+        response = self.post(self.payload(amount='20.00'))
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(MassPayment.objects.count(), 1)
+
+    def test_retry_while_the_first_request_runs_gets_a_conflict(self):
+        create = MassPaymentCreator.create
+        retries = []
+
+        def create_while_retried(*args, **kwargs):
+            retries.append(self.post(self.payload()))
+            return create(*args, **kwargs)
+
+        with mock.patch.object(MassPaymentCreator, 'create', side_effect=create_while_retried):
+            first = self.post(self.payload())
+
+        self.assertEqual(first.status_code, 201, first.data)
+        self.assertEqual([retry.status_code for retry in retries], [409])
+        self.assertEqual(MassPayment.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+
+    def test_keys_are_scoped_by_initiator_account(self):
+        first = self.post(self.payload('IDEM001'))
+        other = self.post(self.payload('IDEM002'))
+
+        self.assertEqual((first.status_code, other.status_code), (201, 201))
+        self.assertFalse(other.has_header('Idempotent-Replayed'))
+        self.assertNotEqual(other.data['mass_payment_id'], first.data['mass_payment_id'])
+        self.assertEqual(
+            set(IdempotencyKey.objects.values_list('scope', 'key')),
+            {('IDEM001', 'payroll-2026-10'), ('IDEM002', 'payroll-2026-10')}
+        )
+
+    def test_failed_request_releases_the_key(self):
+        response = self.post(self.payload(amount='5000.00'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.post(self.payload()).status_code, 201)
+
+
+class MassPaymentCreationTests(TestCase):
+    """
+    Creation endpoints share pricing, funds hold and idempotency
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.initiator = create_account('50000000', 'CREA000', '1000.00')
+        for n in range(1, 3):
+            create_account(f'5000000{n}', f'CREA00{n}', '0.00')
+        FeeSchedule.objects.create(bank_code='SEDAD', flat_fee=Decimal('0.75'))
+        FeeScheduleRegistry.invalidate()
+        self.group = RecipientGroup.objects.create(name='Payroll')
+        GroupRecipient.objects.bulk_create([
+            GroupRecipient(group=self.group, phone_number='50000001', bank_code='SEDAD', full_name='Test CREA001',
+                           default_amount=Decimal('100.00'), status='validated'),
+            GroupRecipient(group=self.group, phone_number='50000002', bank_code='SEDAD', full_name='Test CREA002',
+                           default_amount=Decimal('50.00'), status='validated'),
+        ])
+
+    def created(self, response):
+        self.assertEqual(response.status_code, 201, response.data)
+        mass_payment = MassPayment.objects.get(id=response.data['mass_payment_id'])
+        return (
+            mass_payment.total_amount,
+            mass_payment.fee_amount,
+            FundsHold.objects.get(mass_payment=mass_payment).amount,
+            list(mass_payment.items.order_by('id').values_list('destination_phone_number', 'amount', 'fee_amount')),
+        )
+
+    def test_group_payment_is_priced_and_held_like_a_json_payment(self):
+        from_group = self.created(self.client.post(
+            f'/api/recipient-groups/{self.group.id}/create_mass_payment/',
+            {"initiator_account_number": 'CREA000'}, format='json'
+        ))
+        from_json = self.created(self.client.post('/api/mass-payments/', {
+            "initiator_account_number": 'CREA000',
+            "recipients": [
+                {"phone_number": '50000001', "bank_code": 'SEDAD', "amount": '100.00'},
+                {"phone_number": '50000002', "bank_code": 'SEDAD', "amount": '50.00'},
+            ],
+        }, format='json'))
+
+        self.assertEqual(from_group, from_json)
+        self.assertEqual(from_group[:3], (Decimal('150.00'), Decimal('1.50'), Decimal('151.50')))
+        self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('697.00'))
+
+    def test_group_payment_without_funds_creates_nothing(self):
+        Account.objects.filter(id=self.initiator.id).update(balance=Decimal('100.00'))
+
+        response = self.client.post(
+            f'/api/recipient-groups/{self.group.id}/create_mass_payment/',
+            {"initiator_account_number": 'CREA000'}, format='json', HTTP_IDEMPOTENCY_KEY='group-payroll'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MassPayment.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('100.00'))
+
+
+    def test_items_are_inserted_in_batches(self):
+        accounts = {account.user.phone_number: account for account in Account.objects.select_related('user')}
+        recipients = [
+            {"phone_number": phone_number, "bank_code": 'SEDAD', "destination_account": accounts[phone_number],
+             "amount": Decimal(amount), "fee_amount": Decimal('0.75')}
+            for phone_number, amount in [
+                ('50000001', '10.00'), ('50000002', '20.00'), ('50000001', '30.00'),
+                ('50000002', '40.00'), ('50000001', '50.00'),
+            ]
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            mass_payment, items = MassPaymentCreator.create(
+                self.initiator, recipients, Decimal('150.00'), Decimal('3.75'), batch_size=2
+            )
+
+        self.assertEqual(
+            sum(query['sql'].startswith('INSERT INTO "payments_masspaymentitem"') for query in queries.captured_queries),
+            3
+        )
+        self.assertTrue(all(item.id for item in items))
+        self.assertEqual(
+            list(mass_payment.items.order_by('id').values_list('id', 'amount')),
+            [(item.id, item.amount) for item in items]
+        )
+        self.assertEqual((mass_payment.status, mass_payment.pending_count), ('processing', 5))
+        self.assertEqual(FundsHold.objects.get(mass_payment=mass_payment).amount, Decimal('153.75'))
+
+        summary = MassPaymentCreator.build_response(mass_payment, items, self.initiator, summary_only=True)
+        self.assertEqual((summary["recipients_count"], summary["external_recipients_count"]), (5, 0))
+        self.assertNotIn("recipients", summary)
+        echoed = MassPaymentCreator.build_response(mass_payment, items, self.initiator)["recipients"]
+        self.assertEqual([recipient["id"] for recipient in echoed], [item.id for item in items])
+
+
+    def upload(self, content, **data):
+        return self.client.post('/api/mass-payments/upload/', {
+            "initiator_account_number": 'CREA000',
+            "file": SimpleUploadedFile('recipients.csv', content, content_type='text/csv'),
+            **data,
+        }, format='multipart')
+
+    @override_settings(MASS_PAYMENT_UPLOAD_CHUNK_SIZE=1)
+    def test_uploaded_file_payment_is_priced_and_held_like_a_json_payment(self):
+        response = self.upload(b"phone_number,amount,bank_code\n50000001,100.00,SEDAD\n50000002,50,\n")
+        self.assertEqual((response.data['recipients_count'], response.data['external_recipients_count']), (2, 0))
+        self.assertNotIn('recipients', response.data)
+        from_file = self.created(response)
+        from_json = self.created(self.client.post('/api/mass-payments/', {
+            "initiator_account_number": 'CREA000',
+            "recipients": [
+                {"phone_number": '50000001', "bank_code": 'SEDAD', "amount": '100.00'},
+                {"phone_number": '50000002', "bank_code": 'SEDAD', "amount": '50.00'},
+            ],
+        }, format='json'))
+
+        self.assertEqual(from_file, from_json)
+        self.assertEqual(MassPayment.objects.get(id=response.data['mass_payment_id']).pending_count, 2)
+
+    def test_uploaded_file_with_invalid_rows_creates_nothing(self):
+        response = self.upload(b"phone_number,amount\n50000001,100\n59999999,10\n50000002,ten\n,5\n")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error_count'], 3)
+        self.assertEqual([(error['row'], error['field']) for error in response.data['recipients']], [
+            (2, 'phone_number'), (3, 'amount'), (4, 'phone_number'),
+        ])
+        self.assertFalse(MassPayment.objects.exists())
+        self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('1000.00'))
+
+    @override_settings(MASS_PAYMENT_UPLOAD_CHUNK_SIZE=1)
+    def test_uploaded_file_stops_at_the_chunk_that_overdraws(self):
+        response = self.upload(b"phone_number,amount\n50000001,600\n50000002,600\n50000001,600\n")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['error'], "Insufficient funds for the total amount and fees (exceeded after 2 rows)"
+        )
+        self.assertFalse(MassPayment.objects.exists())
+        self.assertFalse(FundsHold.objects.exists())
+        self.assertEqual(Account.objects.get(id=self.initiator.id).balance, Decimal('1000.00'))
+
+
+class RecipientResolverTests(TestCase):
+    """
+    Bulk resolution of recipients to destination accounts
+    """
+
+    def setUp(self):
+        self.sedad = create_account('42000001', 'RSLV001', '0.00')
+        self.other_bank = Account.objects.create(
+            user=self.sedad.user, account_number='RSLV002', balance=Decimal('0.00'), bank_code='BNK2'
+        )
+        blocked = create_account('42000002', 'RSLV003', '0.00')
+        blocked.is_blocked = True
+        blocked.save()
+
+    def test_resolves_in_chunked_queries(self):
+        recipients = [
+            ('42000001', None),
+            ('42000001', 'BNK2'),
+            ('42000002', None),
+            ('42000002', 'SEDAD'),
+            ('42000009', None),
+            ('42000001', 'NOPE'),
+            (42000001, None),
+        ]
+
+        # Accounts of 3 phone numbers by 2, then users of the 2 without any
+        with self.assertNumQueries(3):
+            accounts, failures = RecipientResolver.resolve(recipients, chunk_size=2)
+
+        self.assertEqual(accounts, {('42000001', None): self.sedad, ('42000001', 'BNK2'): self.other_bank})
+        self.assertEqual(accounts[('42000001', None)].user.phone_number, '42000001')
+        self.assertEqual(failures, {
+            2: {"field": "phone_number", "error": RecipientResolver.NO_ACTIVE_ACCOUNT},
+            3: {"field": "bank_code", "error": RecipientResolver.ACCOUNT_NOT_FOUND},
+            4: {"field": "phone_number", "error": RecipientResolver.USER_NOT_FOUND},
+            5: {"field": "bank_code", "error": RecipientResolver.ACCOUNT_NOT_FOUND},
+        })
+
+
+class RecipientImporterTests(TestCase):
+    """
+    Imports of recipient rows into a recipient group
+    """
+
+    def test_invalid_amounts_fail_their_row_only(self):
+        for n in range(1, 3):
+            create_account(f'4000000{n}', f'IMPT00{n}', '0.00')
+        group = RecipientGroup.objects.create(name='Import')
+        rows = [
+            {"phone_number": '40000001', "amount": '10.5', "motive": 'Salary'},
+            {"phone_number": '40000009', "amount": '1e20'},
+            {"phone_number": '40000009', "amount": '12.345'},
+            {"phone_number": '40000009', "amount": 'ten'},
+            {"phone_number": '40000009', "amount": 'NaN'},
+            {"phone_number": '40000009', "amount": '-5'},
+            {"phone_number": '40000002', "amount": 7},
+        ]
+
+        summary = RecipientImporter.import_rows(group, rows)
+
+        self.assertEqual((summary["total_count"], summary["successful_count"], summary["failed_count"]), (7, 2, 5))
+        self.assertEqual([failure["error"] for failure in summary["failed_records"]], [
+            "Ensure that there are no more than 15 digits and 2 decimal places",
+            "Ensure that there are no more than 15 digits and 2 decimal places",
+            RecipientImporter.INVALID_AMOUNT,
+            RecipientImporter.INVALID_AMOUNT,
+            RecipientImporter.NON_POSITIVE_AMOUNT,
+        ])
+        self.assertEqual(
+            list(group.recipients.order_by('phone_number').values_list('phone_number', 'default_amount')),
+            [('40000001', Decimal('10.50')), ('40000002', Decimal('7.00'))]
+        )
+
+
+    @override_settings(RECIPIENT_IMPORT_CHUNK_SIZE=2)
+    def test_background_import_reports_progress_and_failures(self):
+        import_dir = tempfile.mkdtemp(prefix='recipient-imports-')
+        self.addCleanup(shutil.rmtree, import_dir, ignore_errors=True)
+        for n in range(1, 4):
+            create_account(f'4100000{n}', f'IMPA00{n}', '0.00')
+        group = RecipientGroup.objects.create(name='Background import')
+        # Creating the group queued its own job
+        ProcessingJob.objects.all().delete()
+        content = b"phone_number,amount,motive\n41000001,10,Salary\n41000009,5,Bonus\n41000002,7.5,\n41000003,2,\n"
+        client = APIClient()
+
+        with override_settings(RECIPIENT_IMPORT_DIR=Path(import_dir)):
+            response = client.post(
+                f'/api/recipient-groups/{group.id}/upload_recipients_csv/?async=true',
+                {'file': SimpleUploadedFile('recipients.csv', content, content_type='text/csv')},
+                format='multipart'
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(
+                (response.data['status'], response.data['file_size'], response.data['progress_percentage']),
+                ('pending', len(content), 0.0)
+            )
+            recipient_import = RecipientImport.objects.get(id=response.data['id'])
+            self.assertEqual(os.listdir(import_dir), [Path(recipient_import.file_path).name])
+
+            # Counters as each chunk starts: committed with the previous one
+            progress = []
+            import_chunk = RecipientImporter._import_chunk
+
+            def record_progress(group, rows):
+                progress.append(RecipientImport.objects.values_list('rows_processed', 'rows_failed').get(
+                    id=recipient_import.id
+                ))
+                return import_chunk(group, rows)
+
+            job = JobQueue.claim('worker-a', job_types=['recipient_import'])
+            self.assertEqual(job.object_id, recipient_import.id)
+            with mock.patch.object(RecipientImporter, '_import_chunk', side_effect=record_progress):
+                PaymentWorkerPool(JOB_HANDLERS)._run_job(job, 'worker-a')
+            self.assertEqual(progress, [(0, 0), (2, 1)])
+
+        status_url = f'/api/recipient-groups/{group.id}/imports/{recipient_import.id}/'
+        response = client.get(status_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [response.data[field] for field in (
+                'status', 'rows_processed', 'rows_succeeded', 'rows_failed', 'progress_percentage', 'eta_seconds'
+            )],
+            ['completed', 4, 3, 1, 100.0, 0]
+        )
+        self.assertTrue(response.data['failure_report_url'].endswith(f'{status_url}failures/'))
+
+        response = client.get(f'{status_url}failures/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['phone_number,error', f'41000009,{RecipientImporter.USER_NOT_FOUND}']
+        )
+        response.close()
+
+        group.refresh_from_db()
+        self.assertEqual(group.status, 'partially_completed')
+        self.assertEqual(group.recipients.count(), 3)
+        # The spooled upload is deleted, its failure report kept
+        self.assertEqual(os.listdir(import_dir), [Path(recipient_import.file_path).name + '.failures.csv'])
+
+
+class QueryCountMiddlewareTests(TestCase):
+    """
+    X-DB-Query-Count header of QueryCountMiddleware
+    """
+
+    def setUp(self):
+        create_account('60000001', 'QCNT001', '0.00')
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    def test_counts_the_queries_of_a_request(self):
+        with self.assertNumQueries(2):
+            response = Client().get('/api/accounts/')
+        self.assertEqual(response['X-DB-Query-Count'], '2')
+
+    @override_settings(QUERY_COUNT_HEADER=True)
+    async def test_counts_the_queries_of_an_asgi_request(self):
+        response = await AsyncClient().get('/api/accounts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-DB-Query-Count'], '2')
+
+    @override_settings(QUERY_COUNT_HEADER=False)
+    def test_not_installed_when_disabled(self):
+        self.assertFalse(Client().get('/api/accounts/').has_header('X-DB-Query-Count'))
+
+
+@override_settings(PAYMENT_JOB_MAX_ATTEMPTS=3, PAYMENT_JOB_RETRY_BACKOFF_SECONDS=10, PAYMENT_JOB_MAX_BACKOFF_SECONDS=30)
+class JobQueueTests(TestCase):
+    """
+    Claims, leases, retries and dead-lettering of the ProcessingJob queue
+    """
+
+    def enqueue(self, job_type='recipient_group', **options):
+        # Not a mass payment or group: no signal queues a job of its own
+        return JobQueue.enqueue(job_type, 1, **options)
+
+    def assertAvailableIn(self, job, seconds):
+        job.refresh_from_db()
+        self.assertAlmostEqual((job.available_at - timezone.now()).total_seconds(), seconds, delta=2)
+
+    def test_claim_leases_the_oldest_available_job(self):
+        first = self.enqueue()
+        self.enqueue(delay_seconds=60)
+        self.enqueue('recipient_import')
+
+        job = JobQueue.claim('worker-a', lease_seconds=30, job_types=['recipient_group'])
+
+        self.assertEqual(job.id, first.id)
+        self.assertEqual((job.status, job.lease_owner, job.attempts), ('running', 'worker-a', 1))
+        self.assertAlmostEqual((job.lease_expires_at - timezone.now()).total_seconds(), 30, delta=2)
+        # The other group job is not due yet
+        self.assertIsNone(JobQueue.claim('worker-b', job_types=['recipient_group']))
+
+    def test_heartbeat_and_complete_need_the_lease(self):
+        job = self.enqueue()
+        job = JobQueue.claim('worker-a', lease_seconds=30)
+
+        self.assertTrue(JobQueue.heartbeat(job, 'worker-a', lease_seconds=120))
+        self.assertFalse(JobQueue.heartbeat(job, 'worker-b'))
+        job.refresh_from_db()
+        self.assertAlmostEqual((job.lease_expires_at - timezone.now()).total_seconds(), 120, delta=2)
+
+        JobQueue.complete(job, 'worker-b')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        JobQueue.complete(job, 'worker-a')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_owner, job.lease_expires_at), ('completed', '', None))
+
+    def test_failed_attempts_back_off_exponentially_then_dead_letter(self):
+        job = self.enqueue()
+        ProcessingJob.objects.filter(id=job.id).update(max_attempts=4)
+
+        for delay in (10, 20, 30):
+            job = JobQueue.claim('worker-a')
+            JobQueue.fail(job, 'worker-a', "Bank unavailable")
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.lease_owner, job.last_error), ('pending', '', "Bank unavailable"))
+            self.assertAvailableIn(job, delay)
+            self.assertIsNone(JobQueue.claim('worker-a'))
+            ProcessingJob.objects.filter(id=job.id).update(available_at=timezone.now())
+
+        job = JobQueue.claim('worker-a')
+        self.assertEqual(job.attempts, 4)
+        JobQueue.fail(job, 'worker-a', "Bank unavailable")
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNone(JobQueue.claim('worker-a'))
+
+    def test_non_retryable_failure_dead_letters_at_once(self):
+        self.enqueue()
+        job = JobQueue.claim('worker-a')
+
+        JobQueue.fail(job, 'worker-a', "No handler", retry=False)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    def test_job_whose_lease_expired_is_reclaimed(self):
+        self.enqueue()
+        job = JobQueue.claim('worker-a')
+        ProcessingJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = JobQueue.claim('worker-b')
+
+        self.assertEqual((reclaimed.id, reclaimed.lease_owner, reclaimed.attempts), (job.id, 'worker-b', 2))
+        # The first worker no longer owns it
+        self.assertFalse(JobQueue.heartbeat(job, 'worker-a'))
+        JobQueue.fail(job, 'worker-a', "Too late")
+        reclaimed.refresh_from_db()
+        self.assertEqual((reclaimed.status, reclaimed.lease_owner), ('running', 'worker-b'))
+
+    def test_job_that_keeps_losing_its_lease_is_given_up(self):
+        self.enqueue()
+        for attempt in range(3):
+            job = JobQueue.claim(f'worker-{attempt}')
+            ProcessingJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(JobQueue.claim('worker-3'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('failed', 4, "Lease expired too many times"))
+
+    def test_worker_retries_a_job_whose_handler_raises(self):
+        calls = []
+
+        def handler(object_id, **payload):
+            calls.append((object_id, payload))
+            raise RuntimeError("Bank unavailable")
+
+        self.enqueue(payload={"shard": 2})
+        pool = PaymentWorkerPool({'recipient_group': handler})
+        job = JobQueue.claim('worker-a')
+
+        pool._run_job(job, 'worker-a')
+
+        self.assertEqual(calls, [(1, {"shard": 2})])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error, job.lease_owner), ('pending', "Bank unavailable", ''))
+        self.assertAvailableIn(job, 10)
+
+    def test_mass_payment_job_is_retried_when_processing_fails(self):
+        initiator = create_account('70000000', 'JOBQ000', '100.00')
+        create_account('70000001', 'JOBQ001', '0.00')
+        mass_payment = MassPayment.objects.create(
+            initiator_account=initiator, total_amount=Decimal('10.00'), pending_count=1
+        )
+        MassPaymentItem.objects.create(
+            mass_payment=mass_payment, destination_phone_number='70000001', destination_bank_code='SEDAD',
+            amount=Decimal('10.00')
+        )
+        pool = PaymentWorkerPool(JOB_HANDLERS)
+        job = JobQueue.claim('worker-a', job_types=['mass_payment'])
+        self.assertEqual(job.object_id, mass_payment.id)
+
+        with mock.patch.object(PaymentProcessor, '_process_in_batches', side_effect=OperationalError("database is locked")):
+            pool._run_job(job, 'worker-a')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('pending', "database is locked"))
+        mass_payment.refresh_from_db()
+        self.assertEqual(mass_payment.status, 'processing')
+
+        ProcessingJob.objects.filter(id=job.id).update(available_at=timezone.now())
+        job = JobQueue.claim('worker-a', job_types=['mass_payment'])
+        pool._run_job(job, 'worker-a')
+
+        job.refresh_from_db()
+        mass_payment.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('completed', 2))
+        self.assertEqual((mass_payment.status, mass_payment.success_count), ('completed', 1))
+
+
+@override_settings(MASS_PAYMENT_EVENTS_POLL_INTERVAL=0.01)
+class MassPaymentEventsTests(TestCase):
+    """
+    Server-Sent Events stream of /api/mass-payments/<pk>/events/
+    """
+
+    def setUp(self):
+        initiator = create_account('70000000', 'SSE001', '100.00')
+        self.mass_payment = MassPayment.objects.create(
+            initiator_account=initiator,
+            total_amount=Decimal('30.00'),
+            fee_amount=Decimal('0.00'),
+            status='processing',
+            failure_count=1,
+            pending_count=2
+        )
+        self.failed_items = MassPaymentItem.objects.bulk_create(
+            MassPaymentItem(
+                mass_payment=self.mass_payment,
+                destination_phone_number=f'7000000{number}',
+                destination_bank_code='SEDAD',
+                amount=Decimal('10.00'),
+                fee_amount=Decimal('0.00'),
+                status='failed' if number == 1 else 'pending',
+                failure_reason='Recipient account not found' if number == 1 else None
+            )
+            for number in (1, 2, 3)
+        )[:1]
+
+    @staticmethod
+    def parse(chunk):
+        """
+        (event, data, id) of one SSE chunk, data decoded from JSON
+        """
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+        data = json.loads(fields['data']) if 'data' in fields else None
+        return fields.get('event'), data, fields.get('id')
+
+    async def open_stream(self):
+        """
+        Events of the payment, past the initial retry line
+        """
+        response = await AsyncClient().get(f'/api/mass-payments/{self.mass_payment.id}/events/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 30\n\n")
+        return stream
+
+    def update(self, **fields):
+        return MassPayment.objects.filter(id=self.mass_payment.id).aupdate(**fields)
+
+    async def test_streams_progress_until_the_final_event(self):
+        stream = await self.open_stream()
+        failed_id = str(self.failed_items[0].id)
+
+        event, data, event_id = self.parse(await anext(stream))
+        self.assertEqual((event, event_id), ('progress', '0'))
+        self.assertEqual(
+            (data['processed_count'], data['total_count'], data['percentage'], data['delta']),
+            (1, 3, 33.33, None)
+        )
+        event, data, event_id = self.parse(await anext(stream))
+        self.assertEqual((event, event_id), ('failures', failed_id))
+        self.assertEqual(
+            [(item['destination_phone_number'], item['failure_reason']) for item in data],
+            [('70000001', 'Recipient account not found')]
+        )
+
+        await self.update(success_count=1, pending_count=1)
+        event, data, event_id = self.parse(await anext(stream))
+        self.assertEqual((event, event_id, data['status']), ('progress', failed_id, 'processing'))
+        self.assertEqual(data['delta'], {"success_count": 1, "failure_count": 0, "pending_count": -1})
+        self.assertEqual(data['processed_count'], 2)
+        self.assertGreater(data['items_per_second'], 0)
+
+        await self.update(status='partially_completed', success_count=2, pending_count=0)
+        event, data, _ = self.parse(await anext(stream))
+        self.assertEqual((event, data['status'], data['percentage'], data['eta_seconds']), (
+            'progress', 'partially_completed', 100.0, 0
+        ))
+        self.assertEqual(self.parse(await anext(stream)), ('end', {"status": "partially_completed"}, failed_id))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    @override_settings(MASS_PAYMENT_EVENTS_MAX_FAILURES=1)
+    async def test_finished_payment_drains_its_failures_and_ends(self):
+        await MassPaymentItem.objects.filter(destination_phone_number='70000002').aupdate(
+            status='failed', failure_reason='Insufficient funds'
+        )
+        await self.update(status='failed', failure_count=2, pending_count=1)
+        stream = await self.open_stream()
+
+        events = [self.parse(chunk) async for chunk in stream]
+
+        self.assertEqual([event for event, _, _ in events], ['progress', 'failures', 'failures', 'end'])
+        self.assertEqual(
+            [data[0]['failure_reason'] for event, data, _ in events if event == 'failures'],
+            ['Recipient account not found', 'Insufficient funds']
+        )
+        self.assertEqual(events[-1][1], {"status": "failed"})
+
+    async def test_resumes_after_the_last_event_id(self):
+        await self.update(status='failed')
+        response = await AsyncClient().get(
+            f'/api/mass-payments/{self.mass_payment.id}/events/',
+            headers={'Last-Event-ID': str(self.failed_items[0].id)}
+        )
+        events = [self.parse(chunk) async for chunk in response.streaming_content][1:]
+        self.assertEqual([event for event, _, _ in events], ['progress', 'end'])
+
+    async def test_unknown_payment_is_not_found(self):
+        response = await AsyncClient().get(f'/api/mass-payments/{self.mass_payment.id + 1}/events/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ProcessingMetricsTests(TestCase):
+    """
+    Timing histograms of mass payment processing and GET /metrics
+    """
+
+    def setUp(self):
+        ProcessingMetrics.reset()
+        self.addCleanup(ProcessingMetrics.reset)
+
+    def test_histogram_exposes_cumulative_buckets(self):
+        histogram = Histogram('test_seconds', 'Test durations', ['stage'], (0.5, 0.1, 1))
+        histogram.observe(0.1, stage='lock')  # On a bound: counted in its bucket
+        histogram.observe(0.3, count=2, stage='lock')
+        histogram.observe(5, stage='lock')  # Above every bound: only in +Inf
+
+        self.assertEqual(histogram.expose(), [
+            '# HELP test_seconds Test durations',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="lock",le="0.1"} 1',
+            'test_seconds_bucket{stage="lock",le="0.5"} 3',
+            'test_seconds_bucket{stage="lock",le="1.0"} 3',
+            'test_seconds_bucket{stage="lock",le="+Inf"} 4',
+            'test_seconds_sum{stage="lock"} 5.7',
+            'test_seconds_count{stage="lock"} 4',
+        ])
+
+    def test_histogram_escapes_label_values(self):
+        histogram = Histogram('test_seconds', 'Test durations', ['bank_code'], (1,))
+        histogram.observe(0.5, bank_code='A"B\\C\nD')
+        self.assertIn('test_seconds_count{bank_code="A\\"B\\\\C\\nD"} 1', histogram.expose())
+
+    def test_chunk_that_raises_observes_no_items(self):
+        item = MassPaymentItem(destination_bank_code='SEDAD', status='success')
+        timer = StageTimer()
+        with self.assertRaises(OperationalError):
+            with timer.chunk() as posted_chunk:
+                posted_chunk.append(item)
+                raise OperationalError("database is locked")
+        with timer.chunk() as posted_chunk:
+            posted_chunk.extend([item, item])
+
+        self.assertEqual((timer.chunks, timer.items), (2, 2))
+        metrics = ProcessingMetrics.expose()
+        self.assertIn('mass_payment_chunk_seconds_count 2', metrics)
+        self.assertIn('mass_payment_item_seconds_count{bank_code="SEDAD",status="success"} 2', metrics)
+
+    @override_settings(MASS_PAYMENT_SHARDING=False, MASS_PAYMENT_BATCH_POSTING=True)
+    def test_processing_records_timings_served_by_metrics(self):
+        initiator = create_account('80000000', 'MTRC000', '100.00')
+        create_account('80000001', 'MTRC001', '0.00')
+        mass_payment = MassPayment.objects.create(
+            initiator_account=initiator,
+            total_amount=Decimal('30.00'),
+            fee_amount=Decimal('0.00'),
+            pending_count=2
+        )
+        MassPaymentItem.objects.bulk_create(
+            MassPaymentItem(
+                mass_payment=mass_payment,
+                destination_phone_number=phone_number,
+                destination_bank_code='SEDAD',
+                amount=Decimal('15.00'),
+                fee_amount=Decimal('0.00')
+            )
+            for phone_number in ('80000001', '89999999')
+        )
+
+        PaymentProcessor.process_mass_payment(mass_payment.id)
+
+        mass_payment.refresh_from_db()
+        timings = mass_payment.timings
+        self.assertEqual((timings['runs'], timings['chunks'], timings['items']), (1, 1, 2))
+        self.assertGreater(timings['chunk_seconds'], 0)
+        self.assertTrue({'item_lock', 'resolution', 'balance_check', 'item_update'} <= set(timings['stages']))
+        self.assertEqual(timings['stages']['balance_check']['calls'], 1)
+
+        response = Client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        metrics = response.content.decode()
+        self.assertIn('mass_payment_chunk_seconds_count 1', metrics)
+        self.assertIn('mass_payment_item_seconds_count{bank_code="SEDAD",status="success"} 1', metrics)
+        self.assertIn('mass_payment_item_seconds_count{bank_code="SEDAD",status="failed"} 1', metrics)
+        self.assertIn('mass_payment_stage_seconds_count{stage="balance_check"} 1', metrics)
+
+
+class BankProviderRegistryTests(TestCase):
+    """
+    Process-local cache of the bank providers
+    """
+
+    def setUp(self):
+        BankProviderRegistry.invalidate()
+        self.addCleanup(BankProviderRegistry.invalidate)
+        self.provider = BankProvider.objects.create(bank_code='REGB', name='Registry bank', api_endpoint='http://localhost:1/')
+
+    def test_loads_the_table_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(BankProviderRegistry.get('REGB').name, 'Registry bank')
+            self.assertIsNone(BankProviderRegistry.get('NOPE'))
+            self.assertEqual(set(BankProviderRegistry.get_many(['REGB', 'NOPE', 'REGB'])), {'REGB'})
+
+    def test_save_and_delete_invalidate_it(self):
+        BankProviderRegistry.get('REGB')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.is_active = False
+            self.provider.save()
+        self.assertIsNotNone(BankProviderRegistry.get('REGB'))
+        self.assertIsNone(BankProviderRegistry.get('REGB', active_only=True))
+        self.assertEqual(BankProviderRegistry.get_many(['REGB'], active_only=True), {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.delete()
+        self.assertIsNone(BankProviderRegistry.get('REGB'))
+
+    def test_bulk_updates_need_an_explicit_invalidation(self):
+        BankProviderRegistry.get('REGB')
+        BankProvider.objects.filter(bank_code='REGB').update(name='Renamed bank')
+        self.assertEqual(BankProviderRegistry.get('REGB').name, 'Registry bank')
+
+        BankProviderRegistry.invalidate()
+        self.assertEqual(BankProviderRegistry.get('REGB').name, 'Renamed bank')
+
+
+class MassPaymentItemListingTests(TestCase):
+    """
+    Mass payment detail and its paginated, filtered and streamed items
+    """
+
+    def setUp(self):
+        BankProviderRegistry.invalidate()
+        self.addCleanup(BankProviderRegistry.invalidate)
+        BankProvider.objects.create(bank_code='EXTB', name='External bank', api_endpoint='http://localhost:1/')
+        self.client = APIClient()
+        self.mass_payment = MassPayment.objects.create(
+            initiator_account=create_account('43000000', 'LIST000', '0.00'),
+            total_amount=Decimal('150.00'),
+            fee_amount=Decimal('2.50'),
+            reference_code='LISTING',
+            success_count=2,
+            failure_count=1,
+            pending_count=2
+        )
+        self.items = MassPaymentItem.objects.bulk_create(
+            MassPaymentItem(
+                mass_payment=self.mass_payment,
+                destination_phone_number=f'4300000{number}',
+                destination_bank_code=bank_code,
+                amount=Decimal(amount),
+                fee_amount=Decimal('0.50'),
+                status=item_status
+            )
+            for number, (bank_code, amount, item_status) in enumerate([
+                ('SEDAD', '10.00', 'success'),
+                ('SEDAD', '20.00', 'failed'),
+                ('EXTB', '30.00', 'pending'),
+                ('EXTB', '40.00', 'success'),
+                ('SEDAD', '50.00', 'pending'),
+            ], start=1)
+        )
+        self.url = f'/api/mass-payments/{self.mass_payment.id}/'
+
+    def ids(self, *positions):
+        return [self.items[position].id for position in positions]
+
+    def test_detail_summarises_items_unless_asked_for_them(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('items', response.data)
+        self.assertEqual(response.data['initiator_account_number'], 'LIST000')
+        self.assertEqual(response.data['items_summary'], {
+            "count": 5,
+            "by_status": {
+                "success": {"count": 2, "amount": '50.00'},
+                "failed": {"count": 1, "amount": '20.00'},
+                "pending": {"count": 2, "amount": '80.00'},
+            },
+            "by_bank": {
+                "SEDAD": {"count": 3, "amount": '80.00'},
+                "EXTB": {"count": 2, "amount": '70.00'},
+            },
+        })
+
+        response = self.client.get(self.url, {'include_items': 'true'})
+        self.assertEqual(response.data['items_summary']['count'], 5)
+        self.assertEqual([item['id'] for item in response.data['items']], self.ids(0, 1, 2, 3, 4))
+        self.assertEqual(
+            [item['bank_name'] for item in response.data['items']][1:3], ['Unknown Bank', 'External bank']
+        )
+
+    def test_items_are_paginated_with_a_cursor(self):
+        pages = []
+        url = f'{self.url}items/?limit=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([item['id'] for item in response.data['results']])
+            url = response.data['next']
+
+        self.assertEqual(pages, [self.ids(0, 1), self.ids(2, 3), self.ids(4)])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_items_are_filtered_by_status_and_bank(self):
+        for params, positions in [
+            ({'status': 'success,failed'}, (0, 1, 3)),
+            ({'bank_code': 'EXTB'}, (2, 3)),
+            ({'status': 'pending', 'bank_code': 'SEDAD'}, (4,)),
+            ({'status': 'cancelled'}, ()),
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(f'{self.url}items/', params)
+                self.assertEqual([item['id'] for item in response.data['results']], self.ids(*positions))
+
+    def test_items_are_streamed_as_ndjson(self):
+        response = self.client.get(f'{self.url}items/', {'stream': 'true', 'status': 'pending,failed'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        items = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([item['id'] for item in items], self.ids(1, 2, 4))
+        self.assertEqual(items[1], {
+            "id": self.items[2].id,
+            "destination_phone_number": '43000003',
+            "destination_bank_code": 'EXTB',
+            "amount": '30.00',
+            "fee_amount": '0.50',
+            "status": 'pending',
+            "failure_reason": None,
+            "bank_name": 'External bank',
+        })
+
+    def test_unknown_payment_has_no_items(self):
+        self.assertEqual(self.client.get(f'/api/mass-payments/{self.mass_payment.id + 1}/items/').status_code, 404)
+
+
+class RecipientFileReaderTests(TestCase):
+    """
+    Decoding of the recipient file formats
+    """
+    ROWS = [
+        {"phone_number": '44000001', "amount": '10.50', "motive": 'Salary'},
+        {"phone_number": '44000002', "amount": '7', "motive": ''},
+    ]
+
+    def read(self, content, file_name):
+        return list(RecipientFileReader.rows(io.BytesIO(content), file_name))
+
+    def csv_content(self):
+        return ("\ufeffphone_number,amount,motive\n" + "".join(
+            f"{row['phone_number']},{row['amount']},{row['motive']}\n" for row in self.ROWS
+        )).encode()
+
+    def ndjson_content(self):
+        return ("\n".join(json.dumps(row) for row in self.ROWS) + "\n\n").encode()
+
+    def test_reads_csv_and_ndjson(self):
+        for content, file_name in [
+            (self.csv_content(), 'recipients.csv'),
+            (self.ndjson_content(), 'recipients.ndjson'),
+            (self.ndjson_content(), 'recipients.upload'),  # Recognised by its content
+            (gzip.compress(self.csv_content()), 'recipients.csv.gz'),
+            (gzip.compress(self.ndjson_content()), 'recipients'),
+        ]:
+            with self.subTest(file_name=file_name):
+                self.assertEqual(self.read(content, file_name), self.ROWS)
+
+    @skipUnless(recipient_file_services.zstandard, "zstandard is not installed")
+    def test_reads_zstd_compressed_files(self):
+        compressor = recipient_file_services.zstandard.ZstdCompressor()
+        self.assertEqual(self.read(compressor.compress(self.ndjson_content()), 'recipients.jsonl.zst'), self.ROWS)
+        self.assertEqual(self.read(compressor.compress(self.csv_content()), 'recipients.zst'), self.ROWS)
+
+    def test_zstd_needs_the_zstandard_package(self):
+        with mock.patch.object(recipient_file_services, 'zstandard', None):
+            with self.assertRaisesMessage(UnsupportedFileFormat, "zstd-compressed files require the zstandard package"):
+                self.read(b'\x28\xb5\x2f\xfd' + b'\x00' * 8, 'recipients.csv.zst')
+
+    @skipUnless(recipient_file_services.pyarrow, "pyarrow is not installed")
+    def test_reads_parquet_and_arrow_files(self):
+        pyarrow = recipient_file_services.pyarrow
+        table = pyarrow.Table.from_pylist(self.ROWS)
+
+        parquet = io.BytesIO()
+        pyarrow.parquet.write_table(table, parquet)
+        arrow_file = io.BytesIO()
+        with pyarrow.ipc.new_file(arrow_file, table.schema) as writer:
+            writer.write_table(table)
+        arrow_stream = io.BytesIO()
+        with pyarrow.ipc.new_stream(arrow_stream, table.schema) as writer:
+            writer.write_table(table)
+
+        for content, file_name in [
+            (parquet.getvalue(), 'recipients.parquet'),
+            (parquet.getvalue(), 'recipients.bin'),  # Recognised by its magic bytes
+            (arrow_file.getvalue(), 'recipients.arrow'),
+            (arrow_stream.getvalue(), 'recipients.arrows'),
+        ]:
+            with self.subTest(file_name=file_name):
+                self.assertEqual(self.read(content, file_name), self.ROWS)
+
+    def test_rejects_undecodable_files(self):
+        for content, file_name, message in [
+            (gzip.compress(b'PAR1' + b'\x00' * 8), 'recipients.parquet.gz', "Compressed parquet files are not supported"),
+            (b'{"phone_number": "44000001"}\nnot json\n', 'recipients.ndjson', "Invalid JSON on line 2"),
+        ]:
+            with self.subTest(file_name=file_name), self.assertRaisesMessage(UnsupportedFileFormat, message):
+                self.read(content, file_name)
+
+        with mock.patch.object(recipient_file_services, 'pyarrow', None):
+            with self.assertRaisesMessage(UnsupportedFileFormat, "arrow files require the pyarrow package"):
+                self.read(b'ARROW1\x00\x00', 'recipients.arrow')
+
+
+class BatchPricerTests(TestCase):
+    """
+    Fee schedule tiers, their compiled cache and batch pricing
+    """
+
+    def setUp(self):
+        FeeScheduleRegistry.invalidate()
+        self.addCleanup(FeeScheduleRegistry.invalidate)
+        self.initiator = create_account('45000000', 'PRIC000', '0.00')
+        # Catch-all schedule of three tiers
+        FeeSchedule.objects.bulk_create([
+            FeeSchedule(min_amount=Decimal('0.00'), flat_fee=Decimal('0.50')),
+            FeeSchedule(min_amount=Decimal('100.00'), flat_fee=Decimal('1.00'), percentage_fee=Decimal('1.50')),
+            FeeSchedule(min_amount=Decimal('1000.00'), percentage_fee=Decimal('0.25')),
+        ])
+
+    def fees(self, amounts, bank_code='SEDAD'):
+        pricing = BatchPricer.price([Decimal(amount) for amount in amounts], [bank_code] * len(amounts), self.initiator)
+        return [str(fee) for fee in pricing["fees"]]
+
+    def test_tier_boundaries(self):
+        self.assertEqual(
+            self.fees(['0.01', '99.99', '100.00', '999.99', '1000.00']),
+            ['0.50', '0.50', '2.50', '16.00', '2.50']
+        )
+
+    def test_percentage_fees_round_half_up(self):
+        # 1.5 % of 103.00 is 1.545, 0.25 % of 1002.00 is 2.505, 0.25 % of 1001.96 is 2.5049
+        self.assertEqual(self.fees(['103.00', '1002.00', '1001.96']), ['2.55', '2.51', '2.50'])
+
+    def test_most_specific_schedule_prices_each_bank(self):
+        FeeSchedule.objects.create(bank_code='EXTB', transfer_type='external', flat_fee=Decimal('2.00'))
+        FeeSchedule.objects.create(initiator_account=self.initiator, transfer_type='internal', flat_fee=Decimal('0.10'))
+
+        pricing = BatchPricer.price(
+            [Decimal('50.00'), Decimal('60.00'), Decimal('70.00'), Decimal('200.00')],
+            ['SEDAD', 'EXTB', 'OTHER', 'SEDAD'],
+            self.initiator
+        )
+
+        self.assertEqual(pricing["fees"], [Decimal('0.10'), Decimal('2.00'), Decimal('0.50'), Decimal('0.10')])
+        self.assertEqual((pricing["total_amount"], pricing["fee_amount"]), (Decimal('380.00'), Decimal('2.70')))
+        self.assertEqual(pricing["by_bank"]['SEDAD'], {
+            "count": 2, "amount": Decimal('250.00'), "fee_amount": Decimal('0.20')
+        })
+
+    def test_invalid_amounts_are_rejected(self):
+        for amounts, message in [
+            (['0.00'], "Amounts must be greater than zero"),
+            (['1.005'], "Invalid amount 1.005: at most 2 decimal places are allowed"),
+            (['10000000000000.00'], "Invalid amount 10000000000000.00: at most 15 digits are allowed"),
+        ]:
+            with self.subTest(amounts=amounts), self.assertRaisesMessage(PricingError, message):
+                self.fees(amounts)
+
+    def test_schedules_are_compiled_once_and_invalidated_by_their_signals(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.fees(['50.00']), ['0.50'])
+            self.assertEqual(self.fees(['150.00']), ['3.25'])
+
+        tier = FeeSchedule.objects.get(min_amount=Decimal('0.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            tier.flat_fee = Decimal('0.40')
+            tier.save()
+        self.assertEqual(self.fees(['50.00']), ['0.40'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FeeSchedule.objects.filter(min_amount__gt=0).delete()
+        self.assertEqual(self.fees(['150.00', '5000.00']), ['0.40', '0.40'])
+
+        # Bulk updates bypass the signals
+        FeeSchedule.objects.update(is_active=False)
+        self.assertEqual(self.fees(['50.00']), ['0.40'])
+        FeeScheduleRegistry.invalidate()
+        with self.settings(MASS_PAYMENT_DEFAULT_FEE='0.60'):
+            self.assertEqual(self.fees(['50.00']), ['0.60'])
+
+
+class AggregateListTests(TestCase):
+    """
+    Recipient counts and totals of the template and group lists, from annotations
+    """
+
+    def setUp(self):
+        owner = create_account('46000000', 'AGGR000', '0.00').user
+        payroll = PaymentTemplate.objects.create(name='Payroll', owner=owner)
+        PaymentTemplate.objects.create(name='Empty', owner=owner)
+        TemplateRecipient.objects.bulk_create(
+            TemplateRecipient(template=payroll, phone_number=f'4600000{number}', bank_code='SEDAD', default_amount=amount)
+            for number, amount in [(1, Decimal('10.00')), (2, Decimal('20.50')), (3, None)]
+        )
+        suppliers = RecipientGroup.objects.create(name='Suppliers')
+        RecipientGroup.objects.create(name='Empty')
+        GroupRecipient.objects.bulk_create(
+            GroupRecipient(group=suppliers, phone_number=f'4600000{number}', bank_code='SEDAD',
+                           full_name='Test', default_amount=Decimal(amount), status=recipient_status)
+            for number, amount, recipient_status in [(1, '5.00', 'validated'), (2, '7.25', 'validated'), (3, '1.00', 'failed')]
+        )
+
+    @staticmethod
+    def rows(results, *fields):
+        return sorted(tuple(row[field] for field in ('name',) + fields) for row in results)
+
+    def test_template_counts_and_sums(self):
+        templates = PaymentTemplateListSerializer.annotate_queryset(PaymentTemplate.objects.all(), include_totals=True)
+        self.assertEqual(
+            sorted(templates.values_list('name', 'recipient_count', 'total_default_amount')),
+            [('Empty', 0, None), ('Payroll', 3, Decimal('30.50'))]
+        )
+
+        # One query for the page, one for the count
+        with self.assertNumQueries(2):
+            response = Client().get('/api/payment-templates/', {'include_totals': 'true'})
+        self.assertEqual(
+            self.rows(response.json()['results'], 'recipient_count', 'total_default_amount'),
+            [('Empty', 0, None), ('Payroll', 3, '30.50')]
+        )
+        response = Client().get('/api/accounts/AGGR000/payment_templates/')
+        self.assertEqual(self.rows(response.json()['results'], 'recipient_count'), [('Empty', 0), ('Payroll', 3)])
+        self.assertNotIn('total_default_amount', response.json()['results'][0])
+
+    def test_group_counts_and_sums(self):
+        with self.assertNumQueries(2):
+            response = Client().get('/api/recipient-groups/', {'include_totals': 'true'})
+        self.assertEqual(
+            self.rows(response.json()['results'], 'recipient_count', 'total_default_amount', 'recipients_by_status'),
+            [
+                ('Empty', 0, None, {"pending": 0, "validated": 0, "failed": 0}),
+                ('Suppliers', 3, '13.25', {"pending": 0, "validated": 2, "failed": 1}),
+            ]
+        )
+
+        response = Client().get('/api/recipient-groups/', {'include_recipients': 'true'})
+        rows = {row['name']: row for row in response.json()['results']}
+        self.assertNotIn('total_default_amount', rows['Suppliers'])
+        self.assertEqual(
+            [recipient['phone_number'] for recipient in rows['Suppliers']['recipients']],
+            ['46000001', '46000002', '46000003']
+        )
+
+
+class DemoDataGeneratorTests(TestCase):
+    """
+    Synthetic banks, users, groups, templates and upload files
+    """
+
+    def test_same_seed_generates_the_same_data_once(self):
+        generator = DemoDataGenerator(seed=1, batch_size=7)
+        banks = generator.create_banks(5)
+        users = generator.create_users(20, banks, accounts_per_user=3)
+
+        self.assertEqual(list(banks), ['SEDAD', 'BIMBANK', 'BANKILY', 'BANK004', 'BANK005'])
+        self.assertAlmostEqual(sum(banks.values()), 1)
+        self.assertEqual(len({phone_number for phone_number, _ in users}), 20)
+        self.assertTrue(all(len(phone_number) == 8 and phone_number[0] in '234' for phone_number, _ in users))
+        self.assertTrue(all(1 <= len(user_banks) == len(set(user_banks)) <= 3 for _, user_banks in users))
+        accounts = Account.objects.count()
+        self.assertEqual(accounts, sum(len(user_banks) for _, user_banks in users))
+
+        again = DemoDataGenerator(seed=1, batch_size=7)
+        self.assertEqual(again.create_users(20, again.create_banks(5), accounts_per_user=3), users)
+        self.assertEqual((User.objects.count(), Account.objects.count(), BankProvider.objects.count()), (20, accounts, 5))
+
+    def test_command_creates_groups_and_templates(self):
+        output = io.StringIO()
+        call_command('create_demo_data', users=12, recipients=5, groups=2, templates=1, banks=4, stdout=output)
+
+        self.assertEqual(User.objects.count(), 12 + len(DemoDataGenerator.USERS))
+        self.assertEqual(BankProvider.objects.count(), 4)
+        self.assertEqual(
+            sorted(RecipientGroup.objects.values_list('name', flat=True)),
+            ['Demo group 1 (5 recipients)', 'Demo group 2 (5 recipients)']
+        )
+        self.assertEqual([group.recipients.count() for group in RecipientGroup.objects.all()], [5, 5])
+        self.assertEqual(PaymentTemplate.objects.get().recipients.count(), 5)
+        self.assertIn("Successfully created demo data", output.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'Counts must not be negative'):
+            call_command('create_demo_data', recipients=-1, stdout=io.StringIO())
+
+    def test_recipient_files_read_back(self):
+        directory = tempfile.mkdtemp(prefix='demo-files-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        generator = DemoDataGenerator(seed=2)
+        recipients = generator.sample_recipients(generator.create_users(6, generator.create_banks()), 4)
+
+        paths = DemoDataGenerator.write_recipient_files(recipients, directory, 'recipients', ('csv', 'ndjson'))
+
+        self.assertEqual([path.name for path in paths], ['recipients.csv', 'recipients.ndjson'])
+        for path in paths:
+            with self.subTest(path=path.name), open(path, 'rb') as source:
+                self.assertEqual(
+                    [(row['phone_number'], row['bank_code'], Decimal(row['amount']), row['motive'])
+                     for row in RecipientFileReader.rows(source, path.name)],
+                    recipients
+                )
+
+
+class LoadTestTests(TestCase):
+    """
+    loadtest command: replayed traffic, latency percentiles and query counts
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='loadtest-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.replay = os.path.join(directory, 'requests.jsonl')
+        self.output = os.path.join(directory, 'report.json')
+        with open(self.replay, 'w', encoding='utf-8') as lines:
+            lines.write(json.dumps({"method": 'GET', "path": '/api/accounts/'}) + "\n")
+            lines.write("not a request\n")
+            lines.write(json.dumps({"name": 'slow', "method": 'GET', "path": '/api/mass-payments/1/'}) + "\n")
+
+    @staticmethod
+    def stub_server(request):
+        """
+        httpx transport answering like a server with QUERY_COUNT_HEADER on
+        """
+        if request.url.path == '/api/mass-payments/1/':
+            time.sleep(0.05)
+            return httpx.Response(404, json={"detail": "Not found."}, headers={'X-DB-Query-Count': '1'})
+        return httpx.Response(200, json={"results": []}, headers={'X-DB-Query-Count': '2'})
+
+    def test_replayed_requests_are_reported_per_endpoint(self):
+        client_class = httpx.Client
+        transport = httpx.MockTransport(self.stub_server)
+        stdout = io.StringIO()
+        with mock.patch('httpx.Client', side_effect=lambda **options: client_class(transport=transport, **options)):
+            call_command(
+                'loadtest', url='http://testserver', replay=self.replay, requests=6, rps=0, concurrency=2,
+                output=self.output, stdout=stdout
+            )
+
+        with open(self.output, encoding='utf-8') as report:
+            endpoints = json.load(report)["endpoints"]
+        self.assertEqual(list(endpoints), ['GET account-list', 'slow', 'total'])
+        self.assertEqual(
+            [(report["requests"], report["errors"], report["statuses"], report["queries"], report["queries_per_request"])
+             for report in endpoints.values()],
+            [(3, 0, {"200": 3}, 6, 2.0), (3, 3, {"404": 3}, 3, 1.0), (6, 3, {"200": 3, "404": 3}, 9, 1.5)]
+        )
+        slow = endpoints['slow']
+        self.assertGreaterEqual(slow["p50_ms"], 50)
+        self.assertTrue(slow["p50_ms"] <= slow["p95_ms"] <= slow["p99_ms"] <= endpoints['total']["p99_ms"])
+        self.assertLess(endpoints['GET account-list']["p99_ms"], slow["p50_ms"])
+        self.assertIn("Skipped 1 lines that are not requests", stdout.getvalue())
+
+    def test_summary_percentiles_use_the_nearest_rank(self):
+        results = [
+            {"name": 'detail', "status": 200, "latency_ms": float(latency), "queries": 3, "error": None}
+            for latency in range(100, 0, -1)
+        ] + [{"name": 'detail', "status": None, "latency_ms": 500.0, "queries": None, "error": "ReadTimeout: timed out"}]
+
+        report = LoadTestRunner.summarize(results, elapsed=10)['detail']
+
+        self.assertEqual((report["p50_ms"], report["p95_ms"], report["p99_ms"]), (51.0, 96.0, 100.0))
+        self.assertEqual((report["requests"], report["errors"], report["error_rate"]), (101, 1, 0.0099))
+        self.assertEqual(report["statuses"], {"200": 100, "ReadTimeout: timed out": 1})
+        self.assertEqual((report["queries"], report["queries_per_request"], report["throughput_rps"]), (300, 3.0, 10.1))
+
+    # Tests run with DEBUG off, where an empty ALLOWED_HOSTS no longer allows localhost
+    @override_settings(QUERY_COUNT_HEADER=True, ALLOWED_HOSTS=['localhost', 'testserver'])
+    def test_test_client_target_counts_like_the_header(self):
+        create_account('47000001', 'LOAD001', '0.00')
+        status, body, queries = TestClientLoadTarget().request('GET', '/api/accounts/')
+
+        self.assertEqual((status, body['results'][0]['account_number']), (200, 'LOAD001'))
+        self.assertEqual(queries, int(Client().get('/api/accounts/')['X-DB-Query-Count']))
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views.views import UserViewSet, AccountViewSet, BankProviderViewSet
 from .views.mass_payments_views import MassPaymentViewSet
+from .views.mass_payment_events_views import mass_payment_events
 from .views.payment_template_views import PaymentTemplateViewSet
 from .views.group_recipiants_views import RecipientGroupViewSet
 
@@ -15,5 +16,6 @@ router.register(r'recipient-groups', RecipientGroupViewSet)
 
 
 urlpatterns = [
+    path('mass-payments/<int:pk>/events/', mass_payment_events, name='masspayment-events'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -0,0 +1,5 @@
+def query_flag(request, name):
+    """
+    Whether a boolean query parameter is set (?name=true)
+    """
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
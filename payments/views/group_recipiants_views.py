@@ -1,17 +1,23 @@
 from payments.services.recipient_group_services import RecipientGroupProcessor
-from ..models import Account, GroupRecipient, MassPayment, MassPaymentItem, RecipientGroup, User
+from payments.services.recipient_file_services import RecipientFileReader, UnsupportedFileFormat
+from payments.services.recipient_import_services import RecipientImporter, RecipientImportJob
+from payments.services.recipient_resolver_services import RecipientResolver
+from payments.services.mass_payment_creation_services import DuplicateReferenceError, MassPaymentCreator
+from payments.services.funds_hold_services import InsufficientFundsError
+from payments.services.idempotency_services import idempotent
+from payments.services.pricing_services import PricingError
+from ..models import Account, GroupRecipient, RecipientGroup, RecipientImport, User
+from ..utils import query_flag
 from ..serializers.group_recipiants_serializers import (
-    AddRecipientToGroupSerializer, CreateMassPaymentFromGroupSerializer, RecipientGroupCreateUpdateSerializer, RecipientGroupDetailSerializer, RecipientGroupListSerializer, RecipientValidationSerializer, UploadRecipientsCSVSerializer
+    AddRecipientToGroupSerializer, CreateMassPaymentFromGroupSerializer, RecipientGroupCreateUpdateSerializer, RecipientGroupDetailSerializer, RecipientGroupListSerializer, RecipientImportSerializer, RecipientValidationSerializer, UploadRecipientsCSVSerializer
 )
-import uuid
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db import transaction
-from django.utils import timezone
-from decimal import Decimal
-from io import TextIOWrapper
-import csv
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+import os
 
 
 
@@ -21,6 +27,8 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'upload_recipients_csv':
             return UploadRecipientsCSVSerializer
+        if self.action in ['imports', 'import_status']:
+            return RecipientImportSerializer
         if self.action in ['create', 'update', 'partial_update']:
             return RecipientGroupCreateUpdateSerializer
         elif self.action == 'retrieve':
@@ -43,7 +51,22 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
         # return RecipientGroup.objects.none()
     
         # For now, return all groups
-        return RecipientGroup.objects.all()
+        queryset = RecipientGroup.objects.all()
+        if self.action == 'list':
+            # Counts as annotations, recipients prefetched only if asked for
+            queryset = RecipientGroupListSerializer.annotate_queryset(
+                queryset,
+                include_totals=query_flag(self.request, 'include_totals'),
+                include_recipients=query_flag(self.request, 'include_recipients')
+            )
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['include_totals'] = query_flag(self.request, 'include_totals')
+            context['include_recipients'] = query_flag(self.request, 'include_recipients')
+        return context
     
     def perform_create(self, serializer):
         # Set the owner to the current user
@@ -179,6 +202,7 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
 
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def create_mass_payment(self, request, pk=None):
         """
         Create a mass payment from a recipient group.
@@ -218,42 +242,35 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
                 "error": "No recipients found in the group"
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # Skip recipients without an amount
+        candidates = [recipient for recipient in group_recipients if recipient.default_amount is not None]
+        
+        # Validate all recipients at once
+        accounts, failures = RecipientResolver.resolve(
+            (recipient.phone_number, recipient.bank_code) for recipient in candidates
+        )
+        
         # Prepare recipients for mass payment
         payment_recipients = []
-        for recipient in group_recipients:
-            # Skip recipients without an amount
-            if recipient.default_amount is None:
+        for index, recipient in enumerate(candidates):
+            # Skip invalid recipients
+            if index in failures:
                 continue
             
-            # Validate recipient data
-            try:
-                # Find the user by phone_number
-                user = User.objects.get(phone_number=recipient.phone_number)
-                
-                # Find active account for user with the specified bank_code
-                destination_account = Account.objects.get(
-                    user=user,
-                    bank_code=recipient.bank_code,
-                    is_active=True,
-                    is_blocked=False
-                )
-                
-                # Skip if destination account is the same as initiator account
-                if destination_account.account_number == initiator_account.account_number:
-                    continue
-                
-                # Add to payment recipients
-                payment_recipients.append({
-                    'phone_number': recipient.phone_number,
-                    'bank_code': recipient.bank_code,
-                    'amount': recipient.default_amount,
-                    'destination_account': destination_account,
-                    'motive': recipient.motive
-                })
-                
-            except (User.DoesNotExist, Account.DoesNotExist):
-                # Skip invalid recipients
+            destination_account = accounts[(recipient.phone_number, recipient.bank_code)]
+            
+            # Skip if destination account is the same as initiator account
+            if destination_account.account_number == initiator_account.account_number:
                 continue
+            
+            # Add to payment recipients
+            payment_recipients.append({
+                'phone_number': recipient.phone_number,
+                'bank_code': recipient.bank_code,
+                'amount': recipient.default_amount,
+                'destination_account': destination_account,
+                'motive': recipient.motive
+            })
         
         # If no valid recipients, return error
         if not payment_recipients:
@@ -261,70 +278,22 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
                 "error": "No valid recipients found in the group"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Now create the mass payment
-        total_amount = sum(recipient['amount'] for recipient in payment_recipients)
-        fee_per_transaction = Decimal('0.50')  # Example fee
-        fee_amount = fee_per_transaction * len(payment_recipients)
-        
-        # Check if initiator has sufficient funds
-        if initiator_account.balance < (total_amount + fee_amount):
-            return Response({
-                "error": "Insufficient funds for the total amount and fees"
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Create the mass payment
-        with transaction.atomic():
-            # Generate a reference code if none provided
-            if not reference:
-                reference = f"MP{uuid.uuid4().hex[:8].upper()}"
-            
-            mass_payment = MassPayment.objects.create(
+        # Now create the mass payment, the same way as the other creation endpoints
+        try:
+            response_data = MassPaymentCreator.price_and_create(
                 initiator_account=initiator_account,
-                total_amount=total_amount,
-                fee_amount=fee_amount,
-                status='processing',
+                recipients=payment_recipients,
                 description=description,
-                reference_code=reference,
-                pending_count=len(payment_recipients)
+                reference=reference,
+                summary_only=query_flag(request, 'summary_only')
             )
-            
-            # Create payment items
-            payment_items = []
-            for recipient in payment_recipients:
-                payment_item = MassPaymentItem.objects.create(
-                    mass_payment=mass_payment,
-                    destination_phone_number=recipient['phone_number'],
-                    destination_account=recipient['destination_account'],
-                    destination_bank_code=recipient['bank_code'],
-                    amount=recipient['amount'],
-                    fee_amount=fee_per_transaction
-                )
-                payment_items.append({
-                    "id": payment_item.id,
-                    "phone_number": payment_item.destination_phone_number,
-                    "bank_code": payment_item.destination_bank_code,
-                    "amount": payment_item.amount,
-                    "fee_amount": payment_item.fee_amount,
-                    "status": payment_item.status
-                })
-            
-            response_data = {
-                "mass_payment_id": mass_payment.id,
-                "reference_code": mass_payment.reference_code,
-                "status": mass_payment.status,
-                "total_amount": str(total_amount),
-                "fee_amount": str(fee_amount),
-                "created_at": mass_payment.created_at,
-                "recipients_count": len(payment_recipients),
-                "external_recipients_count": sum(
-                    1 for r in payment_recipients 
-                    if r['bank_code'] != initiator_account.bank_code
-                ),
-                "estimated_completion_time": timezone.now() + timezone.timedelta(minutes=30),
-                "recipients": payment_items
-            }
-            
-            return Response(response_data, status=status.HTTP_201_CREATED)    
+        except (DuplicateReferenceError, InsufficientFundsError, PricingError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # This endpoint has always sent the amounts as strings
+        response_data["total_amount"] = str(response_data["total_amount"])
+        response_data["fee_amount"] = str(response_data["fee_amount"])
+        return Response(response_data, status=status.HTTP_201_CREATED)
 
     
     @action(detail=True, methods=['post'])
@@ -335,99 +304,30 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
         if not csv_file:
             return Response({"error": "No CSV file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            decoded_file = TextIOWrapper(csv_file.file, encoding='utf-8')
-            reader = csv.DictReader(decoded_file)
-            
-            total_records = 0
-            successful_records = 0
-            failed_records = []
+        # Large files: import in the background, progress at /recipient-groups/{id}/imports/{job_id}/
+        if query_flag(request, 'async'):
+            try:
+                recipient_import = RecipientImportJob.spool(group, csv_file)
+            except UnsupportedFileFormat as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            serializer = RecipientImportSerializer(recipient_import, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
-            with transaction.atomic():
-                for row in reader:
-                    total_records += 1
-                    
-                    try:
-                        # Extract data from CSV
-                        phone_number = row.get('phone_number')
-                        amount = row.get('amount')
-                        motive = row.get('motive', '')
-                        
-                        # Validate required fields
-                        if not phone_number or not amount:
-                            failed_records.append({
-                                "row": row,
-                                "error": "Missing required fields (phone_number or amount)"
-                            })
-                            continue
-                        
-                        # Find the user by phone number
-                        user = User.objects.get(phone_number=phone_number)
-                        
-                        # Get the user's account
-                        accounts = Account.objects.filter(
-                            user=user,
-                            is_active=True,
-                            is_blocked=False
-                        )
-                        
-                        if not accounts.exists():
-                            failed_records.append({
-                                "phone_number": phone_number,
-                                "error": "No active account found for this user"
-                            })
-                            continue
-                        
-                        # Use the first active account found
-                        account = accounts.first()
-                        bank_code = account.bank_code
-                        
-                        # Check if recipient already exists in the group
-                        if GroupRecipient.objects.filter(
-                            group=group,
-                            phone_number=phone_number,
-                            bank_code=bank_code
-                        ).exists():
-                            failed_records.append({
-                                "phone_number": phone_number,
-                                "error": "Recipient already exists in this group"
-                            })
-                            continue
+        try:
+            # CSV, NDJSON (optionally gzip/zstd-compressed), Parquet or Arrow
+            reader = RecipientFileReader.rows(csv_file.file, csv_file.name)
 
-                        # Add recipient to group
-                        GroupRecipient.objects.create(
-                            group=group,
-                            phone_number=phone_number,
-                            bank_code=bank_code,
-                            full_name=f"{user.first_name} {user.last_name}",
-                            default_amount=Decimal(amount),
-                            motive=motive,
-                            status='validated'
-                        )
-                        successful_records += 1
-                        
-                    except User.DoesNotExist:
-                        failed_records.append({
-                            "phone_number": phone_number,
-                            "error": "User not found with this phone number"
-                        })
-                    except Exception as e:
-                        failed_records.append({
-                            "phone_number": phone_number if 'phone_number' in locals() else "Unknown",
-                            "error": str(e)
-                        })
+            # Rows are parsed, resolved and inserted chunk by chunk as the file is read
+            summary = RecipientImporter.import_rows(group, reader)
+            successful_records = summary["successful_count"]
+            total_records = summary["total_count"]
+            failed_records = summary["failed_records"]
 
             # Calculate success percentage
             success_percentage = (successful_records / total_records * 100) if total_records > 0 else 0
             
             # Update group status
-            if successful_records == total_records:
-                group.status = 'completed'
-            elif successful_records > 0:
-                group.status = 'partially_completed'
-            else:
-                group.status = 'failed'
-            group.save()
+            RecipientImporter.update_group_status(group, summary)
             
             # Prepare response message
             message = f"{successful_records} successful out of {total_records}! ({success_percentage:.1f}%)"
@@ -441,4 +341,44 @@ class RecipientGroupViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'])
+    def imports(self, request, pk=None):
+        group = self.get_object()
+        imports = RecipientImport.objects.filter(group=group).order_by('-created_at')
+
+        page = self.paginate_queryset(imports)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(imports, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path=r'imports/(?P<job_id>[0-9]+)')
+    def import_status(self, request, pk=None, job_id=None):
+        """
+        Progress of a background import: rows processed and failed, throughput and ETA
+        """
+        group = self.get_object()
+        recipient_import = get_object_or_404(RecipientImport, group=group, id=job_id)
+        serializer = self.get_serializer(recipient_import)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path=r'imports/(?P<job_id>[0-9]+)/failures')
+    def import_failures(self, request, pk=None, job_id=None):
+        """
+        Download the rows rejected by a background import as CSV
+        """
+        group = self.get_object()
+        recipient_import = get_object_or_404(RecipientImport, group=group, id=job_id)
+        if not recipient_import.failure_report_path or not os.path.exists(recipient_import.failure_report_path):
+            return Response({"error": "No failure report for this import"}, status=status.HTTP_404_NOT_FOUND)
+
+        return FileResponse(
+            open(recipient_import.failure_report_path, 'rb'),
+            as_attachment=True,
+            filename=f"import-{recipient_import.id}-failures.csv",
+            content_type='text/csv'
+        )
@@ -0,0 +1,25 @@
+from ..models import MassPayment
+from ..services.progress_stream_services import MassPaymentProgressStream
+from django.http import Http404, StreamingHttpResponse
+
+
+async def mass_payment_events(request, pk):
+    """
+    Server-Sent Events stream of a mass payment's progress.
+    Serve it with an ASGI server (mass_payment_service/asgi.py), where each
+    open stream costs a coroutine rather than a worker thread.
+    """
+    if not await MassPayment.objects.filter(id=pk).aexists():
+        raise Http404("Mass payment not found")
+
+    # Resume after the failures an EventSource client has already received
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_failure_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    response = StreamingHttpResponse(
+        MassPaymentProgressStream.events(pk, last_failure_id=last_failure_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable nginx response buffering
+    return response
@@ -1,20 +1,29 @@
-from urllib import response
-from ..models import Account, MassPayment, MassPaymentItem, PaymentTemplate, User
+from ..models import Account, MassPayment, MassPaymentItem, PaymentTemplate
+from ..pagination import MassPaymentItemCursorPagination
+from ..utils import query_flag
+from ..services.recipient_resolver_services import RecipientResolver
+from ..services.mass_payment_creation_services import (
+    DuplicateReferenceError, InvalidRecipientsError, MassPaymentCreator
+)
+from ..services.recipient_file_services import RecipientFileReader, UnsupportedFileFormat
+from ..services.funds_hold_services import InsufficientFundsError
+from ..services.idempotency_services import idempotent
+from ..services.pricing_services import PricingError
 from ..serializers.mass_payments_serializers import (
-    MassPaymentListSerializer, MassPaymentDetailSerializer, MassPaymentCreateSerializer
+    MassPaymentListSerializer, MassPaymentDetailSerializer, MassPaymentCreateSerializer,
+    MassPaymentItemDetailSerializer, MassPaymentSummarySerializer, MassPaymentUploadSerializer
 )
 from ..serializers.payment_template_serializers import (
     CreateMassPaymentFromTemplateSerializer
 )
-import uuid
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db import transaction
-from django.utils import timezone
 from decimal import Decimal
-
+import json
 
 
 class MassPaymentViewSet(mixins.ListModelMixin, 
@@ -27,11 +36,18 @@ class MassPaymentViewSet(mixins.ListModelMixin,
         if self.action == 'create':
             return MassPaymentCreateSerializer
         elif self.action == 'retrieve':
-            return MassPaymentDetailSerializer
+            if query_flag(self.request, 'include_items'):
+                return MassPaymentDetailSerializer
+            return MassPaymentSummarySerializer
+        elif self.action == 'items':
+            return MassPaymentItemDetailSerializer
         elif self.action == 'create_from_template':
             return CreateMassPaymentFromTemplateSerializer
+        elif self.action == 'upload':
+            return MassPaymentUploadSerializer
         return MassPaymentListSerializer
     
+    @idempotent
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -49,82 +65,117 @@ class MassPaymentViewSet(mixins.ListModelMixin,
                 is_blocked=False
             )
         except Account.DoesNotExist:
-            return response(
+            return Response(
                 {"error": "Initiator account not found or inactive"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Calculate total amount
-        total_amount = sum(Decimal(item['amount']) for item in recipients)
-        
-        # Calculate fees - simplified for now, can be more complex
-        fee_per_transaction = Decimal('0.50')  # Example fee
-        fee_amount = fee_per_transaction * len(recipients)
+        return self._create_mass_payment(
+            initiator_account=initiator_account,
+            recipients=recipients,
+            description=description,
+            reference=reference
+        )
         
-        # Check if initiator has sufficient funds
-        if initiator_account.balance < (total_amount + fee_amount):
+    def retrieve(self, request, pk=None):
+        """
+        Mass payment with item aggregates; ?include_items=true also nests every item
+        """
+        mass_payment = get_object_or_404(MassPayment.objects.select_related('initiator_account'), pk=pk)
+        serializer = self.get_serializer(mass_payment)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=MassPaymentItemCursorPagination)
+    def items(self, request, pk=None):
+        """
+        Items of a mass payment in id order, filtered by ?status= and ?bank_code=
+        (comma-separated values accepted). Paginated with a cursor (?limit=),
+        or streamed as NDJSON with ?stream=true.
+        """
+        mass_payment = get_object_or_404(MassPayment, pk=pk)
+        items = MassPaymentItem.objects.filter(mass_payment=mass_payment)
+
+        status_filter = request.query_params.get('status')
+        if status_filter:
+            items = items.filter(status__in=status_filter.split(','))
+        bank_code = request.query_params.get('bank_code')
+        if bank_code:
+            items = items.filter(destination_bank_code__in=bank_code.split(','))
+
+        if query_flag(request, 'stream'):
+            return self._stream_items(items)
+
+        page = self.paginate_queryset(items)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def _stream_items(items):
+        """
+        Stream items as one JSON object per line, reading them from the
+        database in chunks instead of loading the whole payment
+        """
+        fields = [
+            field for field in MassPaymentItemDetailSerializer.Meta.fields
+            if field != 'bank_name'
+        ]
+
+        def lines():
+            for item in items.order_by('id').values(*fields).iterator(chunk_size=2000):
+                item['bank_name'] = MassPaymentItemDetailSerializer.bank_name_for(item['destination_bank_code'])
+                yield json.dumps(item, cls=DjangoJSONEncoder) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def upload(self, request):
+        """
+        Create a mass payment straight from an uploaded recipients file,
+        streamed into the payment items chunk by chunk
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        uploaded_file = serializer.validated_data['file']
+        initiator_account_number = serializer.validated_data['initiator_account_number']
+        description = serializer.validated_data.get('description', '')
+        reference = serializer.validated_data.get('reference', '')
+
+        # Verify initiator account exists and is active
+        try:
+            initiator_account = Account.objects.get(
+                account_number=initiator_account_number,
+                is_active=True,
+                is_blocked=False
+            )
+        except Account.DoesNotExist:
             return Response(
-                {"error": "Insufficient funds for the total amount and fees"},
+                {"error": "Initiator account not found or inactive"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Create the mass payment
-        with transaction.atomic():
-            # Generate a reference code if none provided
-            if not reference:
-                reference = f"MP{uuid.uuid4().hex[:8].upper()}"
-            
-            mass_payment = MassPayment.objects.create(
+
+        try:
+            mass_payment, summary = MassPaymentCreator.create_from_rows(
                 initiator_account=initiator_account,
-                total_amount=total_amount,
-                fee_amount=fee_amount,
-                status='processing',
+                rows=RecipientFileReader.rows(uploaded_file.file, uploaded_file.name),
                 description=description,
-                reference_code=reference,
-                pending_count=len(recipients)
+                reference=reference
             )
-            
-            # Create payment items and collect them for the response
-            payment_items = []
-            for recipient in recipients:
-                payment_item = MassPaymentItem.objects.create(
-                    mass_payment=mass_payment,
-                    destination_phone_number=recipient['phone_number'],
-                    destination_account=recipient['destination_account'],  
-                    destination_bank_code=recipient['bank_code'],
-                    amount=recipient['amount'],
-                    fee_amount=fee_per_transaction
-                )
-                payment_items.append({
-                    "id": payment_item.id,
-                    "phone_number": payment_item.destination_phone_number,
-                    "bank_code": payment_item.destination_bank_code,
-                    "amount": payment_item.amount,
-                    "fee_amount": payment_item.fee_amount,
-                    "status": payment_item.status if hasattr(payment_item, 'status') else 'pending'
-                })
-            
-            response_data = {
-                "mass_payment_id": mass_payment.id,
-                "reference_code": mass_payment.reference_code,
-                "status": mass_payment.status,
-                "total_amount": mass_payment.total_amount,
-                "fee_amount": mass_payment.fee_amount,
-                "created_at": mass_payment.created_at,
-                "recipients_count": len(recipients),
-                "external_recipients_count": sum(1 for r in recipients if r['bank_code'] != initiator_account.bank_code),
-                "estimated_completion_time": timezone.now() + timezone.timedelta(minutes=30),  
-                "recipients": payment_items  
-            }
-            
-            return Response(response_data, status=status.HTTP_201_CREATED)
-        
-    def retrieve(self, request, pk=None):
-        mass_payment = get_object_or_404(MassPayment, pk=pk)
-        serializer = self.get_serializer(mass_payment)
-        return Response(serializer.data)
-    
+        except InvalidRecipientsError as e:
+            return Response(
+                {"error": str(e), "error_count": e.error_count, "recipients": e.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except (DuplicateReferenceError, InsufficientFundsError, PricingError,
+                UnsupportedFileFormat, UnicodeDecodeError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_data = MassPaymentCreator.build_summary(mass_payment, **summary)
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['post'])
+    @idempotent
     def create_from_template(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -175,7 +226,7 @@ class MassPaymentViewSet(mixins.ListModelMixin,
                 overrides_dict[recipient_id] = override
         
         # Prepare recipients for mass payment
-        payment_recipients = []
+        candidates = []
         for recipient in template_recipients:
             amount = recipient.default_amount
             
@@ -190,32 +241,26 @@ class MassPaymentViewSet(mixins.ListModelMixin,
                 continue
             
             # Build recipient data
-            recipient_data = {
+            candidates.append({
                 'phone_number': recipient.phone_number,
                 'bank_code': recipient.bank_code,
                 'amount': amount
-            }
-            
-            # Validate recipient data
-            try:
-                # Find the user by phone_number
-                user = User.objects.get(phone_number=recipient.phone_number)
-                
-                # Find active account for user with the specified bank_code
-                destination_account = Account.objects.get(
-                    user=user,
-                    bank_code=recipient.bank_code,
-                    is_active=True,
-                    is_blocked=False
-                )
-                
-                # Add destination_account to recipient data
-                recipient_data['destination_account'] = destination_account
-                payment_recipients.append(recipient_data)
-                
-            except (User.DoesNotExist, Account.DoesNotExist):
-                # Skip invalid recipients or handle as needed
+            })
+        
+        # Validate all recipients at once
+        accounts, failures = RecipientResolver.resolve(
+            (recipient['phone_number'], recipient['bank_code']) for recipient in candidates
+        )
+        
+        payment_recipients = []
+        for index, recipient_data in enumerate(candidates):
+            # Skip invalid recipients
+            if index in failures:
                 continue
+            
+            # Add destination_account to recipient data
+            recipient_data['destination_account'] = accounts[(recipient_data['phone_number'], recipient_data['bank_code'])]
+            payment_recipients.append(recipient_data)
         
         # If no valid recipients, return error
         if not payment_recipients:
@@ -233,67 +278,15 @@ class MassPaymentViewSet(mixins.ListModelMixin,
         )
     
     def _create_mass_payment(self, initiator_account, recipients, description='', reference=''):
-        # Calculate total amount
-        total_amount = sum(Decimal(str(item['amount'])) for item in recipients)
-        
-        # Calculate fees
-        fee_per_transaction = Decimal('0.50')  # Example fee
-        fee_amount = fee_per_transaction * len(recipients)
-        
-        # Check if initiator has sufficient funds
-        if initiator_account.balance < (total_amount + fee_amount):
-            return Response(
-                {"error": "Insufficient funds for the total amount and fees"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Create the mass payment
-        with transaction.atomic():
-            # Generate a reference code if none provided
-            if not reference:
-                reference = f"MP{uuid.uuid4().hex[:8].upper()}"
-            
-            mass_payment = MassPayment.objects.create(
+        # Price the recipients, then create the mass payment and its items, reserving the funds
+        try:
+            response_data = MassPaymentCreator.price_and_create(
                 initiator_account=initiator_account,
-                total_amount=total_amount,
-                fee_amount=fee_amount,
-                status='processing',
+                recipients=recipients,
                 description=description,
-                reference_code=reference,
-                pending_count=len(recipients)
+                reference=reference,
+                summary_only=query_flag(self.request, 'summary_only')
             )
-            
-            # Create payment items and collect them for the response
-            payment_items = []
-            for recipient in recipients:
-                payment_item = MassPaymentItem.objects.create(
-                    mass_payment=mass_payment,
-                    destination_phone_number=recipient['phone_number'],
-                    destination_account=recipient['destination_account'],  
-                    destination_bank_code=recipient['bank_code'],
-                    amount=recipient['amount'],
-                    fee_amount=fee_per_transaction
-                )
-                payment_items.append({
-                    "id": payment_item.id,
-                    "phone_number": payment_item.destination_phone_number,
-                    "bank_code": payment_item.destination_bank_code,
-                    "amount": payment_item.amount,
-                    "fee_amount": payment_item.fee_amount,
-                    "status": payment_item.status if hasattr(payment_item, 'status') else 'pending'
-                })
-            
-            response_data = {
-                "mass_payment_id": mass_payment.id,
-                "reference_code": mass_payment.reference_code,
-                "status": mass_payment.status,
-                "total_amount": mass_payment.total_amount,
-                "fee_amount": mass_payment.fee_amount,
-                "created_at": mass_payment.created_at,
-                "recipients_count": len(recipients),
-                "external_recipients_count": sum(1 for r in recipients if r['bank_code'] != initiator_account.bank_code),
-                "estimated_completion_time": timezone.now() + timezone.timedelta(minutes=30),
-                "recipients": payment_items
-            }
-            
-            return Response(response_data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        except (DuplicateReferenceError, InsufficientFundsError, PricingError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(response_data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,10 @@
+from ..services.processing_metrics_services import ProcessingMetrics
+from django.http import HttpResponse
+
+
+def metrics(request):
+    """
+    Processing timings of this process in the Prometheus text format.
+    Payment workers serve theirs with run_payment_workers --metrics-port.
+    """
+    return HttpResponse(ProcessingMetrics.expose(), content_type=ProcessingMetrics.CONTENT_TYPE)
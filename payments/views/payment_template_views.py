@@ -1,4 +1,5 @@
 from ..models import PaymentTemplate
+from ..utils import query_flag
 from ..serializers.payment_template_serializers import (
     PaymentTemplateListSerializer, PaymentTemplateCreateUpdateSerializer, PaymentTemplateDetailSerializer
 )
@@ -29,7 +30,18 @@ class PaymentTemplateViewSet(viewsets.ModelViewSet):
         # return PaymentTemplate.objects.none()
         
         # for now, return all templates
-        return PaymentTemplate.objects.all()
+        queryset = PaymentTemplate.objects.all()
+        if self.action == 'list':
+            queryset = PaymentTemplateListSerializer.annotate_queryset(
+                queryset, include_totals=query_flag(self.request, 'include_totals')
+            )
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['include_totals'] = query_flag(self.request, 'include_totals')
+        return context
     
     # def perform_create(self, serializer):
     #     # Set the owner to the current user
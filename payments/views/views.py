@@ -3,11 +3,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from ..serializers.payment_template_serializers import PaymentTemplateListSerializer
 from ..models import (
-    User, Account, BankProvider,
+    User, Account, BankProvider, BankProviderHealth,
     MassPayment,PaymentTemplate,
 )
 from ..serializers.serializers import (
-    UserSerializer, AccountSerializer, BankProviderSerializer,
+    UserSerializer, AccountSerializer, BankProviderSerializer, BankProviderHealthSerializer,
 )
 from ..serializers.mass_payments_serializers import (
     MassPaymentListSerializer
@@ -21,7 +21,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 class AccountViewSet(viewsets.ModelViewSet):
-    queryset = Account.objects.all()
+    queryset = Account.objects.select_related('user')
     serializer_class = AccountSerializer
     lookup_field = 'account_number'
     
@@ -41,7 +41,9 @@ class AccountViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def payment_templates(self, request, account_number=None):
         account = self.get_object()
-        templates = PaymentTemplate.objects.filter(owner=account.user).order_by('-created_at')
+        templates = PaymentTemplateListSerializer.annotate_queryset(
+            PaymentTemplate.objects.filter(owner=account.user).order_by('-created_at')
+        )
         
         page = self.paginate_queryset(templates)
         if page is not None:
@@ -55,4 +57,23 @@ class AccountViewSet(viewsets.ModelViewSet):
 class BankProviderViewSet(viewsets.ModelViewSet):
     queryset = BankProvider.objects.all()
     serializer_class = BankProviderSerializer
-    lookup_field = 'bank_code'
\ No newline at end of file
+    lookup_field = 'bank_code'
+
+    @action(detail=False, methods=['get'])
+    def circuit_breakers(self, request):
+        """
+        Circuit breaker and rate limit state of every bank provider seen by the dispatcher
+        """
+        health = BankProviderHealth.objects.order_by('bank_code')
+        serializer = BankProviderHealthSerializer(health, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def circuit_breaker(self, request, bank_code=None):
+        provider = self.get_object()
+        health = BankProviderHealth.objects.filter(bank_code=provider.bank_code).first()
+        if health is None:
+            # No transfer sent to this provider yet
+            health = BankProviderHealth(bank_code=provider.bank_code)
+        serializer = BankProviderHealthSerializer(health)
+        return Response(serializer.data)